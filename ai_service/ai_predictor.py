@@ -5,14 +5,19 @@ AI预测服务
 
 import logging
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
 import yaml
 
-from .predictor import ModelPredictor
+from .predictor import ModelPredictor, DEFAULT_BATCH_SIZE
 from .ocr_service import RegistrationOCR
 from .quality import ImageQualityAssessor
 from .hdbscan_service import HDBSCANNewClassDetector
+from .pipeline import PredictionPipeline
+from .result_cache import ResultCache
+from .decoded_image import DecodedImage
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -31,12 +36,34 @@ class AIPredictor:
         # 加载配置
         self.config = self._load_config(config_path)
 
-        # 初始化子模块
-        self.predictor = ModelPredictor(self.config['models'])
-        self.ocr = RegistrationOCR(self.config.get('ocr', {}))
-        self.quality = ImageQualityAssessor(self.config.get('quality', {}))
+        # 批大小：performance.batch_size 为每次送入模型的图片数，
+        # auto_annotate.batch_size 为 predict_batch 每轮解码和回调的图片数
+        performance_config = self.config.get('performance') or {}
+        auto_annotate_config = self.config.get('auto_annotate') or {}
+        self.inference_batch_size = int(performance_config.get('batch_size', DEFAULT_BATCH_SIZE))
+        self.annotate_batch_size = int(auto_annotate_config.get('batch_size', 32))
+
+        # 结果缓存：按图片内容哈希复用分类、OCR、质量评估结果（未启用时为 None）
+        self.result_cache = ResultCache.from_config(self.config.get('result_cache'))
+
+        # 初始化子模块（质量评估器最先创建：配置 quality.workers 时其进程池在构造时 fork，
+        # 此时还没有推理、OCR 等线程）
+        self.quality = ImageQualityAssessor(self.config.get('quality', {}), result_cache=self.result_cache)
+        self.predictor = ModelPredictor(
+            self.config['models'],
+            batch_size=self.inference_batch_size,
+            result_cache=self.result_cache
+        )
+        self.ocr = RegistrationOCR(self.config.get('ocr', {}), result_cache=self.result_cache)
         self.hdbscan = HDBSCANNewClassDetector(self.config.get('hdbscan', {}))
 
+        # 流水线预测：启用时 predict_batch 的解码、推理、OCR、质量评估分阶段并行
+        self.pipeline_config = self.config.get('pipeline') or {}
+
+        # 历史特征来源，签名 (model_version, limit=None) -> (文件名列表, 特征矩阵)，
+        # 由调用方设置（如特征向量存储），用于持久化 HDBSCAN 的拟合
+        self.embedding_history = None
+
         # 模型已加载标志
         self._models_loaded = False
 
@@ -88,68 +115,126 @@ class AIPredictor:
         Returns:
             包含所有预测结果的字典
         """
+        return self.predict_many([image_path])[0]
+
+    def predict_many(
+        self,
+        image_paths: List[str],
+        embeddings: Optional[list] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        预测多张图片
+
+        每张图片只读取和解码一次（DecodedImage），分类、检测、OCR、质量评估共用；
+        分类和检测按 performance.batch_size 批量推理，
+        OCR 请求并发发送（recognize_many），同时质量评估批量进行（assess_many，
+        配置 quality.workers 时在进程池中并行）
+
+        Args:
+            image_paths: 图片文件路径列表
+            embeddings: 传入列表时，按顺序追加每张图片分类时得到的特征向量（失败为 None）
+
+        Returns:
+            与 image_paths 顺序一致的结果列表，失败的图片为 {'filename', 'error'}
+        """
+        if not image_paths:
+            return []
+
+        images = [DecodedImage(image_path) for image_path in image_paths]
+        try:
+            return self._predict_images(image_paths, images, embeddings)
+        finally:
+            # 本轮完成后释放原始字节和像素
+            for image in images:
+                image.release()
+
+    def _predict_images(
+        self,
+        image_paths: List[str],
+        images: List[DecodedImage],
+        embeddings: Optional[list]
+    ) -> List[Dict[str, Any]]:
+        """predict_many 的实现，images 为与 image_paths 对齐的共享图片"""
+        start_time = time.time()
+        try:
+            classification_results = self.predictor.predict_many(images)
+        except Exception as e:
+            import traceback
+            logger.error(f"Error running batch classification for {len(image_paths)} images: {e}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            if embeddings is not None:
+                embeddings.extend([None] * len(image_paths))
+            # 返回错误标记，这样 predict_batch 会捕获
+            return [
+                {'filename': Path(image_path).name, 'error': str(e)}
+                for image_path in image_paths
+            ]
+        # 批量推理的耗时平摊到每张图片
+        classification_time = (time.time() - start_time) / len(image_paths)
+
+        # 特征向量不进入预测结果（结果会写库和返回 JSON）
+        features = [result.pop('embedding', None) for result in classification_results]
+        if embeddings is not None:
+            embeddings.extend(features)
+
+        # OCR 和质量评估：分类成功的图片上同时进行（OCR 在后台线程并发请求，
+        # 有检测框时只发送注册号区域；质量评估在当前线程或进程池中），耗时同样平摊
         start_time = time.time()
+        valid_indices = [
+            i for i, classification_result in enumerate(classification_results)
+            if 'error' not in classification_result
+        ]
+        valid_images = [images[i] for i in valid_indices]
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix='ocr-batch') as executor:
+            ocr_future = executor.submit(
+                self.ocr.recognize_many,
+                valid_images,
+                regions=[self.registration_box(classification_results[i]) for i in valid_indices]
+            )
+            quality_results = dict(zip(valid_indices, self.quality.assess_many(valid_images)))
+            ocr_results = dict(zip(valid_indices, ocr_future.result()))
+        postprocess_time = (time.time() - start_time) / len(valid_indices) if valid_indices else 0.0
+
+        return [
+            self._complete_prediction(
+                image_path, classification_result, ocr_results.get(i), quality_results.get(i),
+                classification_time + postprocess_time
+            )
+            for i, (image_path, classification_result) in enumerate(zip(image_paths, classification_results))
+        ]
+
+    def _complete_prediction(
+        self,
+        image_path: str,
+        classification_result: Dict[str, Any],
+        ocr_result: Optional[Dict[str, Any]],
+        quality_result: Optional[Dict[str, Any]],
+        elapsed_time: float
+    ) -> Dict[str, Any]:
+        """由单张图片的分类、OCR 和质量评估结果生成预测结果"""
         filename = Path(image_path).name
-        logger.info(f"Predicting image: {filename}")
+
+        if 'error' in classification_result:
+            logger.error(f"Error predicting {filename}: {classification_result['error']}")
+            return {
+                'filename': filename,
+                'error': classification_result['error']
+            }
 
         try:
             # 1. 分类预测（机型和航司）
-            logger.debug(f"Starting classification for {filename}")
-            classification_result = self.predictor.predict(image_path)
-            logger.debug(f"Classification result: {classification_result}")
-
-            aircraft_pred = classification_result['aircraft']
-            airline_pred = classification_result['airline']
+            logger.debug(f"Classification result for {filename}: {classification_result}")
 
-            # 2. OCR识别
-            logger.debug(f"Starting OCR recognition for {filename}")
-            ocr_result = self.ocr.recognize(image_path)
+            # 2. OCR识别（已在 predict_many 中并发完成）
             logger.debug(f"OCR result: {ocr_result}")
 
-            # 3. 质量评估（使用 CV 算法）
-            logger.debug(f"Starting quality assessment for {filename}")
-            quality_result = self.quality.assess(image_path)
+            # 3. 质量评估（使用 CV 算法，已在 predict_many 中批量完成）
             logger.debug(f"Quality result: {quality_result}")
 
-            # 4. 从 detection 模型获取 registration_area（检测到的文本区域）
-            registration_area = ''
-            detection_result = classification_result.get('detection')
-            if detection_result and detection_result.get('enabled') and detection_result.get('boxes'):
-                logger.debug(f"Processing detection boxes for {filename}")
-                # 假设第一个检测框是注册号区域，或选择置信度最高的框
-                boxes = detection_result['boxes']
-                if boxes:
-                    best_box = max(boxes, key=lambda x: x['confidence'])
-                    # 使用归一化坐标 xywhn: [x_center, y_center, width, height]
-                    if best_box.get('xywhn'):
-                        xywhn = best_box['xywhn']
-                        registration_area = f"{xywhn[0]:.6f} {xywhn[1]:.6f} {xywhn[2]:.6f} {xywhn[3]:.6f}"
-                        logger.debug(f"Registration area extracted: {registration_area}")
-
-            prediction_time = time.time() - start_time
-
-            # 简化返回结果
-            result = {
-                'filename': Path(image_path).name,
-                'aircraft_class': aircraft_pred['class_name'],
-                'aircraft_confidence': aircraft_pred['confidence'],
-                'airline_class': airline_pred['class_name'],
-                'airline_confidence': airline_pred['confidence'],
-                'registration': ocr_result['registration'],
-                'registration_confidence': ocr_result.get('confidence', 0.0),
-                'registration_area': registration_area,
-                'quality_score': quality_result.get('score', 0.0),
-                'quality_confidence': quality_result.get('score', 0.0),
-                'prediction_time': prediction_time
-            }
-
-            logger.info(f"Prediction completed: {filename} | Aircraft: {aircraft_pred['class_name']}({aircraft_pred['confidence']:.3f}) | "
-                        f"Airline: {airline_pred['class_name']}({airline_pred['confidence']:.3f}) | "
-                        f"Registration: {ocr_result['registration']} | Quality: {quality_result.get('score', 0.0):.3f} | "
-                        f"Time: {prediction_time:.2f}s")
+            return self.build_result(
+                filename, classification_result, ocr_result, quality_result, elapsed_time
+            )
 
-            return result
-        
         except Exception as e:
             import traceback
             logger.error(f"Error predicting {filename}: {e}")
@@ -160,11 +245,68 @@ class AIPredictor:
                 'error': str(e)
             }
 
+    @staticmethod
+    def registration_box(classification_result: Dict[str, Any]) -> Optional[List[float]]:
+        """
+        detection 模型检测到的注册号区域（置信度最高的框）
+
+        Returns:
+            归一化坐标 xywhn: [x_center, y_center, width, height]，未检测到时返回 None
+        """
+        detection_result = classification_result.get('detection')
+        if not (detection_result and detection_result.get('enabled') and detection_result.get('boxes')):
+            return None
+        best_box = max(detection_result['boxes'], key=lambda x: x['confidence'])
+        return best_box.get('xywhn') or None
+
+    def build_result(
+        self,
+        filename: str,
+        classification_result: Dict[str, Any],
+        ocr_result: Dict[str, Any],
+        quality_result: Dict[str, Any],
+        prediction_time: float
+    ) -> Dict[str, Any]:
+        """合并分类、OCR、质量评估结果为预测结果"""
+        aircraft_pred = classification_result['aircraft']
+        airline_pred = classification_result['airline']
+
+        # 从 detection 模型获取 registration_area（检测到的文本区域）
+        registration_area = ''
+        xywhn = self.registration_box(classification_result)
+        if xywhn:
+            registration_area = f"{xywhn[0]:.6f} {xywhn[1]:.6f} {xywhn[2]:.6f} {xywhn[3]:.6f}"
+            logger.debug(f"Registration area extracted for {filename}: {registration_area}")
+
+        # 简化返回结果
+        result = {
+            'filename': filename,
+            'aircraft_class': aircraft_pred['class_name'],
+            'aircraft_confidence': aircraft_pred['confidence'],
+            'airline_class': airline_pred['class_name'],
+            'airline_confidence': airline_pred['confidence'],
+            'registration': ocr_result['registration'],
+            'registration_confidence': ocr_result.get('confidence', 0.0),
+            'registration_area': registration_area,
+            'quality_score': quality_result.get('score', 0.0),
+            'quality_confidence': quality_result.get('score', 0.0),
+            'quality_pass': quality_result.get('pass', False),
+            'prediction_time': prediction_time
+        }
+
+        logger.info(f"Prediction completed: {filename} | Aircraft: {aircraft_pred['class_name']}({aircraft_pred['confidence']:.3f}) | "
+                    f"Airline: {airline_pred['class_name']}({airline_pred['confidence']:.3f}) | "
+                    f"Registration: {ocr_result['registration']} | Quality: {quality_result.get('score', 0.0):.3f} | "
+                    f"Time: {prediction_time:.2f}s")
+
+        return result
+
     def predict_batch(
         self,
         image_paths: List[str],
         detect_new_classes: bool = True,
-        on_prediction_callback = None
+        on_prediction_callback = None,
+        on_embeddings_callback = None
     ) -> Dict[str, Any]:
         """
         批量预测（懒加载模型）
@@ -172,67 +314,61 @@ class AIPredictor:
         Args:
             image_paths: 图片路径列表
             detect_new_classes: 是否检测新类别
-            on_prediction_callback: 预测完成回调，接收(index, result)参数，可用于实时保存到数据库
+            on_prediction_callback: 预测完成回调，接收(index, result)参数，可用于实时保存到数据库；
+                                    总在调用线程中串行调用，启用流水线时按完成顺序而非输入顺序
+            on_embeddings_callback: 每轮预测完成后回调，接收(model_version, filenames, embeddings)参数，
+                                    可用于写入特征向量存储（只包含预测成功的图片）
 
         Returns:
             包含所有预测结果和新类别检测结果的字典
         """
         logger.info(f"predict_batch called with {len(image_paths)} images")
 
-        # 移除提前加载模型的逻辑，让模型在 predict_single 中懒加载
-        # if not self._models_loaded:
-        #     logger.info("Models not loaded, loading now...")
-        #     try:
-        #         self.load_models()
-        #     except Exception as e:
-        #         logger.error(f"Failed to load models: {e}")
-        #         raise
+        # 模型在首次推理时懒加载
 
         logger.info(f"Predicting batch of {len(image_paths)} images...")
 
-        predictions = []
-        for i, image_path in enumerate(image_paths):
-            try:
-                logger.info(f"Processing image {i+1}/{len(image_paths)}: {image_path}")
-                result = self.predict_single(image_path)
-                predictions.append(result)
-
-                # 实时回调（用于流式保存到数据库）
-                if on_prediction_callback and 'error' not in result:
-                    try:
-                        on_prediction_callback(i, result)
-                    except Exception as e:
-                        logger.error(f"Error in prediction callback for {result.get('filename')}: {e}")
-
-                if (i + 1) % 10 == 0:
-                    logger.info(f"Processed {i + 1}/{len(image_paths)} images")
-            except Exception as e:
-                logger.error(f"Error processing {image_path}: {e}")
-                # 添加错误记录
-                predictions.append({
-                    'filename': Path(image_path).name,
-                    'error': str(e),
-                    'aircraft_class': '',
-                    'aircraft_confidence': 0.0,
-                    'airline_class': '',
-                    'airline_confidence': 0.0
-                })
+        collect_embeddings = detect_new_classes or on_embeddings_callback is not None
+        if self.pipeline_config.get('enabled', False):
+            predictions, embedding_list = self._predict_pipelined(
+                image_paths, collect_embeddings, on_prediction_callback, on_embeddings_callback
+            )
+        else:
+            predictions, embedding_list = self._predict_chunked(
+                image_paths, collect_embeddings, on_prediction_callback, on_embeddings_callback
+            )
 
         # 新类别检测
         new_class_indices = []
         if detect_new_classes:
-            # 获取embeddings用于HDBSCAN聚类
-            embeddings = self.predictor.get_embeddings(image_paths)
-            new_class_indices = self.hdbscan.detect_new_classes(predictions, embeddings=embeddings)
-
-        # 标记新类别
-        for i, idx in enumerate(new_class_indices):
-            if idx < len(predictions):
-                predictions[idx]['is_new_class'] = 1
-                # 获取异常分数
-                outlier_scores = self.hdbscan.get_outlier_scores()
+            # 使用分类推理时捕获的embeddings进行HDBSCAN聚类；
+            # 已知特征的模型版本时由持久化聚类器增量打分。
+            # 推理失败的图片没有特征向量，不参与拟合、打分和漂移统计
+            embeddings, rows = self._stack_embeddings(embedding_list)
+            if embeddings is None:
+                rows = list(range(len(predictions)))
+            model_version = self._embedding_model_version() if embeddings is not None else None
+            history_provider = None
+            if model_version is not None and self.embedding_history is not None:
+                def load_history():
+                    return self.embedding_history(model_version, limit=self.hdbscan.max_fit_samples)
+                history_provider = load_history
+            labels, outlier_scores = self.hdbscan.detect_new_classes(
+                [predictions[row] for row in rows],
+                embeddings=embeddings,
+                model_version=model_version,
+                history_provider=history_provider
+            )
+
+            # 标记新类别（检测结果的下标映射回预测结果）
+            for idx in self.hdbscan.new_class_indices(labels):
+                if idx >= len(rows):
+                    continue
+                prediction = predictions[rows[idx]]
+                prediction['is_new_class'] = 1
                 if idx < len(outlier_scores):
-                    predictions[idx]['outlier_score'] = float(outlier_scores[idx])
+                    prediction['outlier_score'] = float(outlier_scores[idx])
+                new_class_indices.append(rows[idx])
 
         # 默认值
         for pred in predictions:
@@ -262,10 +398,168 @@ class AIPredictor:
             'statistics': stats
         }
 
+    def _predict_chunked(
+        self,
+        image_paths: List[str],
+        collect_embeddings: bool,
+        on_prediction_callback,
+        on_embeddings_callback
+    ) -> tuple:
+        """
+        逐轮预测：每轮 annotate_batch_size 张图片交给 predict_many，分类和检测按 inference_batch_size
+        批量推理，OCR 请求并发发送，同时质量评估批量进行
+
+        Returns:
+            (预测结果列表, 与之对齐的特征向量列表；collect_embeddings 为 False 时为 None)
+        """
+        # 机型分类时顺带取得的特征向量直接用于新类别检测
+        predictions = []
+        embedding_list = [] if collect_embeddings else None
+        chunk_size = max(1, self.annotate_batch_size)
+        for start in range(0, len(image_paths), chunk_size):
+            chunk = image_paths[start:start + chunk_size]
+            try:
+                logger.info(f"Processing images {start + 1}-{start + len(chunk)}/{len(image_paths)}")
+                chunk_embeddings = [] if collect_embeddings else None
+                chunk_results = self.predict_many(chunk, embeddings=chunk_embeddings)
+            except Exception as e:
+                logger.error(f"Error processing images {start + 1}-{start + len(chunk)}: {e}")
+                chunk_results = [{'error': str(e)} for _ in chunk]
+                chunk_embeddings = [None] * len(chunk) if collect_embeddings else None
+            if embedding_list is not None:
+                embedding_list.extend(chunk_embeddings)
+            if on_embeddings_callback is not None:
+                self._emit_embeddings(on_embeddings_callback, chunk_results, chunk_embeddings)
+
+            for offset, (image_path, result) in enumerate(zip(chunk, chunk_results)):
+                if 'error' in result:
+                    result = self._failed_prediction(image_path, result['error'])
+                predictions.append(result)
+
+                # 实时回调（用于流式保存到数据库）
+                self._notify_prediction(on_prediction_callback, start + offset, result)
+
+            logger.info(f"Processed {len(predictions)}/{len(image_paths)} images")
+
+        return predictions, embedding_list
+
+    def _predict_pipelined(
+        self,
+        image_paths: List[str],
+        collect_embeddings: bool,
+        on_prediction_callback,
+        on_embeddings_callback
+    ) -> tuple:
+        """
+        流水线预测：解码、推理、OCR、质量评估分阶段并行（见 PredictionPipeline），
+        回调在当前线程中按完成顺序调用，特征向量每满 annotate_batch_size 张交给回调一次
+
+        Returns:
+            (预测结果列表, 与之对齐的特征向量列表；collect_embeddings 为 False 时为 None)
+        """
+        embedding_list = [None] * len(image_paths) if collect_embeddings else None
+        pending_results, pending_embeddings = [], []
+
+        def on_result(index, result, embedding):
+            if embedding_list is not None:
+                embedding_list[index] = embedding
+            if on_embeddings_callback is not None and 'error' not in result and embedding is not None:
+                pending_results.append(result)
+                pending_embeddings.append(embedding)
+                if len(pending_results) >= max(1, self.annotate_batch_size):
+                    self._emit_embeddings(on_embeddings_callback, pending_results, pending_embeddings)
+                    pending_results.clear()
+                    pending_embeddings.clear()
+            if 'error' not in result:
+                self._notify_prediction(on_prediction_callback, index, result)
+
+        results = PredictionPipeline(self, self.pipeline_config).run(image_paths, on_result=on_result)
+        if pending_results:
+            self._emit_embeddings(on_embeddings_callback, pending_results, pending_embeddings)
+
+        predictions = [
+            self._failed_prediction(image_path, result['error']) if 'error' in result else result
+            for image_path, result in zip(image_paths, results)
+        ]
+        return predictions, embedding_list
+
+    @staticmethod
+    def _failed_prediction(image_path: str, error: str) -> Dict[str, Any]:
+        """失败图片的预测记录"""
+        return {
+            'filename': Path(image_path).name,
+            'error': error,
+            'aircraft_class': '',
+            'aircraft_confidence': 0.0,
+            'airline_class': '',
+            'airline_confidence': 0.0
+        }
+
+    @staticmethod
+    def _notify_prediction(callback, index: int, result: Dict[str, Any]):
+        """预测成功时调用回调（用于流式保存到数据库），回调异常不影响后续预测"""
+        if callback is None or 'error' in result:
+            return
+        try:
+            callback(index, result)
+        except Exception as e:
+            logger.error(f"Error in prediction callback for {result.get('filename')}: {e}")
+
+    def _embedding_model_version(self) -> Optional[str]:
+        """特征向量的模型版本，无法确定时返回 None"""
+        try:
+            return self.predictor.embedding_model_version
+        except Exception as e:
+            logger.warning(f"Cannot determine embedding model version: {e}")
+            return None
+
+    def _emit_embeddings(self, callback, results: list, embeddings: list):
+        """把一轮预测成功图片的特征向量交给回调"""
+        pairs = [
+            (result['filename'], embedding)
+            for result, embedding in zip(results, embeddings)
+            if 'error' not in result and embedding is not None
+        ]
+        if not pairs:
+            return
+        model_version = self._embedding_model_version()
+        if model_version is None:
+            return
+        try:
+            callback(
+                model_version,
+                [filename for filename, _ in pairs],
+                np.vstack([embedding for _, embedding in pairs])
+            )
+        except Exception as e:
+            logger.error(f"Error in embeddings callback: {e}")
+
+    @staticmethod
+    def _stack_embeddings(embedding_list: list) -> Tuple[Optional[np.ndarray], List[int]]:
+        """
+        将各图片的特征向量堆叠为矩阵
+
+        失败图片没有特征向量，不计入矩阵；
+        全部缺失时返回 (None, [])（HDBSCAN 退化为使用置信度特征）
+
+        Returns:
+            (特征矩阵, 矩阵各行对应的预测结果下标)
+        """
+        rows = [i for i, embedding in enumerate(embedding_list) if embedding is not None]
+        if not rows:
+            return None, []
+        return np.vstack([embedding_list[i] for i in rows]), rows
+
     def get_config(self) -> Dict[str, Any]:
         """获取当前配置"""
         return self.config
 
+    def get_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """获取结果缓存统计，未启用缓存时返回 None"""
+        if self.result_cache is None:
+            return None
+        return self.result_cache.get_stats()
+
     def is_enabled(self, service: str) -> bool:
         """
         检查特定服务是否启用
@@ -0,0 +1,158 @@
+"""
+单次预测共享的图片对象
+文件只读取一次、只解码一次，分类、检测、OCR、质量评估和结果缓存都从同一个 DecodedImage 取数据：
+
+- data: 文件原始字节（OCR 发送原图、内容哈希、降采样解码都基于它）
+- size / format / mime_type: 从文件头解析，不解码像素
+- bgr / rgb: 解码后的像素（按 EXIF 方向旋转，与 cv2.imread 一致），rgb 为 bgr 的视图
+
+传入进程池时已解码的图片只序列化路径和像素（接收方不再解码），未解码的图片只序列化路径和原始字节
+"""
+
+import io
+import hashlib
+import threading
+from typing import Optional, Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+# PIL 格式到 MIME 类型
+MIME_TYPES = {
+    'jpeg': 'image/jpeg',
+    'jpg': 'image/jpeg',
+    'png': 'image/png',
+    'gif': 'image/gif',
+    'bmp': 'image/bmp',
+    'webp': 'image/webp'
+}
+
+
+def content_hasher():
+    """图片内容哈希算法（结果缓存的键，文件哈希与 DecodedImage.content_hash 一致）"""
+    return hashlib.blake2b(digest_size=20)
+
+
+class DecodedImage:
+    """按需读取、按需解码并缓存的图片"""
+
+    def __init__(self, path: str):
+        """
+        Args:
+            path: 图片文件路径（只在首次访问数据时读取）
+        """
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._data: Optional[bytes] = None
+        self._read = False
+        self._header: Optional[Tuple[Tuple[int, int], Optional[str]]] = None
+        self._bgr: Optional[np.ndarray] = None
+        self._decoded = False
+        self._content_hash: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return f"DecodedImage({self.path!r})"
+
+    def __getstate__(self):
+        # 已解码时传递像素，接收方无需再次解码（原始字节需要时从文件重新读取）；
+        # 否则传递原始字节，由接收方解码
+        with self._lock:
+            if self._decoded:
+                return {'path': self.path, 'bgr': self._bgr}
+        return {'path': self.path, 'data': self.data}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+        if 'bgr' in state:
+            self._bgr = state['bgr']
+            self._decoded = True
+        else:
+            self._data = state['data']
+            self._read = True
+
+    @property
+    def data(self) -> Optional[bytes]:
+        """文件原始字节，无法读取或为空文件时为 None"""
+        with self._lock:
+            if not self._read:
+                try:
+                    with open(self.path, 'rb') as f:
+                        self._data = f.read() or None
+                except OSError:
+                    self._data = None
+                self._read = True
+            return self._data
+
+    def _parse_header(self) -> Tuple[Optional[Tuple[int, int]], Optional[str]]:
+        if self._header is None:
+            data = self.data
+            size, img_format = None, None
+            if data is not None:
+                try:
+                    with Image.open(io.BytesIO(data)) as img:
+                        size, img_format = img.size, (img.format or '').lower() or None
+                except Exception:
+                    pass
+            self._header = (size, img_format)
+        return self._header
+
+    @property
+    def size(self) -> Optional[Tuple[int, int]]:
+        """文件中存储的尺寸 (宽, 高)（未按 EXIF 方向旋转），无法解析时为 None"""
+        return self._parse_header()[0]
+
+    @property
+    def format(self) -> Optional[str]:
+        """图片格式（小写，如 'jpeg'、'png'）"""
+        return self._parse_header()[1]
+
+    @property
+    def mime_type(self) -> str:
+        return MIME_TYPES.get(self.format or 'jpeg', 'image/jpeg')
+
+    @property
+    def is_decoded(self) -> bool:
+        """像素是否已经解码"""
+        return self._decoded
+
+    @property
+    def bgr(self) -> Optional[np.ndarray]:
+        """解码后的 BGR 像素（只解码一次），无法解码时为 None；调用方不应修改"""
+        data = self.data
+        with self._lock:
+            if not self._decoded:
+                if data is not None:
+                    self._bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+                self._decoded = True
+            return self._bgr
+
+    @property
+    def rgb(self) -> Optional[np.ndarray]:
+        """RGB 像素（bgr 的视图，不复制）"""
+        bgr = self.bgr
+        return None if bgr is None else bgr[:, :, ::-1]
+
+    @property
+    def content_hash(self) -> Optional[str]:
+        """原始字节的内容哈希，无法读取时为 None"""
+        if self._content_hash is None:
+            data = self.data
+            if data is not None:
+                hasher = content_hasher()
+                hasher.update(data)
+                self._content_hash = hasher.hexdigest()
+        return self._content_hash
+
+    def release(self):
+        """释放原始字节和像素（预测完成后调用，之后再访问会重新读取）"""
+        with self._lock:
+            self._data = None
+            self._read = False
+            self._bgr = None
+            self._decoded = False
+
+
+def source_path(image) -> str:
+    """图片路径（DecodedImage 或路径）"""
+    return image.path if isinstance(image, DecodedImage) else str(image)
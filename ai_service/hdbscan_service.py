@@ -1,10 +1,20 @@
 """
 HDBSCAN新类别检测服务
 使用HDBSCAN聚类识别新类别
+
+提供特征向量模型版本时使用持久化的聚类器：在历史特征上拟合一次并保存到磁盘，
+新图片用 approximate_predict / approximate_predict_scores 打分（与批量大小线性相关）；
+新图片中噪声点比例相对拟合时的漂移超过阈值后在后台重新拟合
+
+聚类前可选降维（PCA / 随机投影）和 L2 归一化，降维器与聚类器一起拟合和保存
 """
 
+import os
+import time
+import pickle
 import logging
-from typing import Dict, Any, List, Optional
+import threading
+from typing import Callable, Dict, Any, List, Optional, Tuple
 import numpy as np
 
 # 检查hdbscan是否可用
@@ -19,6 +29,109 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+# 支持的降维方法
+REDUCTION_METHODS = ("none", "pca", "random_projection")
+
+
+class EmbeddingReducer:
+    """聚类前的特征降维（PCA / 高斯随机投影）和 L2 归一化"""
+
+    def __init__(self, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化降维器
+
+        Args:
+            config: hdbscan.reduction 配置（method、n_components、normalize、random_state）
+        """
+        config = config or {}
+        self.method = config.get('method', 'none')
+        if self.method not in REDUCTION_METHODS:
+            raise ValueError(f"Unsupported reduction method: {self.method}")
+        self.n_components = config.get('n_components', 64)
+        self.normalize = config.get('normalize', False)
+        self.random_state = config.get('random_state', 0)
+
+        # 拟合时的输入维度和投影参数（mean 仅 PCA 使用）
+        self.input_dim: Optional[int] = None
+        self._mean: Optional[np.ndarray] = None
+        self._components: Optional[np.ndarray] = None
+
+    @property
+    def enabled(self) -> bool:
+        """是否对特征做任何变换"""
+        return self.method != 'none' or self.normalize
+
+    def is_fitted_for(self, dim: int) -> bool:
+        """是否已针对该输入维度拟合"""
+        return self.input_dim == dim
+
+    def fit(self, embeddings: np.ndarray) -> 'EmbeddingReducer':
+        """
+        拟合投影矩阵
+
+        Args:
+            embeddings: (n, dim) 特征矩阵
+        """
+        embeddings = self._normalize(np.asarray(embeddings, dtype=np.float64))
+        n_samples, dim = embeddings.shape
+        self.input_dim = dim
+        self._mean = None
+        self._components = None
+
+        if self.method == 'pca':
+            n_components = min(self.n_components, n_samples, dim)
+            if n_components < dim:
+                self._mean = embeddings.mean(axis=0)
+                # 经济型 SVD：右奇异向量即主成分方向
+                _, _, vt = np.linalg.svd(embeddings - self._mean, full_matrices=False)
+                self._components = vt[:n_components].T
+        elif self.method == 'random_projection' and self.n_components < dim:
+            rng = np.random.default_rng(self.random_state)
+            self._components = rng.normal(
+                0.0, 1.0 / np.sqrt(self.n_components), size=(dim, self.n_components)
+            )
+
+        return self
+
+    def transform(self, embeddings: np.ndarray) -> np.ndarray:
+        """
+        降维并归一化
+
+        Args:
+            embeddings: (n, input_dim) 特征矩阵
+
+        Returns:
+            变换后的特征矩阵；未启用时原样返回
+        """
+        if not self.enabled:
+            return embeddings
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+        if self.input_dim is not None and embeddings.shape[1] != self.input_dim:
+            raise ValueError(
+                f"Embedding dim {embeddings.shape[1]} does not match reducer dim {self.input_dim}"
+            )
+
+        embeddings = self._normalize(embeddings)
+        if self._components is not None:
+            if self._mean is not None:
+                embeddings = embeddings - self._mean
+            embeddings = self._normalize(embeddings @ self._components)
+        return embeddings
+
+    def fit_transform(self, embeddings: np.ndarray) -> np.ndarray:
+        """拟合并变换"""
+        if not self.enabled:
+            return embeddings
+        return self.fit(embeddings).transform(embeddings)
+
+    def _normalize(self, embeddings: np.ndarray) -> np.ndarray:
+        """按行 L2 归一化（零向量保持不变）"""
+        if not self.normalize:
+            return embeddings
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        return embeddings / np.maximum(norms, 1e-12)
+
+
 class HDBSCANNewClassDetector:
     """HDBSCAN新类别检测器"""
 
@@ -36,11 +149,30 @@ class HDBSCANNewClassDetector:
         self.cluster_selection_method = config.get('cluster_selection_method', 'eom')
         self.prediction_data = config.get('prediction_data', True)
 
-        self._clusterer = None
-        self._labels: Optional[np.ndarray] = None
-        self._outlier_scores: Optional[np.ndarray] = None
+        # 持久化聚类器配置
+        self.model_path = config.get('model_path', '')
+        self.min_fit_samples = config.get('min_fit_samples', 50)
+        self.max_fit_samples = config.get('max_fit_samples', 20000)
+        self.drift_window = config.get('drift_window', 200)
+        self.refit_drift_threshold = config.get('refit_drift_threshold', 0.15)
+        self.reduction_config = config.get('reduction') or {}
+
+        # 持久化聚类器及其信息（embedding_model、dim、n_samples、noise_ratio、fitted_at）
+        self._model = None
+        # 与持久化聚类器配套的降维器（拟合时一并拟合、保存）
+        self._model_reducer: Optional[EmbeddingReducer] = None
+        self._model_info: Optional[Dict[str, Any]] = None
+        # 拟合后新打分样本的数量和其中的噪声点数量（用于计算漂移）
+        self._scored = 0
+        self._scored_noise = 0
+        self._model_lock = threading.Lock()
+        self._refit_thread: Optional[threading.Thread] = None
+
+        # 当前的降维配置（按批聚类时每批用它重新拟合，持久化聚类器据此判断是否需要重新拟合）
+        self._reducer = EmbeddingReducer(self.reduction_config)
 
         if self.enabled:
+            self._load_model()
             logger.info(f"HDBSCANNewClassDetector initialized")
         else:
             logger.info("HDBSCANNewClassDetector disabled")
@@ -48,42 +180,67 @@ class HDBSCANNewClassDetector:
     def detect_new_classes(
         self,
         predictions: List[Dict[str, Any]],
-        embeddings: Optional[np.ndarray] = None
-    ) -> List[int]:
+        embeddings: Optional[np.ndarray] = None,
+        model_version: Optional[str] = None,
+        history_provider: Optional[Callable[[], Tuple[list, np.ndarray]]] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
         """
         检测新类别
 
+        结果只通过返回值给出（不保存在实例上），多个批次可以并发检测
+
         Args:
             predictions: 预测结果列表
             embeddings: 特征嵌入（可选，如果为None则使用预测置信度）
+            model_version: 生成 embeddings 的模型版本；提供时使用持久化聚类器增量打分，
+                           否则在本批数据上重新聚类
+            history_provider: 返回历史特征 (文件名列表, 特征矩阵) 的回调，
+                              用于首次拟合和漂移后的重新拟合
 
         Returns:
-            新类别的索引列表
+            (簇标签, 离群分数)，与 predictions 一一对应；标签为 -1 的样本为潜在新类别
+            （见 new_class_indices）。未启用时标签和分数全为 0
         """
-        if not self.enabled:
-            return []
+        n_samples = len(predictions)
+        if not self.enabled or n_samples == 0:
+            return np.zeros(n_samples, dtype=int), np.zeros(n_samples)
 
-        if len(predictions) == 0:
-            return []
-
-        logger.info(f"Detecting new classes from {len(predictions)} predictions...")
+        logger.info(f"Detecting new classes from {n_samples} predictions...")
 
         # 使用置信度作为嵌入（如果未提供）
         if embeddings is None:
             embeddings = self._extract_confidence_features(predictions)
-
-        # 聚类
-        self._cluster_embeddings(embeddings)
-
-        # 获取异常点索引
-        outlier_indices = np.where(self._labels == -1)[0]
-
+            model_version = None
+
+        if model_version is not None:
+            scored = self._score_incremental(predictions, embeddings, model_version, history_provider)
+            if scored is not None:
+                labels, outlier_scores = scored
+                n_noise = int(np.sum(labels == -1))
+                logger.info(
+                    f"Found {n_noise} potential new class samples "
+                    f"({n_noise/n_samples*100:.1f}%) with persistent clusterer"
+                )
+                return labels, outlier_scores
+
+        # 聚类（置信度特征只有一维，不做降维）；降维器在本批上拟合，
+        # 避免沿用首批样本数限制下的成分数
+        if model_version is not None and self._reducer.enabled:
+            embeddings = EmbeddingReducer(self.reduction_config).fit_transform(embeddings)
+        labels, outlier_scores = self._cluster_embeddings(embeddings)
+
+        n_noise = int(np.sum(labels == -1))
         logger.info(
-            f"Found {len(outlier_indices)} potential new class samples "
-            f"({len(outlier_indices)/len(predictions)*100:.1f}%)"
+            f"Found {n_noise} potential new class samples "
+            f"({n_noise/n_samples*100:.1f}%)"
         )
 
-        return outlier_indices.tolist()
+        return labels, outlier_scores
+
+    @staticmethod
+    def new_class_indices(labels: np.ndarray) -> List[int]:
+        """检测结果中潜在新类别（噪声点）的索引列表"""
+        return np.where(np.asarray(labels) == -1)[0].tolist()
 
     def _extract_confidence_features(self, predictions: List[Dict[str, Any]]) -> np.ndarray:
         """
@@ -123,11 +280,248 @@ class HDBSCANNewClassDetector:
 
         return np.array(features)
 
-    def _cluster_embeddings(self, embeddings: np.ndarray):
-        """使用HDBSCAN聚类嵌入"""
+    # ==================== 持久化聚类器 ====================
+
+    def _score_incremental(
+        self,
+        predictions: List[Dict[str, Any]],
+        embeddings: np.ndarray,
+        model_version: str,
+        history_provider: Optional[Callable[[], Tuple[list, np.ndarray]]]
+    ) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        使用持久化聚类器为本批样本打分，返回 (簇标签, 离群分数)
+
+        没有可用的聚类器（或模型版本、维度、降维配置与之不符）时先在历史特征 + 本批特征上拟合；
+        样本不足时返回 None，
+        由调用方退回到按批聚类
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+
+        with self._model_lock:
+            if self._model is None:
+                self._load_model()
+            model = self._model
+            reducer = self._model_reducer
+            info = self._model_info
+        if (model is None or info['embedding_model'] != model_version
+                or info['dim'] != embeddings.shape[1]
+                or not self._reduction_matches(info)):
+            fit_data = self._collect_fit_data(predictions, embeddings, history_provider)
+            if len(fit_data) < self.min_fit_samples:
+                return None
+            self.fit(fit_data, model_version)
+            with self._model_lock:
+                model = self._model
+                reducer = self._model_reducer
+
+        if reducer is not None:
+            embeddings = reducer.transform(embeddings)
+        labels, _ = hdbscan.approximate_predict(model, embeddings)
+        labels = np.asarray(labels)
+        # 离群程度：GLOSH 分数（噪声点的隶属强度都为 0，不能用来区分噪声点之间的离群程度），
+        # 近似值可能略超出 [0, 1]，截断到与按批聚类 outlier_scores_ 相同的范围
+        scores = np.nan_to_num(np.asarray(hdbscan.approximate_predict_scores(model, embeddings),
+                                          dtype=np.float64), nan=1.0)
+        outlier_scores = np.clip(scores, 0.0, 1.0)
+
+        self._update_drift(int(np.sum(labels == -1)), len(labels), history_provider)
+        return labels, outlier_scores
+
+    def _reduction_matches(self, info: Dict[str, Any]) -> bool:
+        """聚类器拟合时的降维配置（方法、成分数、归一化）与当前配置是否一致"""
+        if info.get('reduction', 'none') != self._reducer.method:
+            return False
+        if info.get('normalize', False) != self._reducer.normalize:
+            return False
+        # 不降维时成分数不起作用
+        return self._reducer.method == 'none' or info.get('n_components') == self._reducer.n_components
+
+    def _collect_fit_data(
+        self,
+        predictions: List[Dict[str, Any]],
+        embeddings: np.ndarray,
+        history_provider: Optional[Callable[[], Tuple[list, np.ndarray]]]
+    ) -> np.ndarray:
+        """合并历史特征和本批特征（历史中已包含的本批文件不重复计入）"""
+        parts = [embeddings]
+        if history_provider is not None:
+            try:
+                filenames, history = history_provider()
+            except Exception as e:
+                logger.error(f"Failed to load historical embeddings: {e}")
+                filenames, history = [], None
+            if history is not None and len(history) and history.shape[1] == embeddings.shape[1]:
+                batch_names = {pred.get('filename') for pred in predictions}
+                keep = [i for i, name in enumerate(filenames) if name not in batch_names]
+                parts.insert(0, np.asarray(history[keep], dtype=np.float64))
+
+        data = np.vstack(parts)
+        if len(data) > self.max_fit_samples:
+            rng = np.random.default_rng(0)
+            data = data[np.sort(rng.choice(len(data), self.max_fit_samples, replace=False))]
+        return data
+
+    def fit(self, embeddings: np.ndarray, model_version: str):
+        """
+        拟合持久化聚类器并保存到 model_path
+
+        Args:
+            embeddings: 拟合用的特征矩阵
+            model_version: 特征对应的模型版本（版本标记，版本变化后需要重新拟合）
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float64)
+        logger.info(f"Fitting persistent HDBSCAN on {len(embeddings)} samples ({model_version})...")
+        start_time = time.time()
+
+        reducer = EmbeddingReducer(self.reduction_config)
+        dim = int(embeddings.shape[1])
+        embeddings = reducer.fit_transform(embeddings)
+
+        model = hdbscan.HDBSCAN(
+            min_cluster_size=self.min_cluster_size,
+            min_samples=self.min_samples,
+            metric=self.metric,
+            cluster_selection_method=self.cluster_selection_method,
+            prediction_data=True
+        )
+        model.fit(embeddings)
+
+        labels = np.asarray(model.labels_)
+        info = {
+            'embedding_model': model_version,
+            'dim': dim,
+            'reduction': reducer.method,
+            'n_components': reducer.n_components,
+            'normalize': reducer.normalize,
+            'reduced_dim': int(embeddings.shape[1]),
+            'n_samples': int(len(embeddings)),
+            'noise_ratio': float(np.mean(labels == -1)) if len(labels) else 0.0,
+            'fitted_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+        with self._model_lock:
+            self._model = model
+            self._model_reducer = reducer
+            self._model_info = info
+            self._scored = 0
+            self._scored_noise = 0
+        self._save_model(model, reducer, info)
+
+        logger.info(
+            f"Persistent HDBSCAN fitted in {time.time() - start_time:.1f}s: "
+            f"noise_ratio={info['noise_ratio']:.3f}"
+        )
+
+    def _update_drift(
+        self,
+        n_noise: int,
+        n_total: int,
+        history_provider: Optional[Callable[[], Tuple[list, np.ndarray]]]
+    ):
+        """累计新样本的噪声比例，漂移超过阈值时在后台重新拟合"""
+        with self._model_lock:
+            self._scored += n_total
+            self._scored_noise += n_noise
+            drift = self.get_drift()
+
+        if drift is None or drift < self.refit_drift_threshold:
+            return
+        if history_provider is None:
+            logger.warning(f"HDBSCAN drift {drift:.3f} exceeds threshold but no history is available for refit")
+            return
+        self.refit_async(history_provider)
+
+    def get_drift(self) -> Optional[float]:
+        """
+        新样本噪声比例相对拟合时的增量
+
+        打分样本少于 drift_window 时返回 None
+        """
+        if self._model_info is None or self._scored < self.drift_window:
+            return None
+        return self._scored_noise / self._scored - self._model_info['noise_ratio']
+
+    def refit_async(self, history_provider: Callable[[], Tuple[list, np.ndarray]]) -> bool:
+        """
+        在后台线程中用历史特征重新拟合（已有重新拟合在执行时不重复启动）
+
+        Returns:
+            是否启动了重新拟合
+        """
+        with self._model_lock:
+            if self._refit_thread is not None and self._refit_thread.is_alive():
+                return False
+            model_version = self._model_info['embedding_model'] if self._model_info else None
+            if model_version is None:
+                return False
+            self._refit_thread = threading.Thread(
+                target=self._refit, args=(history_provider, model_version), daemon=True
+            )
+            self._refit_thread.start()
+        logger.info(f"Started background HDBSCAN refit for {model_version}")
+        return True
+
+    def _refit(self, history_provider: Callable[[], Tuple[list, np.ndarray]], model_version: str):
+        """后台重新拟合（旧聚类器在新聚类器就绪前继续使用）"""
+        try:
+            _, history = history_provider()
+            if history is None or len(history) < self.min_fit_samples:
+                logger.warning("Not enough historical embeddings for HDBSCAN refit")
+                return
+            history = np.asarray(history, dtype=np.float64)
+            if len(history) > self.max_fit_samples:
+                rng = np.random.default_rng(0)
+                history = history[np.sort(rng.choice(len(history), self.max_fit_samples, replace=False))]
+            self.fit(history, model_version)
+        except Exception as e:
+            logger.error(f"Background HDBSCAN refit failed: {e}")
+
+    def get_model_info(self) -> Optional[Dict[str, Any]]:
+        """获取持久化聚类器信息（含当前漂移）"""
+        with self._model_lock:
+            if self._model_info is None:
+                return None
+            info = dict(self._model_info)
+            info['scored_since_fit'] = self._scored
+            info['drift'] = self.get_drift()
+        return info
+
+    def _save_model(self, model, reducer: EmbeddingReducer, info: Dict[str, Any]):
+        """保存聚类器（先写临时文件再替换，避免读到半个文件）"""
+        if not self.model_path:
+            return
+        try:
+            directory = os.path.dirname(self.model_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.model_path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({'info': info, 'model': model, 'reducer': reducer}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.model_path)
+            logger.info(f"Persistent HDBSCAN saved to {self.model_path}")
+        except Exception as e:
+            logger.error(f"Failed to save HDBSCAN model: {e}")
+
+    def _load_model(self):
+        """加载已保存的聚类器"""
+        if not self.model_path or not os.path.exists(self.model_path):
+            return
+        try:
+            with open(self.model_path, 'rb') as f:
+                saved = pickle.load(f)
+            self._model = saved['model']
+            self._model_reducer = saved.get('reducer')
+            self._model_info = saved['info']
+            logger.info(f"Persistent HDBSCAN loaded: {self._model_info}")
+        except Exception as e:
+            logger.error(f"Failed to load HDBSCAN model from {self.model_path}: {e}")
+
+    def _cluster_embeddings(self, embeddings: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """使用HDBSCAN聚类嵌入，返回 (簇标签, 离群分数)"""
         logger.info(f"Clustering {len(embeddings)} samples...")
 
-        self._clusterer = hdbscan.HDBSCAN(
+        clusterer = hdbscan.HDBSCAN(
             min_cluster_size=self.min_cluster_size,
             min_samples=self.min_samples,
             metric=self.metric,
@@ -135,31 +529,31 @@ class HDBSCANNewClassDetector:
             prediction_data=self.prediction_data
         )
 
-        self._clusterer.fit(embeddings)
+        clusterer.fit(embeddings)
 
-        self._labels = self._clusterer.labels_
+        labels = np.asarray(clusterer.labels_)
 
         # 计算异常分数
         if self.prediction_data:
-            self._outlier_scores = self._clusterer.outlier_scores_
+            outlier_scores = np.asarray(clusterer.outlier_scores_, dtype=np.float64)
         else:
             # 如果没有prediction_data，使用简单的距离计算
-            self._outlier_scores = np.zeros(len(embeddings))
+            outlier_scores = np.zeros(len(embeddings))
 
-        n_clusters = len(set(self._labels)) - (1 if -1 in self._labels else 0)
-        n_noise = list(self._labels).count(-1)
+        n_clusters = len(set(labels)) - (1 if -1 in labels else 0)
+        n_noise = int(np.sum(labels == -1))
 
         logger.info(f"Clustering complete: {n_clusters} clusters, {n_noise} noise points")
+        return labels, outlier_scores
 
-    def get_outlier_scores(self) -> np.ndarray:
-        """获取异常分数"""
-        if self._outlier_scores is None:
-            raise RuntimeError("No clustering results available")
-        return self._outlier_scores
-
-    def get_statistics(self, predictions: List[Dict[str, Any]]) -> Dict[str, Any]:
-        """获取统计信息"""
-        if not self.enabled or self._labels is None:
+    def get_statistics(
+        self,
+        predictions: List[Dict[str, Any]],
+        labels: Optional[np.ndarray] = None,
+        outlier_scores: Optional[np.ndarray] = None
+    ) -> Dict[str, Any]:
+        """获取统计信息（labels / outlier_scores 为 detect_new_classes 的返回值）"""
+        if not self.enabled or labels is None or len(labels) == 0:
             return {
                 "total_samples": len(predictions),
                 "n_clusters": 1,
@@ -169,27 +563,29 @@ class HDBSCANNewClassDetector:
                 "available": False
             }
 
-        n_clusters = len(set(self._labels)) - (1 if -1 in self._labels else 0)
-        n_noise = list(self._labels).count(-1)
-        n_total = len(self._labels)
+        labels = np.asarray(labels)
+        n_clusters = len(set(labels.tolist())) - (1 if -1 in labels else 0)
+        n_noise = int(np.sum(labels == -1))
+        n_total = len(labels)
 
         return {
             "total_samples": n_total,
             "n_clusters": n_clusters,
             "n_noise": n_noise,
             "noise_ratio": n_noise / n_total if n_total > 0 else 0.0,
-            "mean_outlier_score": float(np.mean(self._outlier_scores)),
+            "mean_outlier_score": float(np.mean(outlier_scores)) if outlier_scores is not None else 0.0,
             "available": True
         }
 
     def cleanup(self):
-        """清理HDBSCAN资源"""
-        if self._clusterer is not None:
-            del self._clusterer
-            self._clusterer = None
+        """清理HDBSCAN资源（持久化聚类器保留在磁盘，下次使用时重新加载）"""
+        with self._model_lock:
+            self._model = None
+            self._model_reducer = None
+            self._model_info = None
+            self._scored = 0
+            self._scored_noise = 0
 
-        self._labels = None
-        self._outlier_scores = None
         logger.info("HDBSCANNewClassDetector resources cleaned up")
 
     def __del__(self):
@@ -1,17 +1,33 @@
 """
 OCR服务模块
 使用本地 OCR API 识别注册号
+
+请求通过带连接池的 requests.Session 发送（keep-alive 复用连接），
+失败按指数退避重试；连续失败达到阈值后熔断，冷却期内不再请求，
+避免 OCR 服务宕机时每张图片都要等待一次超时
+
+提供检测框时只发送注册号区域：按检测框加边距裁剪、限制分辨率后在内存中编码为 JPEG，
+未检测到注册号区域时才发送原图
 """
 
+import io
+import math
 import os
+import time
 import logging
 import re
 import json
 import base64
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import requests
-from typing import Dict, Any, Optional
+from requests.adapters import HTTPAdapter
+from typing import Dict, Any, List, Optional, Tuple, Union
 from PIL import Image
 
+from .decoded_image import DecodedImage
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -21,57 +37,271 @@ REGISTRATION_PATTERN = re.compile(
 )
 
 
+# 可重试的 HTTP 状态码（服务过载或网关错误）
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """熔断期间拒绝发送的请求"""
+
+
+class CircuitBreaker:
+    """
+    连续失败熔断器
+
+    连续失败 failure_threshold 次后断开，reset_timeout 秒后放行一个试探请求（半开），
+    试探成功则恢复，失败则继续断开
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 60.0):
+        """
+        Args:
+            failure_threshold: 断开前允许的连续失败次数，<= 0 时不熔断
+            reset_timeout: 断开后等待多久放行试探请求（秒）
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """当前是否允许发送请求"""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            # 半开：同一时间只放行一个试探请求
+            if self._trial_in_flight:
+                return False
+            self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        """记录成功，恢复为闭合状态"""
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info("OCR circuit closed, service recovered")
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        """记录失败，达到阈值或试探失败时断开"""
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.failure_threshold <= 0:
+                return
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    logger.warning(
+                        f"OCR circuit opened after {self._failures} consecutive failures, "
+                        f"retrying in {self.reset_timeout:.0f}s"
+                    )
+                self._opened_at = time.monotonic()
+
+    def get_status(self) -> Dict[str, Any]:
+        """熔断器状态"""
+        with self._lock:
+            if self._opened_at is None:
+                state, retry_in = 'closed', 0.0
+            else:
+                retry_in = max(0.0, self.reset_timeout - (time.monotonic() - self._opened_at))
+                state = 'open' if retry_in > 0 else 'half_open'
+            return {
+                'state': state,
+                'consecutive_failures': self._failures,
+                'retry_in': round(retry_in, 1)
+            }
+
+
 class RegistrationOCR:
     """注册号OCR识别器"""
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(self, config: Dict[str, Any], result_cache=None):
         """
         初始化OCR识别器
 
         Args:
             config: OCR配置
+            result_cache: 结果缓存（ResultCache），提供时按图片内容复用识别结果
         """
         # 从环境变量读取 OCR API URL（优先级：环境变量 > 默认值）
         self.api_url = os.getenv('OCR_API_URL', 'http://localhost:8000/v2/models/ocr/infer')
         self.enabled = config.get('enabled', True)
         self.timeout = config.get('timeout', 30)
+        # 建立连接的超时单独设置：服务不可达时快速失败，而不是等满 timeout
+        self.connect_timeout = config.get('connect_timeout', 5)
+
+        # 连接池和并发
+        self.max_connections = max(1, int(config.get('max_connections', 8)))
+        self.max_in_flight = max(1, int(config.get('max_in_flight', 4)))
+
+        # 重试和熔断
+        self.max_retries = max(0, int(config.get('max_retries', 2)))
+        self.retry_backoff = config.get('retry_backoff', 0.5)
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(config.get('breaker_threshold', 5)),
+            reset_timeout=config.get('breaker_reset_timeout', 60)
+        )
+
+        # 裁剪到检测框：边距为检测框宽高的比例，裁剪结果最长边不超过 crop_max_side
+        self.crop_to_detection = config.get('crop_to_detection', True)
+        self.crop_margin = config.get('crop_margin', 0.2)
+        self.crop_max_side = max(1, int(config.get('crop_max_side', 1024)))
+        self.crop_jpeg_quality = int(config.get('crop_jpeg_quality', 90))
+
+        self.result_cache = result_cache
+
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
 
         if not self.enabled:
             logger.info("OCR is disabled")
             return
 
-        logger.info(f"OCR API initialized (url={self.api_url})")
+        logger.info(
+            f"OCR API initialized (url={self.api_url}, max_connections={self.max_connections}, "
+            f"max_in_flight={self.max_in_flight})"
+        )
+
+    @property
+    def session(self) -> requests.Session:
+        """共享的 HTTP 会话（懒创建，连接池大小为 max_connections）"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    # 重试由 _post 处理（带退避并计入熔断）
+                    adapter = HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=self.max_connections,
+                        max_retries=0
+                    )
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def _post(self, payload: Dict[str, Any]) -> requests.Response:
+        """
+        发送 OCR 请求，连接失败、超时和可重试状态码按指数退避重试
+
+        重试用尽后的失败计入熔断器；服务有响应（包括 4xx）视为服务可用
+
+        Raises:
+            CircuitOpenError: 熔断期间不发送请求
+            requests.exceptions.RequestException: 重试用尽或不可重试的错误
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("OCR circuit is open")
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                time.sleep(self.retry_backoff * (2 ** (attempt - 1)))
+            try:
+                response = self.session.post(
+                    self.api_url,
+                    json=payload,
+                    headers={'Content-Type': 'application/json'},
+                    timeout=(self.connect_timeout, self.timeout)
+                )
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt < self.max_retries:
+                    logger.warning(f"OCR API request failed (attempt {attempt + 1}), retrying: {e}")
+                    continue
+                self.breaker.record_failure()
+                raise
+            except Exception:
+                self.breaker.record_failure()
+                raise
+
+            if response.status_code in RETRYABLE_STATUS_CODES:
+                if attempt < self.max_retries:
+                    logger.warning(
+                        f"OCR API returned {response.status_code} (attempt {attempt + 1}), retrying"
+                    )
+                    continue
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            response.raise_for_status()
+            return response
+
+    def _crop_region(
+        self,
+        image: DecodedImage,
+        region: List[float]
+    ) -> Optional[Tuple[bytes, Dict[str, Any]]]:
+        """
+        按检测框（加边距）裁剪图片，缩放到不超过 crop_max_side 后编码为 JPEG
+
+        Args:
+            image: 图片（使用分类时共享的解码结果）
+            region: 归一化检测框 xywhn（相对于按 EXIF 方向旋转后的图片，与检测模型一致）
+
+        Returns:
+            (JPEG 数据, 裁剪信息 {left, top, scale, width, height})；检测框无效或无法解码时返回 None
+        """
+        x_center, y_center, box_width, box_height = region
+        rgb = image.rgb
+        if rgb is None:
+            return None
+        height, width = rgb.shape[:2]
+
+        margin_x = box_width * self.crop_margin
+        margin_y = box_height * self.crop_margin
+        left = max(0, math.floor((x_center - box_width / 2 - margin_x) * width))
+        top = max(0, math.floor((y_center - box_height / 2 - margin_y) * height))
+        right = min(width, math.ceil((x_center + box_width / 2 + margin_x) * width))
+        bottom = min(height, math.ceil((y_center + box_height / 2 + margin_y) * height))
+        if right - left < 2 or bottom - top < 2:
+            return None
+
+        # 只复制检测框区域的像素
+        crop = Image.fromarray(np.ascontiguousarray(rgb[top:bottom, left:right]))
+        scale = min(1.0, self.crop_max_side / max(crop.size))
+        if scale < 1.0:
+            crop = crop.resize(
+                (max(1, round(crop.width * scale)), max(1, round(crop.height * scale))),
+                Image.Resampling.LANCZOS
+            )
 
-    def _call_ocr_api(self, image_path: str) -> Optional[Dict]:
+        buffer = io.BytesIO()
+        crop.save(buffer, format='JPEG', quality=self.crop_jpeg_quality)
+
+        return buffer.getvalue(), {
+            'left': left,
+            'top': top,
+            'scale': scale,
+            'width': width,
+            'height': height
+        }
+
+    def _call_ocr_api(
+        self,
+        image_path: str,
+        image_bytes: bytes,
+        mime_type: str = 'image/jpeg'
+    ) -> Optional[Dict]:
         """
         调用 OCR API
 
         Args:
-            image_path: 图片文件路径
+            image_path: 图片文件路径（用于日志）
+            image_bytes: 已编码的图片数据（原图文件内容或裁剪后的区域）
+            mime_type: image_bytes 的 MIME 类型
 
         Returns:
             API 响应数据
         """
         try:
-            # 检测图片格式并读取为 base64
-            with Image.open(image_path) as img:
-                img_format = img.format.lower() if img.format else 'jpeg'
-                # 映射 PIL 格式到 MIME 类型
-                mime_mapping = {
-                    'jpeg': 'image/jpeg',
-                    'jpg': 'image/jpeg',
-                    'png': 'image/png',
-                    'gif': 'image/gif',
-                    'bmp': 'image/bmp',
-                    'webp': 'image/webp'
-                }
-                mime_type = mime_mapping.get(img_format, 'image/jpeg')
-            
-            # 读取图片并转换为 base64 编码
-            with open(image_path, 'rb') as f:
-                image_bytes = f.read()
-                image_base64 = base64.b64encode(image_bytes).decode('utf-8')
-            
+            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+            logger.debug(f"Sending {len(image_bytes)} bytes to OCR API for {image_path}")
+
             # 构建请求数据，使用 base64 编码的图片
             payload = {
                 "inputs": [
@@ -94,14 +324,8 @@ class RegistrationOCR:
                 ]
             }
 
-            # 发送请求
-            response = requests.post(
-                self.api_url,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=self.timeout
-            )
-            response.raise_for_status()
+            # 发送请求（连接池复用连接，失败重试）
+            response = self._post(payload)
 
             # 解析响应（兼容 BYTES 嵌套 JSON 与多重转义）
             result = response.json()
@@ -186,8 +410,8 @@ class RegistrationOCR:
             logger.debug(f"Successfully parsed OCR response with keys: {list(parsed.keys())}")
             return parsed
 
-        except FileNotFoundError as e:
-            logger.error(f"Image file not found: {image_path}")
+        except CircuitOpenError:
+            logger.debug(f"OCR circuit open, skipping {image_path}")
             return None
         except requests.exceptions.RequestException as e:
             logger.error(f"OCR API request failed: {e}")
@@ -202,12 +426,22 @@ class RegistrationOCR:
             logger.error(f"Unexpected error in _call_ocr_api: {e}", exc_info=True)
             return None
 
-    def recognize(self, image_path: str) -> Dict[str, Any]:
+    def recognize(
+        self,
+        image_path: Union[str, DecodedImage],
+        region: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
         """
         识别注册号
 
+        配置了结果缓存时，内容相同的图片（且注册号区域相同）直接返回缓存结果；
+        只缓存 OCR 服务正常返回的结果，请求失败不缓存
+
         Args:
-            image_path: 图片文件路径
+            image_path: 图片文件路径或 DecodedImage（文件只读取一次，发送原图、裁剪、
+                        计算缓存键共用同一份数据）
+            region: 检测到的注册号区域 xywhn；提供且启用 crop_to_detection 时只识别该区域，
+                    返回的坐标仍相对于整张图片
 
         Returns:
             包含识别结果的字典
@@ -221,13 +455,63 @@ class RegistrationOCR:
                 "yolo_boxes": []
             }
 
+        image = image_path if isinstance(image_path, DecodedImage) else DecodedImage(image_path)
+
+        cache_version = self._cache_version(region) if self.result_cache is not None else None
+        if cache_version is not None:
+            cached = self.result_cache.get('ocr', cache_version, image)
+            if cached is not None:
+                return cached
+
+        result, cacheable = self._recognize(image, region)
+        if cacheable and cache_version is not None:
+            try:
+                self.result_cache.put('ocr', cache_version, image, result)
+            except Exception as e:
+                logger.warning(f"Failed to cache OCR result for {image.path}: {e}")
+        return result
+
+    def _cache_version(self, region: Optional[List[float]]) -> str:
+        """OCR 结果的缓存版本：接口地址、裁剪参数和注册号区域"""
+        if region and self.crop_to_detection:
+            crop = (
+                f"crop={self.crop_margin},{self.crop_max_side},{self.crop_jpeg_quality}"
+                f"|region={','.join(f'{v:.4f}' for v in region)}"
+            )
+        else:
+            crop = "full"
+        return f"{self.api_url}|{crop}"
+
+    def _recognize(self, image: DecodedImage, region: Optional[List[float]]) -> Tuple[Dict[str, Any], bool]:
+        """
+        识别注册号（不经过缓存）
+
+        Returns:
+            (识别结果, 是否可缓存)：OCR 服务未正常返回时不可缓存
+        """
+        image_path = image.path
         try:
-            # 获取图片尺寸
-            image = Image.open(image_path)
-            img_width, img_height = image.size
+            # 裁剪到检测框，裁剪失败时退回原图
+            crop = None
+            if region and self.crop_to_detection:
+                try:
+                    crop = self._crop_region(image, region)
+                except Exception as e:
+                    logger.warning(f"Failed to crop OCR region for {image_path}, using full image: {e}")
+
+            if crop is not None:
+                image_bytes, crop_info = crop
+                mime_type = 'image/jpeg'
+                img_width, img_height = crop_info['width'], crop_info['height']
+            else:
+                # 发送原图文件内容，尺寸取自文件头
+                image_bytes, mime_type, crop_info = image.data, image.mime_type, None
+                if image_bytes is None or image.size is None:
+                    raise ValueError(f"Failed to read image: {image_path}")
+                img_width, img_height = image.size
 
             # 调用 OCR API
-            ocr_data = self._call_ocr_api(image_path)
+            ocr_data = self._call_ocr_api(image_path, image_bytes, mime_type=mime_type)
             if not ocr_data:
                 logger.warning(f"OCR API returned no data for {image_path}")
                 return {
@@ -236,7 +520,7 @@ class RegistrationOCR:
                     "raw_text": "",
                     "all_matches": [],
                     "yolo_boxes": []
-                }
+                }, False
 
             # 检查ocr_data是否是有效的字典
             if not isinstance(ocr_data, dict):
@@ -247,7 +531,7 @@ class RegistrationOCR:
                     "raw_text": "",
                     "all_matches": [],
                     "yolo_boxes": []
-                }
+                }, False
 
             # 检查API错误响应
             if 'errorCode' in ocr_data:
@@ -260,7 +544,7 @@ class RegistrationOCR:
                     "raw_text": "",
                     "all_matches": [],
                     "yolo_boxes": []
-                }
+                }, False
 
             # 解析 OCR 结果（支持多种响应格式）
             try:
@@ -296,7 +580,7 @@ class RegistrationOCR:
                         "raw_text": "",
                         "all_matches": [],
                         "yolo_boxes": []
-                    }
+                    }, False
                 
                 rec_texts = pruned_result.get('rec_texts', [])
                 rec_scores = pruned_result.get('rec_scores', [])
@@ -326,7 +610,7 @@ class RegistrationOCR:
                         "raw_text": "",
                         "all_matches": [],
                         "yolo_boxes": []
-                    }
+                    }, True
 
             except (KeyError, IndexError, TypeError, AttributeError) as e:
                 logger.error(f"Failed to parse OCR results: {e}, OCR data keys: {list(ocr_data.keys()) if isinstance(ocr_data, dict) else f'not a dict, type={type(ocr_data)}'}")
@@ -336,7 +620,7 @@ class RegistrationOCR:
                     "raw_text": "",
                     "all_matches": [],
                     "yolo_boxes": []
-                }
+                }, False
 
             all_texts = []
             yolo_boxes = []
@@ -345,6 +629,13 @@ class RegistrationOCR:
             for i, (text, score, box) in enumerate(zip(rec_texts, rec_scores, rec_boxes)):
                 # box 格式: [xmin, ymin, xmax, ymax]
                 xmin, ymin, xmax, ymax = box
+                if crop_info is not None:
+                    # 裁剪图坐标映射回原图
+                    scale = crop_info['scale']
+                    xmin = xmin / scale + crop_info['left']
+                    xmax = xmax / scale + crop_info['left']
+                    ymin = ymin / scale + crop_info['top']
+                    ymax = ymax / scale + crop_info['top']
 
                 # 转换为YOLO格式
                 x_center = (xmin + xmax) / 2.0 / img_width
@@ -378,7 +669,7 @@ class RegistrationOCR:
                     "raw_text": raw_text,
                     "all_matches": [],
                     "yolo_boxes": yolo_boxes
-                }
+                }, True
 
             best_match = max(matches, key=lambda x: x["confidence"])
 
@@ -388,7 +679,7 @@ class RegistrationOCR:
                 "raw_text": raw_text,
                 "all_matches": matches,
                 "yolo_boxes": yolo_boxes
-            }
+            }, True
 
         except Exception as e:
             logger.error(f"OCR recognition error: {e}", exc_info=True)
@@ -398,7 +689,44 @@ class RegistrationOCR:
                 "raw_text": "",
                 "all_matches": [],
                 "yolo_boxes": []
-            }
+            }, False
+
+    def recognize_many(
+        self,
+        image_paths: List[Union[str, DecodedImage]],
+        regions: Optional[List[Optional[List[float]]]] = None,
+        max_workers: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        并发识别多张图片的注册号，同时最多 max_in_flight 个请求在途
+
+        Args:
+            image_paths: 图片文件路径或 DecodedImage 列表
+            regions: 与 image_paths 对齐的注册号区域 xywhn（见 recognize），None 表示识别整张图片
+            max_workers: 并发请求数，默认 max_in_flight
+
+        Returns:
+            与 image_paths 顺序一致的识别结果列表，结构同 recognize()
+        """
+        if not image_paths:
+            return []
+
+        if regions is None:
+            regions = [None] * len(image_paths)
+
+        workers = min(max_workers or self.max_in_flight, len(image_paths))
+        if not self.enabled or workers <= 1:
+            return [self.recognize(path, region) for path, region in zip(image_paths, regions)]
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='ocr') as executor:
+            return list(executor.map(self.recognize, image_paths, regions))
+
+    def get_status(self) -> Dict[str, Any]:
+        """OCR 客户端状态（熔断器）"""
+        return {
+            'enabled': self.enabled,
+            'circuit': self.breaker.get_status()
+        }
 
     def _filter_registrations(self, ocr_results: list) -> list:
         """使用正则表达式过滤注册号"""
@@ -420,8 +748,12 @@ class RegistrationOCR:
         return matches
 
     def cleanup(self):
-        """清理OCR资源，释放内存"""
-        logger.info("OCR API client cleanup (no resources to release)")
+        """清理OCR资源，关闭连接池"""
+        with self._session_lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+        logger.info("OCR API client cleanup (connection pool closed)")
 
     def __del__(self):
         """析构时自动清理"""
@@ -0,0 +1,318 @@
+"""
+流水线预测引擎
+解码、模型推理、OCR、质量评估分阶段并行执行，阶段之间用有界队列衔接：
+推理阶段等待 OCR 网络往返时 GPU 不再空闲，OCR 等待时 CPU 继续解码和评估
+
+    解码(decode_workers) -> 推理(1, 攒批) -> OCR(ocr_workers) -> 质量评估(quality_workers) -> 写入(调用线程)
+
+写入阶段在调用 run() 的线程中执行，回调保持串行调用（与逐批预测相同的流式保存约定）
+
+每张图片只读取和解码一次（DecodedImage），解码后的像素随任务传递到写入阶段才释放，
+因此 queue_size 同时限制了在途图片占用的内存
+"""
+
+import time
+import queue
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from .predictor import read_image
+from .decoded_image import DecodedImage
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# 队列结束标记
+_DONE = object()
+
+
+class _Stage:
+    """
+    流水线阶段：若干工作线程从输入队列取任务处理后放入输出队列
+
+    最后一个工作线程退出时向输出队列放入下游工作线程数量的结束标记
+    """
+
+    def __init__(
+        self,
+        name: str,
+        handler: Callable[[list], list],
+        workers: int,
+        input_queue: queue.Queue,
+        output_queue: queue.Queue,
+        downstream_workers: int,
+        batch_size: int = 1
+    ):
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, int(workers))
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.downstream_workers = downstream_workers
+        self.batch_size = max(1, int(batch_size))
+
+        # 累计处理耗时（秒），用于判断瓶颈阶段
+        self.busy_time = 0.0
+        self._running = self.workers
+        self._lock = threading.Lock()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(
+                target=self._work, name=f"pipeline-{self.name}-{i}", daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def _work(self):
+        try:
+            finished = False
+            while not finished:
+                item = self.input_queue.get()
+                if item is _DONE:
+                    break
+                items = [item]
+                # 攒批：只取队列中已就绪的任务，不为凑满批次等待
+                while len(items) < self.batch_size:
+                    try:
+                        item = self.input_queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is _DONE:
+                        finished = True
+                        break
+                    items.append(item)
+
+                start_time = time.time()
+                try:
+                    items = self.handler(items)
+                except Exception as e:
+                    logger.error(f"Pipeline stage {self.name} failed for {len(items)} items: {e}")
+                    for item in items:
+                        item.setdefault('error', str(e))
+                elapsed = time.time() - start_time
+                with self._lock:
+                    self.busy_time += elapsed
+
+                for item in items:
+                    self.output_queue.put(item)
+        finally:
+            with self._lock:
+                self._running -= 1
+                last = self._running == 0
+            if last:
+                for _ in range(self.downstream_workers):
+                    self.output_queue.put(_DONE)
+
+
+class PredictionPipeline:
+    """分阶段并行的批量预测"""
+
+    def __init__(self, ai_predictor, config: Optional[Dict[str, Any]] = None):
+        """
+        初始化流水线
+
+        Args:
+            ai_predictor: AIPredictor 实例（使用其分类器、OCR 和质量评估器）
+            config: pipeline 配置（decode_workers、ocr_workers、quality_workers、queue_size）
+        """
+        config = config or {}
+        self.ai_predictor = ai_predictor
+        self.decode_workers = max(1, int(config.get('decode_workers', 2)))
+        self.ocr_workers = max(1, int(config.get('ocr_workers', 4)))
+        self.quality_workers = max(1, int(config.get('quality_workers', 2)))
+        self.queue_size = max(1, int(config.get('queue_size', 64)))
+
+    def run(
+        self,
+        image_paths: List[str],
+        on_result: Optional[Callable[[int, Dict[str, Any], Any], None]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        执行流水线
+
+        Args:
+            image_paths: 图片路径列表
+            on_result: 每张图片完成后在调用线程中回调，接收 (index, result, embedding)，
+                       完成顺序与输入顺序不一定一致
+
+        Returns:
+            与 image_paths 顺序一致的结果列表，失败的图片为 {'filename', 'error'}
+        """
+        if not image_paths:
+            return []
+
+        inference_batch_size = self.ai_predictor.predictor.batch_size
+        paths_queue = queue.Queue(maxsize=self.queue_size)
+        decoded_queue = queue.Queue(maxsize=self.queue_size)
+        classified_queue = queue.Queue(maxsize=self.queue_size)
+        recognized_queue = queue.Queue(maxsize=self.queue_size)
+        done_queue = queue.Queue(maxsize=self.queue_size)
+
+        stages = [
+            _Stage('decode', self._decode, self.decode_workers,
+                   paths_queue, decoded_queue, 1),
+            _Stage('inference', self._infer, 1,
+                   decoded_queue, classified_queue, self.ocr_workers,
+                   batch_size=inference_batch_size),
+            _Stage('ocr', self._recognize, self.ocr_workers,
+                   classified_queue, recognized_queue, self.quality_workers),
+            # 质量评估启用进程池时按工作进程数攒批，由 assess_many 分发
+            _Stage('quality', self._assess, self.quality_workers,
+                   recognized_queue, done_queue, 1,
+                   batch_size=max(1, self.ai_predictor.quality.workers)),
+        ]
+
+        start_time = time.time()
+        for stage in stages:
+            stage.start()
+
+        feeder = threading.Thread(
+            target=self._feed, args=(image_paths, paths_queue), name="pipeline-feed", daemon=True
+        )
+        feeder.start()
+
+        # 写入阶段：在调用线程中组装结果并回调
+        results: List[Optional[Dict[str, Any]]] = [None] * len(image_paths)
+        completed = 0
+        while True:
+            item = done_queue.get()
+            if item is _DONE:
+                break
+            result = self._finish(item)
+            results[item['index']] = result
+            completed += 1
+            if on_result is not None:
+                try:
+                    on_result(item['index'], result, item.get('embedding'))
+                except Exception as e:
+                    logger.error(f"Error in pipeline result callback for {result.get('filename')}: {e}")
+            if completed % 100 == 0:
+                logger.info(f"Pipeline processed {completed}/{len(image_paths)} images")
+
+        feeder.join()
+
+        elapsed = time.time() - start_time
+        logger.info(
+            f"Pipeline processed {completed} images in {elapsed:.1f}s | busy time: "
+            + ", ".join(f"{stage.name}={stage.busy_time:.1f}s" for stage in stages)
+        )
+
+        return [
+            result if result is not None
+            else {'filename': Path(path).name, 'error': 'Prediction did not complete'}
+            for path, result in zip(image_paths, results)
+        ]
+
+    def _feed(self, image_paths: List[str], paths_queue: queue.Queue):
+        """按顺序投放任务（队列满时阻塞，限制在途图片数量）"""
+        for index, image_path in enumerate(image_paths):
+            paths_queue.put({'index': index, 'path': image_path, 'time': 0.0})
+        for _ in range(self.decode_workers):
+            paths_queue.put(_DONE)
+
+    def _decode(self, items: list) -> list:
+        predictor = self.ai_predictor.predictor
+        for item in items:
+            start_time = time.time()
+            # 文件只读取一次：缓存键、推理、OCR、质量评估共用同一个 DecodedImage
+            item['image'] = DecodedImage(item['path'])
+            # 结果缓存命中时跳过解码和推理（之后的阶段需要像素时再解码）
+            cached = predictor.cached_prediction(item['image'])
+            if cached is not None:
+                item['embedding'] = cached.pop('embedding', None)
+                item['classification'] = cached
+                item['time'] += time.time() - start_time
+                continue
+            if read_image(item['image']) is None:
+                item['error'] = f"Failed to read image: {item['path']}"
+            item['time'] += time.time() - start_time
+        return items
+
+    def _infer(self, items: list) -> list:
+        valid = [
+            item for item in items
+            if 'error' not in item and 'classification' not in item
+        ]
+        if not valid:
+            return items
+
+        start_time = time.time()
+        try:
+            classification_results = self.ai_predictor.predictor.predict_images(
+                [item['image'].bgr for item in valid]
+            )
+        except Exception as e:
+            import traceback
+            logger.error(f"Error running batch classification for {len(valid)} images: {e}")
+            logger.error(f"Traceback: {traceback.format_exc()}")
+            for item in valid:
+                item['error'] = str(e)
+            classification_results = []
+        # 批量推理的耗时平摊到每张图片
+        classification_time = (time.time() - start_time) / len(valid)
+
+        for item, classification_result in zip(valid, classification_results):
+            self.ai_predictor.predictor.cache_prediction(item['image'], classification_result)
+            item['embedding'] = classification_result.pop('embedding', None)
+            item['classification'] = classification_result
+            item['time'] += classification_time
+        return items
+
+    def _recognize(self, items: list) -> list:
+        for item in items:
+            if 'error' in item:
+                continue
+            start_time = time.time()
+            try:
+                item['ocr'] = self.ai_predictor.ocr.recognize(
+                    item['image'], region=self.ai_predictor.registration_box(item['classification'])
+                )
+            except Exception as e:
+                logger.error(f"OCR failed for {item['path']}: {e}")
+                item['error'] = str(e)
+            item['time'] += time.time() - start_time
+        return items
+
+    def _assess(self, items: list) -> list:
+        valid = [item for item in items if 'error' not in item]
+        if not valid:
+            return items
+
+        start_time = time.time()
+        try:
+            quality_results = self.ai_predictor.quality.assess_many([item['image'] for item in valid])
+        except Exception as e:
+            logger.error(f"Quality assessment failed for {len(valid)} images: {e}")
+            for item in valid:
+                item['error'] = str(e)
+            quality_results = []
+        quality_time = (time.time() - start_time) / len(valid)
+
+        for item, quality_result in zip(valid, quality_results):
+            item['quality'] = quality_result
+        for item in valid:
+            item['time'] += quality_time
+        return items
+
+    def _finish(self, item: Dict[str, Any]) -> Dict[str, Any]:
+        """组装单张图片的预测结果"""
+        # 图片已完成全部阶段，释放原始字节和像素
+        image = item.pop('image', None)
+        if image is not None:
+            image.release()
+        filename = Path(item['path']).name
+        if 'error' in item:
+            logger.error(f"Error predicting {filename}: {item['error']}")
+            return {'filename': filename, 'error': item['error']}
+        try:
+            return self.ai_predictor.build_result(
+                filename, item['classification'], item['ocr'], item['quality'], item['time']
+            )
+        except Exception as e:
+            logger.error(f"Error predicting {filename}: {e}")
+            return {'filename': filename, 'error': str(e)}
@@ -3,29 +3,65 @@ AI分类器预测服务
 集成机型和航司分类器
 """
 
+import base64
+import hashlib
 import logging
+import threading
 from pathlib import Path
-from typing import Dict, Any, Optional, Union
+from typing import Dict, Any, List, Optional, Union
+
+import cv2
+import numpy as np
 from ultralytics import YOLO
 
+from .decoded_image import DecodedImage, source_path
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# 默认推理批大小（performance.batch_size）
+DEFAULT_BATCH_SIZE = 16
+
+
+def read_image(image_path: Union[str, DecodedImage]) -> Optional[np.ndarray]:
+    """
+    读取图片为 BGR 数组（支持非 ASCII 路径），无法读取时返回 None
+
+    传入 DecodedImage 时返回其共享的解码结果，不再读取文件
+    """
+    if isinstance(image_path, DecodedImage):
+        return image_path.bgr
+    try:
+        data = np.fromfile(image_path, dtype=np.uint8)
+    except OSError:
+        return None
+    if data.size == 0:
+        return None
+    return cv2.imdecode(data, cv2.IMREAD_COLOR)
+
 
 class ModelPredictor:
     """YOLOv8分类器和检测器预测器"""
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        result_cache=None
+    ):
         """
         初始化分类器和检测器
 
         Args:
             config: 配置字典，包含模型路径和参数
+            batch_size: predict_many 每次送入模型的图片数
+            result_cache: 结果缓存（ResultCache），提供时按图片内容复用预测结果
         """
         self.aircraft_model_path = config['aircraft']['path']
         self.airline_model_path = config['airline']['path']
         self.device = config['aircraft'].get('device', 'cuda')
         self.image_size = config['aircraft'].get('image_size', 640)
+        self.batch_size = max(1, int(batch_size))
 
         # Detection 配置
         detection_config = config.get('detection', {})
@@ -37,8 +73,14 @@ class ModelPredictor:
         self._aircraft_model: Optional[YOLO] = None
         self._airline_model: Optional[YOLO] = None
         self._detection_model: Optional[YOLO] = None
+        # 机型模型推理锁：特征 forward hook 挂在共享的模型层上，
+        # 注册、推理到移除期间其他线程的机型模型推理不能进入
+        self._aircraft_lock = threading.Lock()
+        # 模型文件路径 -> 内容哈希（模型重新加载后重新计算）
+        self._model_digests: Dict[str, str] = {}
+        self.result_cache = result_cache
 
-        logger.info(f"ModelPredictor initialized with device={self.device}, imgsz={self.image_size}, detection_enabled={self.detection_enabled}")
+        logger.info(f"ModelPredictor initialized with device={self.device}, imgsz={self.image_size}, batch_size={self.batch_size}, detection_enabled={self.detection_enabled}")
 
     @property
     def aircraft_model(self) -> YOLO:
@@ -71,6 +113,7 @@ class ModelPredictor:
 
         logger.info(f"Loading aircraft model from: {model_path}")
         self._aircraft_model = YOLO(str(model_path))
+        self._model_digests.pop(self.aircraft_model_path, None)
         logger.info("Aircraft model loaded successfully")
 
     def _load_airline_model(self):
@@ -81,6 +124,7 @@ class ModelPredictor:
 
         logger.info(f"Loading airline model from: {model_path}")
         self._airline_model = YOLO(str(model_path))
+        self._model_digests.pop(self.airline_model_path, None)
         logger.info("Airline model loaded successfully")
 
     def _load_detection_model(self):
@@ -94,8 +138,82 @@ class ModelPredictor:
 
         logger.info(f"Loading detection model from: {model_path}")
         self._detection_model = YOLO(str(model_path))
+        self._model_digests.pop(self.detection_model_path, None)
         logger.info("Detection model loaded successfully")
 
+    def _model_digest(self, model_path: str) -> str:
+        """模型文件内容哈希（前 12 位）"""
+        if model_path not in self._model_digests:
+            digest = hashlib.sha1()
+            with open(model_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            self._model_digests[model_path] = digest.hexdigest()[:12]
+        return self._model_digests[model_path]
+
+    @property
+    def embedding_model_version(self) -> str:
+        """
+        特征向量对应的模型版本（机型模型文件名 + 内容哈希）
+
+        同一路径上的权重被替换后版本随之变化，不同版本的特征不能混用
+        """
+        return f"{Path(self.aircraft_model_path).stem}-{self._model_digest(self.aircraft_model_path)}"
+
+    @property
+    def prediction_version(self) -> str:
+        """
+        预测结果对应的版本（全部模型的内容哈希和推理参数），用作结果缓存的版本
+        """
+        parts = [
+            self.embedding_model_version,
+            f"{Path(self.airline_model_path).stem}-{self._model_digest(self.airline_model_path)}",
+            f"imgsz={self.image_size}"
+        ]
+        if self.detection_enabled:
+            parts.append(
+                f"{Path(self.detection_model_path).stem}-{self._model_digest(self.detection_model_path)}"
+                f"-conf={self.detection_conf}-iou={self.detection_iou}"
+            )
+        return "|".join(parts)
+
+    def cached_prediction(self, image_path: Union[str, DecodedImage]) -> Optional[Dict[str, Any]]:
+        """
+        从结果缓存读取图片的预测结果（结构同 predict_many 的单项，含 'embedding'）
+
+        未配置缓存、未命中或无法确定模型版本时返回 None
+        """
+        if self.result_cache is None:
+            return None
+        try:
+            cached = self.result_cache.get('prediction', self.prediction_version, image_path)
+        except Exception as e:
+            logger.warning(f"Prediction cache lookup failed for {image_path}: {e}")
+            return None
+        if cached is None:
+            return None
+        embedding = cached.pop('embedding', None)
+        if embedding is not None:
+            cached['embedding'] = np.frombuffer(
+                base64.b64decode(embedding), dtype=np.float32
+            ).copy()
+        return cached
+
+    def cache_prediction(self, image_path: Union[str, DecodedImage], result: Dict[str, Any]):
+        """把预测结果写入结果缓存（失败的结果不缓存）"""
+        if self.result_cache is None or 'error' in result:
+            return
+        value = {key: val for key, val in result.items() if key != 'embedding'}
+        embedding = result.get('embedding')
+        if embedding is not None:
+            value['embedding'] = base64.b64encode(
+                np.ascontiguousarray(embedding, dtype=np.float32).tobytes()
+            ).decode('ascii')
+        try:
+            self.result_cache.put('prediction', self.prediction_version, image_path, value)
+        except Exception as e:
+            logger.warning(f"Failed to cache prediction for {image_path}: {e}")
+
     def load_models(self):
         """显式加载所有模型"""
         self._load_aircraft_model()
@@ -113,23 +231,140 @@ class ModelPredictor:
         Returns:
             包含预测结果的字典
         """
-        # 预测机型
-        aircraft_result = self._predict_single(self.aircraft_model, image_path, "aircraft")
+        result = self.predict_many([image_path])[0]
+        if 'error' in result:
+            raise ValueError(result['error'])
+        return result
 
-        # 预测航司
-        airline_result = self._predict_single(self.airline_model, image_path, "airline")
+    def predict_many(
+        self,
+        image_paths: List[Union[str, DecodedImage]],
+        batch_size: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量预测多张图片的机型、航司和检测框
 
-        result = {
-            'aircraft': aircraft_result,
-            'airline': airline_result
-        }
+        每张图片只解码一次，按 batch_size 组成批次依次送入机型、航司和检测模型；
+        配置了结果缓存时，内容相同的图片直接使用缓存结果，不再解码和推理
+
+        Args:
+            image_paths: 图片文件路径或 DecodedImage 列表（DecodedImage 使用其共享的解码结果）
+            batch_size: 每批图片数，默认使用初始化时的 batch_size
+
+        Returns:
+            与 image_paths 顺序一致的结果列表，每项结构同 predict()，
+            另含 'embedding'：机型模型分类时倒数第二层的特征向量（与 get_embeddings 一致）；
+            无法读取的图片对应 {'error': 错误信息}
+        """
+        batch_size = max(1, batch_size or self.batch_size)
+        results: List[Optional[Dict[str, Any]]] = [
+            self.cached_prediction(path) for path in image_paths
+        ]
+        pending = [i for i, result in enumerate(results) if result is None]
+
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            images = [read_image(image_paths[i]) for i in chunk]
+
+            valid = []
+            for i, image in zip(chunk, images):
+                if image is None:
+                    results[i] = {'error': f"Failed to read image: {source_path(image_paths[i])}"}
+                else:
+                    valid.append((i, image))
+            if valid:
+                batch_results = self.predict_images([image for _, image in valid])
+                for (i, _), result in zip(valid, batch_results):
+                    self.cache_prediction(image_paths[i], result)
+                    results[i] = result
+
+            logger.debug(f"Predicted batch of {len(chunk)} images ({start + len(chunk)}/{len(pending)})")
+
+        return results
+
+    def predict_images(self, images: List[np.ndarray]) -> List[Dict[str, Any]]:
+        """
+        对一批已解码的图片运行全部模型（不再按 batch_size 拆分）
+
+        Returns:
+            与 images 顺序一致的结果列表，结构同 predict_many()
+        """
+        aircraft_results, embeddings = self._predict_with_embeddings(
+            self.aircraft_model, images
+        )
+        airline_results = self.airline_model.predict(
+            images,
+            imgsz=self.image_size,
+            device=self.device,
+            verbose=False
+        )
+
+        results = [
+            {
+                'aircraft': self._parse_classification(self.aircraft_model, aircraft_result),
+                'airline': self._parse_classification(self.airline_model, airline_result)
+            }
+            for aircraft_result, airline_result in zip(aircraft_results, airline_results)
+        ]
+        for result, embedding in zip(results, embeddings):
+            result['embedding'] = embedding
 
         # 目标检测
         if self.detection_enabled:
-            detection_result = self.detect(image_path)
-            result['detection'] = detection_result
+            detection_results = self.detection_model.predict(
+                images,
+                imgsz=self.image_size,
+                device=self.device,
+                conf=self.detection_conf,
+                iou=self.detection_iou,
+                verbose=False
+            )
+            for result, detection_result in zip(results, detection_results):
+                result['detection'] = self._parse_detection(detection_result)
+
+        return results
+
+    def _predict_with_embeddings(self, model: YOLO, images: List[np.ndarray]) -> tuple:
+        """
+        分类预测，同时通过 forward hook 取出倒数第二层的特征
 
-        return result
+        与 YOLO.embed() 取同一层并做全局平均池化，新类别检测无需再推理一遍；
+        持有机型模型推理锁，hook 只捕获本次推理的输出
+
+        Returns:
+            (分类结果列表, 特征向量列表)
+        """
+        captured = []
+
+        def hook(module, inputs, output):
+            features = output.detach()
+            if features.ndim == 4:
+                features = features.mean(dim=(2, 3))
+            captured.append(features.float().cpu().numpy())
+
+        with self._aircraft_lock:
+            # 与 embed() 默认层一致：分类头之前的一层
+            handle = model.model.model[-2].register_forward_hook(hook)
+            try:
+                results = model.predict(
+                    images,
+                    imgsz=self.image_size,
+                    device=self.device,
+                    verbose=False
+                )
+            finally:
+                handle.remove()
+
+        # 首次推理前的预热（GPU 等设备上的额外前向）也会触发 hook，
+        # 按前向调用整体丢弃开头多出的输出
+        while captured and sum(len(features) for features in captured) > len(images):
+            captured.pop(0)
+        if captured:
+            features = np.concatenate(captured)
+            embeddings = list(features) if len(features) == len(images) else [None] * len(images)
+        else:
+            embeddings = [None] * len(images)
+        return results, embeddings
 
     def detect(self, image_path: str) -> Dict[str, Any]:
         """
@@ -152,8 +387,10 @@ class ModelPredictor:
             iou=self.detection_iou,
             verbose=False
         )
+        return self._parse_detection(results[0])
 
-        result = results[0]
+    def _parse_detection(self, result) -> Dict[str, Any]:
+        """解析检测模型的单张图片结果"""
         boxes = result.boxes
         class_names = self.detection_model.model.names
 
@@ -190,8 +427,11 @@ class ModelPredictor:
             device=self.device,
             verbose=False
         )
+        return self._parse_classification(model, results[0])
 
-        result = results[0]
+    @staticmethod
+    def _parse_classification(model: YOLO, result) -> Dict[str, Any]:
+        """解析分类模型的单张图片结果"""
         probs = result.probs
 
         class_id = int(probs.top1)
@@ -245,6 +485,7 @@ class ModelPredictor:
     def get_embeddings(self, image_paths: list) -> "np.ndarray":
         """
         获取图像的嵌入向量（使用YOLO的embed方法）
+        批量预测时 predict_many 已在分类推理中返回同一特征，无需再调用本方法
 
         Args:
             image_paths: 图像文件路径列表
@@ -252,8 +493,6 @@ class ModelPredictor:
         Returns:
             numpy数组，shape为(n_samples, embedding_dim)
         """
-        import numpy as np
-
         if len(image_paths) == 0:
             logger.debug("Empty image paths list, returning empty array")
             return np.array([])
@@ -262,12 +501,13 @@ class ModelPredictor:
 
         # 使用机型模型获取embeddings
         # YOLO的embed()返回一个list，每个元素是一个embedding向量
-        embed_results = self.aircraft_model.embed(
-            image_paths,
-            imgsz=self.image_size,
-            device=self.device,
-            verbose=False
-        )
+        with self._aircraft_lock:
+            embed_results = self.aircraft_model.embed(
+                image_paths,
+                imgsz=self.image_size,
+                device=self.device,
+                verbose=False
+            )
 
         # embed_results是一个list，每个元素是一个tensor
         # 需要转换为numpy数组并堆叠
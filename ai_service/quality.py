@@ -4,18 +4,35 @@
 评估航空摄影图片的质量，包括清晰度、曝光、构图等指标
 """
 
+import json
 import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Union, Dict, Any, Optional
-from dataclasses import dataclass
+from typing import Union, Dict, Any, List, Optional
+from dataclasses import dataclass, asdict
 
 import numpy as np
 from PIL import Image
 import cv2
 
+from .decoded_image import DecodedImage
+
 logger = logging.getLogger(__name__)
 
 
+# 进程池启动（fork 并初始化全部工作进程）的超时时间（秒）
+POOL_START_TIMEOUT = 60
+
+# 按图片最长边选择解码降采样倍数（JPEG 在解码阶段直接缩小，不生成全尺寸图片）
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
 @dataclass
 class QualityConfig:
     """质量评估配置"""
@@ -25,21 +42,26 @@ class QualityConfig:
     noise_weight: float = 0.2
     color_weight: float = 0.15
     pass_threshold: float = 0.6
+    # 评估分辨率：最长边超过该值时缩小后评估（0 表示使用原图分辨率）
+    analysis_max_side: int = 0
 
 
 class ImageQualityAssessor:
     """
     图片质量评估器
 
-    基于传统图像处理算法评估图片质量
+    基于传统图像处理算法评估图片质量。
+    图片只解码一次（可按 analysis_max_side 降采样解码），各指标共用同一份灰度图，
+    直方图类统计在一次直方图计算中完成
     """
 
-    def __init__(self, config: Optional[Dict[str, Any]] = None):
+    def __init__(self, config: Optional[Dict[str, Any]] = None, result_cache=None):
         """
         初始化评估器
 
         Args:
             config: 质量评估配置字典
+            result_cache: 结果缓存（ResultCache），提供时按图片内容复用评估结果
         """
         config = config or {}
         self.quality_config = QualityConfig(
@@ -48,86 +70,123 @@ class ImageQualityAssessor:
             composition_weight=config.get('composition_weight', 0.15),
             noise_weight=config.get('noise_weight', 0.2),
             color_weight=config.get('color_weight', 0.15),
-            pass_threshold=config.get('pass_threshold', 0.6)
+            pass_threshold=config.get('pass_threshold', 0.6),
+            analysis_max_side=int(config.get('analysis_max_side', 0) or 0)
         )
+        self.result_cache = result_cache
+
+        # 批量评估（assess_many）的进程池：workers <= 1 时在调用线程中逐张评估
+        self.workers = int(config.get('workers', 0) or 0)
+        self.worker_opencv_threads = int(config.get('worker_opencv_threads', 1) or 1)
+        self.chunksize = max(1, int(config.get('chunksize', 4) or 1))
+        # 工作进程中的评估器不再启用进程池和缓存
+        self._worker_config = {**config, 'workers': 0}
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+        if self.workers > 1:
+            self._start_pool()
+
+    def _decode(self, image: DecodedImage) -> np.ndarray:
+        """
+        解码图片 (BGR)
+
+        已解码（如分类时）的图片直接使用共享的像素；否则设置了 analysis_max_side 时
+        按文件头中的尺寸选择 IMREAD_REDUCED_COLOR_* 从原始字节降采样解码
+        """
+        max_side = self.quality_config.analysis_max_side
+        flag = cv2.IMREAD_COLOR
+        if max_side > 0 and not image.is_decoded:
+            longest = max(image.size or (0, 0))
+            for factor, reduced_flag in _REDUCED_DECODE_FLAGS:
+                if longest // factor >= max_side:
+                    flag = reduced_flag
+                    break
+
+        if flag == cv2.IMREAD_COLOR:
+            img = image.bgr
+        elif image.data is not None:
+            img = cv2.imdecode(np.frombuffer(image.data, dtype=np.uint8), flag)
+        else:
+            img = None
+        if img is None:
+            raise ValueError(f"无法读取图片: {image.path}")
+        return img
 
     def _load_image(
         self,
-        image: Union[str, Path, np.ndarray, Image.Image]
+        image: Union[str, Path, DecodedImage, np.ndarray, Image.Image]
     ) -> np.ndarray:
-        """加载图片为 numpy 数组 (BGR)"""
+        """加载图片为 numpy 数组 (BGR)，最长边不超过 analysis_max_side"""
         if isinstance(image, (str, Path)):
-            img = cv2.imread(str(image))
-            if img is None:
-                raise ValueError(f"无法读取图片: {image}")
-            return img
+            img = self._decode(DecodedImage(str(image)))
+        elif isinstance(image, DecodedImage):
+            img = self._decode(image)
         elif isinstance(image, Image.Image):
             img = np.array(image.convert("RGB"))
-            return cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+            img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
         elif isinstance(image, np.ndarray):
             if len(image.shape) == 2:
-                return cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
-            if image.shape[2] == 4:
-                return cv2.cvtColor(image, cv2.COLOR_RGBA2BGR)
+                img = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            elif image.shape[2] == 4:
+                img = cv2.cvtColor(image, cv2.COLOR_RGBA2BGR)
             # 假设输入是 RGB
-            if image.shape[2] == 3:
-                return cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-            return image
+            elif image.shape[2] == 3:
+                img = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
+            else:
+                img = image
         else:
             raise ValueError(f"不支持的图片类型: {type(image)}")
+        return self._downscale(img)
 
-    def assess_sharpness(self, image: np.ndarray) -> float:
-        """
-        评估图片清晰度
-
-        使用 Laplacian 算子的方差作为清晰度指标
-
-        Args:
-            image: BGR 图片
-
-        Returns:
-            清晰度分数 (0-1)
-        """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        laplacian = cv2.Laplacian(gray, cv2.CV_64F)
-        variance = laplacian.var()
+    def _downscale(self, image: np.ndarray) -> np.ndarray:
+        """最长边缩小到 analysis_max_side（INTER_AREA）"""
+        max_side = self.quality_config.analysis_max_side
+        h, w = image.shape[:2]
+        if max_side <= 0 or max(h, w) <= max_side:
+            return image
+        scale = max_side / max(h, w)
+        size = (max(1, round(w * scale)), max(1, round(h * scale)))
+        return cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+
+    @staticmethod
+    def _histogram(channel: np.ndarray) -> np.ndarray:
+        """单通道 8 位图片的 256 级直方图 (float64)"""
+        return cv2.calcHist([channel], [0], None, [256], [0, 256]).ravel().astype(np.float64)
+
+    @staticmethod
+    def _histogram_mean(hist: np.ndarray) -> float:
+        """由直方图计算均值"""
+        return float(np.dot(hist, np.arange(256)) / hist.sum())
+
+    @staticmethod
+    def _sharpness_score(gray: np.ndarray) -> float:
+        """灰度图 Laplacian 方差 -> 清晰度分数"""
+        laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+        # meanStdDev 以双精度累加，结果与 float64 Laplacian 的方差一致
+        _, std = cv2.meanStdDev(laplacian)
+        variance = float(std[0, 0]) ** 2
 
         # 归一化到 0-1（经验阈值）
         # variance < 100: 模糊, variance > 1000: 清晰
-        score = min(variance / 1000.0, 1.0)
-        return score
-
-    def assess_exposure(self, image: np.ndarray) -> float:
-        """
-        评估图片曝光
+        return min(variance / 1000.0, 1.0)
 
-        分析直方图分布评估曝光是否正确
+    def _exposure_score(self, image: np.ndarray) -> float:
+        """LAB 亮度通道直方图 -> 曝光分数"""
+        # 转换到 LAB 色彩空间，只保留亮度通道
+        l_channel = cv2.extractChannel(cv2.cvtColor(image, cv2.COLOR_BGR2LAB), 0)
 
-        Args:
-            image: BGR 图片
-
-        Returns:
-            曝光分数 (0-1)
-        """
-        # 转换到 LAB 色彩空间
-        lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-        l_channel = lab[:, :, 0]
-
-        # 计算亮度直方图
-        hist = cv2.calcHist([l_channel], [0], None, [256], [0, 256])
-        hist = hist.flatten() / hist.sum()
-
-        # 计算亮度均值和标准差
-        mean_brightness = np.mean(l_channel)
-        std_brightness = np.std(l_channel)
+        # 均值、过曝和欠曝比例都由同一个亮度直方图得出
+        hist = self._histogram(l_channel)
+        total = hist.sum()
+        mean_brightness = self._histogram_mean(hist)
 
         # 理想亮度在 100-150 之间
         brightness_score = 1.0 - abs(mean_brightness - 127) / 127.0
         brightness_score = max(0, brightness_score)
 
         # 检查过曝和欠曝
-        overexposed = np.sum(l_channel > 250) / l_channel.size
-        underexposed = np.sum(l_channel < 5) / l_channel.size
+        overexposed = hist[251:].sum() / total
+        underexposed = hist[:5].sum() / total
 
         # 惩罚过曝和欠曝
         exposure_penalty = overexposed * 0.5 + underexposed * 0.5
@@ -135,26 +194,16 @@ class ImageQualityAssessor:
 
         return max(0, min(1, score))
 
-    def assess_composition(self, image: np.ndarray) -> float:
-        """
-        评估图片构图
-
-        检查主体位置是否符合三分法则
-
-        Args:
-            image: BGR 图片
-
-        Returns:
-            构图分数 (0-1)
-        """
-        h, w = image.shape[:2]
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    @staticmethod
+    def _composition_score(gray: np.ndarray) -> float:
+        """灰度图边缘质心与三分点的距离 -> 构图分数"""
+        h, w = gray.shape[:2]
 
         # 使用边缘检测找主体
         edges = cv2.Canny(gray, 50, 150)
 
         # 计算边缘质心
-        moments = cv2.moments(edges)
+        moments = cv2.moments(edges, binaryImage=True)
         if moments["m00"] == 0:
             return 0.5  # 无法检测到明显主体
 
@@ -172,6 +221,85 @@ class ImageQualityAssessor:
         score = 1.0 - (min_dist_x + min_dist_y) / 2
         return max(0, min(1, score))
 
+    @staticmethod
+    def _noise_score(gray: np.ndarray) -> float:
+        """灰度图与其高斯模糊之差的标准差 -> 噪点分数"""
+        noise = gray.astype(np.float32)
+
+        # 使用高斯滤波估计噪声（float32，原地相减）
+        blurred = cv2.GaussianBlur(noise, (5, 5), 0)
+        cv2.subtract(noise, blurred, dst=noise)
+        _, std = cv2.meanStdDev(noise)
+        noise_level = float(std[0, 0])
+
+        # 归一化（经验值：noise_level < 5 好，> 20 差）
+        score = 1.0 - min(noise_level / 20.0, 1.0)
+        return max(0, score)
+
+    def _color_score(self, image: np.ndarray) -> float:
+        """饱和度直方图均值和通道均值差 -> 色彩分数"""
+        # 转换到 HSV，只保留饱和度通道
+        saturation = cv2.extractChannel(cv2.cvtColor(image, cv2.COLOR_BGR2HSV), 1)
+        mean_sat = self._histogram_mean(self._histogram(saturation))
+
+        # 理想饱和度在 60-150 之间
+        sat_score = 1.0 - abs(mean_sat - 100) / 100.0
+        sat_score = max(0, sat_score)
+
+        # 检查白平衡（一次遍历得到各通道均值）
+        mean_b, mean_g, mean_r = cv2.mean(image)[:3]
+        mean_diff = abs(mean_r - mean_g) + abs(mean_g - mean_b)
+        wb_score = 1.0 - min(mean_diff / 50.0, 1.0)
+
+        score = (sat_score + wb_score) / 2
+        return max(0, min(1, score))
+
+    @staticmethod
+    def _gray(image: np.ndarray) -> np.ndarray:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    def assess_sharpness(self, image: np.ndarray) -> float:
+        """
+        评估图片清晰度
+
+        使用 Laplacian 算子的方差作为清晰度指标
+
+        Args:
+            image: BGR 图片
+
+        Returns:
+            清晰度分数 (0-1)
+        """
+        return self._sharpness_score(self._gray(image))
+
+    def assess_exposure(self, image: np.ndarray) -> float:
+        """
+        评估图片曝光
+
+        分析直方图分布评估曝光是否正确
+
+        Args:
+            image: BGR 图片
+
+        Returns:
+            曝光分数 (0-1)
+        """
+        return self._exposure_score(image)
+
+    def assess_composition(self, image: np.ndarray) -> float:
+        """
+        评估图片构图
+
+        检查主体位置是否符合三分法则
+
+        Args:
+            image: BGR 图片
+
+        Returns:
+            构图分数 (0-1)
+        """
+        return self._composition_score(self._gray(image))
+
     def assess_noise(self, image: np.ndarray) -> float:
         """
         评估图片噪点水平
@@ -182,16 +310,7 @@ class ImageQualityAssessor:
         Returns:
             噪点分数 (0-1)，分数越高表示噪点越少
         """
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).astype(np.float64)
-
-        # 使用高斯滤波估计噪声
-        blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-        noise = gray - blurred
-        noise_level = np.std(noise)
-
-        # 归一化（经验值：noise_level < 5 好，> 20 差）
-        score = 1.0 - min(noise_level / 20.0, 1.0)
-        return max(0, score)
+        return self._noise_score(self._gray(image))
 
     def assess_color(self, image: np.ndarray) -> float:
         """
@@ -205,33 +324,17 @@ class ImageQualityAssessor:
         Returns:
             色彩分数 (0-1)
         """
-        # 转换到 HSV
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        saturation = hsv[:, :, 1]
-
-        # 计算饱和度
-        mean_sat = np.mean(saturation)
-        std_sat = np.std(saturation)
-
-        # 理想饱和度在 60-150 之间
-        sat_score = 1.0 - abs(mean_sat - 100) / 100.0
-        sat_score = max(0, sat_score)
-
-        # 检查白平衡（通过计算各通道均值差异）
-        b, g, r = cv2.split(image)
-        mean_diff = abs(np.mean(r) - np.mean(g)) + abs(np.mean(g) - np.mean(b))
-        wb_score = 1.0 - min(mean_diff / 50.0, 1.0)
-
-        score = (sat_score + wb_score) / 2
-        return max(0, min(1, score))
+        return self._color_score(image)
 
     def assess(
         self,
-        image: Union[str, Path, np.ndarray, Image.Image]
+        image: Union[str, Path, DecodedImage, np.ndarray, Image.Image]
     ) -> Dict[str, Any]:
         """
         综合评估图片质量
 
+        输入为文件路径且配置了结果缓存时，内容相同的图片直接返回缓存结果
+
         Args:
             image: 输入图片
 
@@ -249,15 +352,36 @@ class ImageQualityAssessor:
                 }
             }
         """
+        return self.assess_many([image], workers=0)[0]
+
+    def _cache_version(self) -> str:
+        """质量评估结果的缓存版本（评估权重和阈值）"""
+        return json.dumps(asdict(self.quality_config), sort_keys=True)
+
+    @staticmethod
+    def _cacheable(image) -> bool:
+        """只有来自文件的图片可以按内容哈希缓存"""
+        return isinstance(image, (str, Path, DecodedImage))
+
+    @staticmethod
+    def _cache_source(image) -> Union[str, DecodedImage]:
+        return image if isinstance(image, DecodedImage) else str(image)
+
+    def _assess(
+        self,
+        image: Union[str, Path, DecodedImage, np.ndarray, Image.Image]
+    ) -> Dict[str, Any]:
+        """综合评估图片质量（不经过缓存），返回结构同 assess()"""
         try:
             img = self._load_image(image)
+            gray = self._gray(img)
 
-            # 评估各指标
-            sharpness = self.assess_sharpness(img)
-            exposure = self.assess_exposure(img)
-            composition = self.assess_composition(img)
-            noise = self.assess_noise(img)
-            color = self.assess_color(img)
+            # 评估各指标（灰度类指标共用同一份灰度图）
+            sharpness = self._sharpness_score(gray)
+            exposure = self._exposure_score(img)
+            composition = self._composition_score(gray)
+            noise = self._noise_score(gray)
+            color = self._color_score(img)
 
             # 加权计算总分
             weights = self.quality_config
@@ -294,9 +418,104 @@ class ImageQualityAssessor:
                 "error": str(e)
             }
 
+    def assess_many(
+        self,
+        images: List[Union[str, Path, DecodedImage, np.ndarray, Image.Image]],
+        workers: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量评估图片质量
+
+        workers > 1 且进程池可用时在进程池中并行评估（每个工作进程持有一个评估器，
+        OpenCV 线程数限制为 worker_opencv_threads，避免与模型推理争抢 CPU 核心）；
+        命中结果缓存的图片不再送入进程池；已解码的 DecodedImage 把像素传给工作进程（不再重复解码），
+        未解码的只传原始字节、在工作进程中解码
+
+        Args:
+            images: 输入图片列表（路径、DecodedImage 或像素数组）
+            workers: 为 0 或 1 时在调用线程中评估，默认使用配置的 quality.workers
+                     （进程池大小在构造时确定）
+
+        Returns:
+            与 images 顺序一致的评估结果列表，结构同 assess()
+        """
+        workers = self.workers if workers is None else int(workers)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(images)
+
+        pending = []
+        for i, image in enumerate(images):
+            if self.result_cache is not None and self._cacheable(image):
+                results[i] = self.result_cache.get('quality', self._cache_version(), self._cache_source(image))
+            if results[i] is None:
+                pending.append(i)
+
+        pool = self._pool
+        if workers > 1 and len(pending) > 1 and pool is not None:
+            try:
+                computed = list(pool.map(
+                    _assess_in_worker,
+                    [images[i] for i in pending],
+                    chunksize=self.chunksize
+                ))
+            except Exception as e:
+                # 工作进程异常退出等情况：关闭进程池，之后都在调用线程中评估
+                # （此时进程中已有推理等线程，不再 fork 新的进程池）
+                logger.error(f"质量评估进程池失败，改为逐张评估: {e}")
+                self._shutdown_pool()
+                computed = [self._assess(images[i]) for i in pending]
+        else:
+            computed = [self._assess(images[i]) for i in pending]
+
+        for i, result in zip(pending, computed):
+            results[i] = result
+            if self.result_cache is not None and self._cacheable(images[i]) and result.get('success'):
+                try:
+                    self.result_cache.put('quality', self._cache_version(), self._cache_source(images[i]), result)
+                except Exception as e:
+                    logger.warning(f"缓存质量评估结果失败: {e}")
+        return results
+
+    def _start_pool(self):
+        """
+        创建进程池并立即启动全部工作进程
+
+        在构造时（AIPredictor 初始化，推理、OCR、流水线等线程启动之前）完成 fork：
+        在多线程进程中 fork 会把其他线程持有的锁（malloc、OpenCV 线程池等）复制到子进程，
+        子进程可能因此死锁，所以进程池只在这里创建一次，失效或关闭后改为在调用线程中评估。
+        不使用 spawn/forkserver：其子进程会重新导入主模块（python app.py 时会再次执行启动预测）
+        """
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker,
+            initargs=(self._worker_config, self.worker_opencv_threads)
+        )
+        try:
+            # fork 方式下首次提交任务时一次性启动全部工作进程
+            pool.submit(_worker_ready).result(timeout=POOL_START_TIMEOUT)
+        except Exception as e:
+            logger.error(f"质量评估进程池启动失败，改为逐张评估: {e}")
+            pool.shutdown(wait=False, cancel_futures=True)
+            return
+        self._pool = pool
+        logger.info(
+            f"Quality assessment process pool started "
+            f"(workers={self.workers}, opencv_threads={self.worker_opencv_threads})"
+        )
+
+    def _shutdown_pool(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+
+    def cleanup(self):
+        """关闭批量评估的进程池（之后在调用线程中评估）"""
+        self._shutdown_pool()
+
     def quick_assess(
         self,
-        image: Union[str, Path, np.ndarray, Image.Image]
+        image: Union[str, Path, DecodedImage, np.ndarray, Image.Image]
     ) -> Dict[str, Any]:
         """
         快速评估（仅评估清晰度）
@@ -328,6 +547,27 @@ class ImageQualityAssessor:
             }
 
 
+# 进程池工作进程中的评估器（由 _init_worker 创建）
+_worker_assessor: Optional[ImageQualityAssessor] = None
+
+
+def _init_worker(config: Dict[str, Any], opencv_threads: int):
+    """进程池工作进程初始化：限制 OpenCV 线程数并创建评估器"""
+    global _worker_assessor
+    cv2.setNumThreads(opencv_threads)
+    _worker_assessor = ImageQualityAssessor(config)
+
+
+def _worker_ready() -> bool:
+    """进程池启动检查（工作进程初始化完成后返回）"""
+    return _worker_assessor is not None
+
+
+def _assess_in_worker(image) -> Dict[str, Any]:
+    """在工作进程中评估单张图片（不经过缓存）"""
+    return _worker_assessor._assess(image)
+
+
 # 全局实例
 _assessor: Optional[ImageQualityAssessor] = None
 
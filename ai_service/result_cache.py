@@ -0,0 +1,260 @@
+"""
+内容寻址的结果缓存
+以 文件内容哈希 + 结果类型 + 版本 为键，把分类、OCR、质量评估结果保存在 SQLite：
+同一张图片改名、重新上传或重新导入后无需再次推理，也不必再调用 OCR 服务
+
+版本由调用方给出（模型文件哈希、OCR 接口与裁剪参数、质量评估权重等），
+版本变化后旧结果自然失效；总大小超过上限时按最近使用时间（LRU）淘汰
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Union
+
+from .decoded_image import DecodedImage, content_hasher
+
+logger = logging.getLogger(__name__)
+
+
+# 文件哈希的内存缓存条数（同一文件在分类、OCR、质量评估中只读一遍）
+FILE_HASH_MEMO_SIZE = 4096
+
+# 淘汰时降到上限的比例，避免每次写入都触发淘汰
+EVICT_TARGET_RATIO = 0.9
+
+
+class ResultCache:
+    """SQLite 结果缓存（按总大小 LRU 淘汰）"""
+
+    def __init__(self, path: str, max_size_mb: float = 512):
+        """
+        初始化结果缓存
+
+        Args:
+            path: SQLite 文件路径
+            max_size_mb: 缓存结果的总大小上限（MB）
+        """
+        self.path = path
+        self.max_size_bytes = int(max_size_mb * 1024 * 1024)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        # 单个连接 + 锁：写入都很小，预测线程之间串行即可
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS result_cache (
+                key TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_used REAL NOT NULL,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_result_cache_last_used ON result_cache(last_used)"
+        )
+        self._lock = threading.Lock()
+
+        self._total_size = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM result_cache"
+        ).fetchone()[0]
+        self._hits: Dict[str, int] = {}
+        self._misses: Dict[str, int] = {}
+
+        self._hash_memo: "OrderedDict[tuple, str]" = OrderedDict()
+        self._hash_lock = threading.Lock()
+
+        logger.info(
+            f"ResultCache initialized (path={path}, size={self._total_size / 1024 / 1024:.1f}MB, "
+            f"max={max_size_mb}MB)"
+        )
+
+    @classmethod
+    def from_config(cls, config: Optional[Dict[str, Any]]) -> Optional['ResultCache']:
+        """
+        根据 result_cache 配置创建缓存，未启用或创建失败时返回 None
+
+        Args:
+            config: result_cache 配置（enabled、path、max_size_mb）
+        """
+        config = config or {}
+        if not config.get('enabled', False):
+            return None
+        try:
+            return cls(
+                config.get('path', './data/result_cache.db'),
+                max_size_mb=config.get('max_size_mb', 512)
+            )
+        except Exception as e:
+            logger.error(f"Failed to open result cache, caching disabled: {e}")
+            return None
+
+    def file_hash(self, file_path: str) -> Optional[str]:
+        """
+        文件内容哈希（按 路径 + 修改时间 + 大小 记忆），无法读取时返回 None
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        memo_key = (os.path.abspath(file_path), stat.st_mtime_ns, stat.st_size)
+
+        with self._hash_lock:
+            digest = self._hash_memo.get(memo_key)
+            if digest is not None:
+                self._hash_memo.move_to_end(memo_key)
+                return digest
+
+        hasher = content_hasher()
+        try:
+            with open(file_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    hasher.update(block)
+        except OSError:
+            return None
+        digest = hasher.hexdigest()
+
+        with self._hash_lock:
+            self._hash_memo[memo_key] = digest
+            while len(self._hash_memo) > FILE_HASH_MEMO_SIZE:
+                self._hash_memo.popitem(last=False)
+        return digest
+
+    def _key(self, kind: str, version: str, image: Union[str, DecodedImage]) -> Optional[str]:
+        # 已读入内存的图片直接对字节求哈希，不再读取文件
+        if isinstance(image, DecodedImage):
+            digest = image.content_hash
+        else:
+            digest = self.file_hash(image)
+        if digest is None:
+            return None
+        version_digest = hashlib.sha1(version.encode('utf-8')).hexdigest()[:16]
+        return f"{kind}:{version_digest}:{digest}"
+
+    def get(self, kind: str, version: str, image: Union[str, DecodedImage]) -> Optional[Any]:
+        """
+        读取缓存结果
+
+        Args:
+            kind: 结果类型（prediction / ocr / quality）
+            version: 结果版本
+            image: 图片文件路径或 DecodedImage
+
+        Returns:
+            缓存的结果，未命中时返回 None
+        """
+        key = self._key(kind, version, image)
+        value = None
+        with self._lock:
+            if key is not None:
+                row = self._conn.execute(
+                    "SELECT value FROM result_cache WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE result_cache SET last_used = ? WHERE key = ?", (time.time(), key)
+                    )
+                    value = json.loads(row[0])
+            counter = self._hits if value is not None else self._misses
+            counter[kind] = counter.get(kind, 0) + 1
+        return value
+
+    def put(self, kind: str, version: str, image: Union[str, DecodedImage], value: Any):
+        """
+        写入缓存结果（value 需可 JSON 序列化），超过大小上限时淘汰最久未使用的结果
+        """
+        key = self._key(kind, version, image)
+        if key is None:
+            return
+        data = json.dumps(value, ensure_ascii=False)
+        size = len(data.encode('utf-8'))
+        if size > self.max_size_bytes:
+            return
+
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT size FROM result_cache WHERE key = ?", (key,)
+            ).fetchone()
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO result_cache (key, kind, value, size, last_used, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (key, kind, data, size, now, now)
+            )
+            self._total_size += size - (row[0] if row else 0)
+            if self._total_size > self.max_size_bytes:
+                self._evict()
+
+    def _evict(self):
+        """按最近使用时间淘汰到上限的 EVICT_TARGET_RATIO 以下（调用方持有锁）"""
+        target = int(self.max_size_bytes * EVICT_TARGET_RATIO)
+        evicted = 0
+        while self._total_size > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM result_cache ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._total_size = 0
+                break
+            keys = []
+            for key, size in rows:
+                keys.append(key)
+                self._total_size -= size
+                if self._total_size <= target:
+                    break
+            self._conn.executemany("DELETE FROM result_cache WHERE key = ?", [(key,) for key in keys])
+            evicted += len(keys)
+        logger.info(f"ResultCache evicted {evicted} entries ({self._total_size / 1024 / 1024:.1f}MB left)")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """缓存统计：条数、大小、各类型命中/未命中次数"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM result_cache GROUP BY kind"
+            ).fetchall()
+            hits = dict(self._hits)
+            misses = dict(self._misses)
+        kinds = {}
+        for kind in sorted(set(hits) | set(misses) | {row[0] for row in rows}):
+            kind_hits, kind_misses = hits.get(kind, 0), misses.get(kind, 0)
+            lookups = kind_hits + kind_misses
+            kinds[kind] = {
+                'entries': 0,
+                'size_bytes': 0,
+                'hits': kind_hits,
+                'misses': kind_misses,
+                'hit_rate': kind_hits / lookups if lookups else 0.0
+            }
+        for kind, entries, size in rows:
+            kinds[kind]['entries'] = entries
+            kinds[kind]['size_bytes'] = size
+        return {
+            'entries': sum(row[1] for row in rows),
+            'size_bytes': sum(row[2] for row in rows),
+            'max_size_bytes': self.max_size_bytes,
+            'kinds': kinds
+        }
+
+    def clear(self):
+        """清空缓存（命中统计保留）"""
+        with self._lock:
+            self._conn.execute("DELETE FROM result_cache")
+            self._total_size = 0
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
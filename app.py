@@ -2,19 +2,25 @@
 Flask 后端 API
 """
 import os
-import csv
+import atexit
 import json
 import shutil
-import zipfile
 import requests
 import base64
+import uuid
 import logging
+import threading
 import traceback
-from io import StringIO, BytesIO
 from flask import Flask, jsonify, request, send_file, Response, send_from_directory
 from flask_cors import CORS
 from dotenv import load_dotenv
-from database import Database
+from database import Database, INVENTORY_UNLABELED
+from image_inventory import ImageInventory
+from prediction_writer import PredictionWriter
+from bulk_approve import BulkApprover
+from export_jobs import ExportJobManager, EXPORT_FILE_NAMES, iter_export
+from embedding_store import EmbeddingStore
+from prediction_jobs import PredictionJobManager
 from ai_service.ai_predictor import AIPredictor
 
 load_dotenv()
@@ -38,8 +44,25 @@ CORS(app)
 IMAGES_DIR = os.getenv('IMAGES_DIR', './images')
 LABELED_DIR = os.getenv('LABELED_DIR', './labeled')
 DATABASE_PATH = os.getenv('DATABASE_PATH', './labels.db')
-EXPORT_IMAGES_THRESHOLD = int(os.getenv('EXPORT_IMAGES_THRESHOLD', '100'))
 AI_CONFIG_PATH = os.getenv('AI_CONFIG_PATH', './config.yaml')
+INVENTORY_RESCAN_SECONDS = float(os.getenv('INVENTORY_RESCAN_SECONDS', '300'))
+MAX_IMAGES_PAGE_SIZE = int(os.getenv('MAX_IMAGES_PAGE_SIZE', '1000'))
+PREDICTION_WRITE_BATCH_SIZE = int(os.getenv('PREDICTION_WRITE_BATCH_SIZE', '64'))
+PREDICTION_WRITE_INTERVAL_MS = int(os.getenv('PREDICTION_WRITE_INTERVAL_MS', '500'))
+BULK_APPROVE_WORKERS = int(os.getenv('BULK_APPROVE_WORKERS', '8'))
+# 后台导出产物目录（默认与数据库同目录）
+EXPORT_SPOOL_DIR = os.getenv(
+    'EXPORT_SPOOL_DIR', os.path.join(os.path.dirname(DATABASE_PATH) or '.', 'exports')
+)
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '2'))
+EXPORT_RETENTION_HOURS = float(os.getenv('EXPORT_RETENTION_HOURS', '24'))
+# 预测特征向量存储目录（默认与数据库同目录）和存储精度
+EMBEDDING_STORE_DIR = os.getenv(
+    'EMBEDDING_STORE_DIR', os.path.join(os.path.dirname(DATABASE_PATH) or '.', 'embeddings')
+)
+EMBEDDING_DTYPE = os.getenv('EMBEDDING_DTYPE', 'float16')
+# 启动预测每轮处理的图片数（进度和断点的粒度）
+STARTUP_PREDICTION_CHUNK_SIZE = int(os.getenv('STARTUP_PREDICTION_CHUNK_SIZE', '256'))
 
 # 确保目录存在
 os.makedirs(IMAGES_DIR, exist_ok=True)
@@ -47,12 +70,13 @@ os.makedirs(LABELED_DIR, exist_ok=True)
 
 # 初始化数据库
 db = Database(DATABASE_PATH)
+atexit.register(db.close)
 
 # 加载预置数据
 data_dir = os.path.join(os.path.dirname(__file__), 'data')
 db.load_preset_data(data_dir)
 
-# 初始化AI预测服务
+# 初始化AI预测服务（须在启动后台线程之前：质量评估进程池在构造时 fork）
 try:
     ai_predictor = AIPredictor(AI_CONFIG_PATH)
     ai_enabled = True
@@ -109,100 +133,158 @@ def is_image_file(filename: str) -> bool:
     return ext in IMAGE_EXTENSIONS
 
 
+_image_inventory = None
+
+
+def get_image_inventory() -> ImageInventory:
+    """获取待标注图片清单（db 或 IMAGES_DIR 变化时重新创建）"""
+    global _image_inventory
+    if (_image_inventory is None
+            or _image_inventory.db is not db
+            or _image_inventory.images_dir != IMAGES_DIR):
+        _image_inventory = ImageInventory(
+            db, IMAGES_DIR, IMAGE_EXTENSIONS,
+            rescan_interval=INVENTORY_RESCAN_SECONDS
+        )
+    return _image_inventory
+
+
+_export_manager = None
+
+
+def get_export_manager() -> ExportJobManager:
+    """获取后台导出任务管理（db 或目录配置变化时重新创建）"""
+    global _export_manager
+    if (_export_manager is None
+            or _export_manager.db is not db
+            or _export_manager.labeled_dir != LABELED_DIR
+            or _export_manager.spool_dir != EXPORT_SPOOL_DIR):
+        if _export_manager is not None:
+            _export_manager.shutdown()
+        _export_manager = ExportJobManager(
+            db, LABELED_DIR, EXPORT_SPOOL_DIR,
+            max_workers=EXPORT_WORKERS,
+            retention_seconds=EXPORT_RETENTION_HOURS * 3600
+        )
+    return _export_manager
+
+
+_embedding_store = None
+
+
+def get_embedding_store() -> EmbeddingStore:
+    """获取特征向量存储（db 或目录配置变化时重新创建）"""
+    global _embedding_store
+    if (_embedding_store is None
+            or _embedding_store.db is not db
+            or _embedding_store.store_dir != EMBEDDING_STORE_DIR):
+        _embedding_store = EmbeddingStore(db, EMBEDDING_STORE_DIR, dtype=EMBEDDING_DTYPE)
+    return _embedding_store
+
+
+def load_embedding_history(model_version: str, limit: int = None) -> tuple:
+    """读取已存储的历史特征向量（持久化 HDBSCAN 拟合使用）"""
+    return get_embedding_store().get(model_version, limit=limit)
+
+
+if ai_predictor is not None:
+    ai_predictor.embedding_history = load_embedding_history
+
+
+def create_prediction_writer() -> PredictionWriter:
+    """创建 AI 预测结果批量写入缓冲"""
+    return PredictionWriter(
+        db,
+        batch_size=PREDICTION_WRITE_BATCH_SIZE,
+        flush_interval_ms=PREDICTION_WRITE_INTERVAL_MS
+    )
+
+
+def mark_new_classes(batch_result: dict) -> int:
+    """预测结束后批量更新新类别标记"""
+    predictions = batch_result['predictions']
+    items = [
+        (predictions[idx]['filename'], predictions[idx].get('outlier_score', 0.0))
+        for idx in batch_result.get('new_class_indices', [])
+        if idx < len(predictions)
+    ]
+    return db.bulk_update_new_class_flags(items)
+
+
+# 批量预测（后台任务的每一轮和手动批量预测）串行执行，避免同一批未标注图片被重复预测
+_batch_prediction_lock = threading.Lock()
+
+
+def collect_startup_prediction_images() -> list:
+    """刷新图片清单，返回未标注、未跳过且尚无 AI 预测的图片路径（按文件名排序）"""
+    with _batch_prediction_lock:
+        inventory = get_image_inventory()
+        inventory.refresh(force=True)
+        logger.info(f"Image inventory: {db.get_inventory_counts()}")
+        return [
+            os.path.join(IMAGES_DIR, filename)
+            for filename in db.get_inventory_filenames((INVENTORY_UNLABELED,))
+        ]
+
+
+def predict_startup_chunk(image_paths: list) -> dict:
+    """预测一轮图片并批量写入数据库，返回本轮的保存/重复/失败/新类别数"""
+    with _batch_prediction_lock, create_prediction_writer() as writer:
+        batch_result = ai_predictor.predict_batch(
+            image_paths, detect_new_classes=True, on_prediction_callback=writer.on_prediction,
+            on_embeddings_callback=get_embedding_store().add
+        )
+
+    # 处理新类别检测（需要在本轮预测完成后执行）
+    new_class_count = batch_result['statistics'].get('new_class_count', 0)
+    if new_class_count > 0:
+        try:
+            mark_new_classes(batch_result)
+        except Exception as e:
+            logger.error(f"Failed to update new_class flags: {e}")
+
+    return {
+        'saved': writer.saved,
+        'duplicates': writer.duplicates,
+        'errors': writer.errors,
+        'new_class_count': new_class_count
+    }
+
+
+_prediction_job_manager = None
+
+
+def get_prediction_job_manager() -> PredictionJobManager:
+    """获取后台预测任务管理（db 变化时重新创建）"""
+    global _prediction_job_manager
+    if _prediction_job_manager is None or _prediction_job_manager.db is not db:
+        if _prediction_job_manager is not None:
+            _prediction_job_manager.shutdown()
+        _prediction_job_manager = PredictionJobManager(
+            db, collect_startup_prediction_images, predict_startup_chunk,
+            chunk_size=STARTUP_PREDICTION_CHUNK_SIZE
+        )
+    return _prediction_job_manager
+
+
 def run_startup_ai_prediction():
-    """启动时对未标注图片进行 AI 预测"""
-    logger.info("="*60)
-    logger.info("run_startup_ai_prediction START")
-    logger.info(f"ai_enabled={ai_enabled}, ai_predictor={ai_predictor}")
-    logger.info(f"IMAGES_DIR={IMAGES_DIR}")
-    logger.info(f"IMAGES_DIR exists: {os.path.exists(IMAGES_DIR)}")
-    logger.info("="*60)
-    
+    """启动时在后台对未标注图片进行 AI 预测（立即返回，进度见 /api/ai/prediction-job）"""
     if not ai_enabled or ai_predictor is None:
         logger.info("AI predictor not enabled, skipping startup prediction")
         return
 
-    try:
-        logger.info("Starting to collect images for prediction...")
-        # 获取已标注和已跳过的文件
-        labeled_files = db.get_labeled_original_filenames()
-        logger.info(f"Labeled files: {len(labeled_files)}")
-        
-        skipped_files = db.get_skipped_filenames()
-        logger.info(f"Skipped files: {len(skipped_files)}")
-
-        # 获取已有 AI 预测的文件
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT filename FROM ai_predictions')
-        predicted_files = {row[0] for row in cursor.fetchall()}
-        conn.close()
-        logger.info(f"Already predicted files: {len(predicted_files)}")
-
-        # 找出需要预测的图片
-        image_paths = []
-        logger.info(f"IMAGES_DIR exists check: {os.path.exists(IMAGES_DIR)}")
-        
-        if os.path.exists(IMAGES_DIR):
-            all_files = os.listdir(IMAGES_DIR)
-            logger.info(f"Total files in IMAGES_DIR: {len(all_files)}")
-            
-            for filename in all_files:
-                is_img = is_image_file(filename)
-                not_labeled = filename not in labeled_files
-                not_skipped = filename not in skipped_files
-                not_predicted = filename not in predicted_files
-                
-                if is_img and not_labeled and not_skipped and not_predicted:
-                    image_paths.append(os.path.join(IMAGES_DIR, filename))
-
-        logger.info(f"Found {len(image_paths)} images to predict")
-
-        if not image_paths:
-            logger.info("No new images to predict at startup")
-            return
-
-        logger.info(f"Starting AI prediction for {len(image_paths)} images...")
-
-        # 实时数据库写入回调
-        success_count = 0
-        error_count = 0
-        
-        def save_to_db(index, result):
-            nonlocal success_count, error_count
-            try:
-                resp = db.add_ai_prediction(result)
-                if isinstance(resp, dict) and resp.get('error'):
-                    logger.warning(f"Prediction already exists, skip save: {result.get('filename')}")
-                else:
-                    success_count += 1
-                    logger.info(f"Saved prediction {success_count} to DB: {result.get('filename')}")
-            except Exception as e:
-                error_count += 1
-                logger.error(f"Failed to save prediction to DB: {result.get('filename')}: {e}")
-
-        # 批量预测（使用流式回调）
-        batch_result = ai_predictor.predict_batch(image_paths, detect_new_classes=True, on_prediction_callback=save_to_db)
-        logger.info(f"predict_batch returned with {len(batch_result['predictions'])} results")
-
-        # 处理新类别检测（需要在所有预测完成后执行）
-        new_class_count = batch_result['statistics'].get('new_class_count', 0)
-        if new_class_count > 0:
-            logger.info(f"Detected {new_class_count} new classes, updating their is_new_class flag")
-            for idx in batch_result['new_class_indices']:
-                if idx < len(batch_result['predictions']):
-                    pred = batch_result['predictions'][idx]
-                    # 更新数据库中的is_new_class标记
-                    try:
-                        db.update_ai_prediction_new_class_flag(pred['filename'], 1, pred.get('outlier_score', 0.0))
-                    except Exception as e:
-                        logger.error(f"Failed to update new_class flag for {pred['filename']}: {e}")
-
-        logger.info(f"Startup AI prediction: {success_count} succeeded, {error_count} failed")
-        logger.info(f"Statistics: {batch_result['statistics']}")
+    auto_annotate = ai_predictor.get_config().get('auto_annotate', {})
+    if not auto_annotate.get('auto_trigger', True):
+        logger.info("auto_annotate.auto_trigger disabled, skipping startup prediction")
+        return
 
+    try:
+        manager = get_prediction_job_manager()
+        status = manager.start(trigger='startup')
+        atexit.register(manager.shutdown)
+        logger.info(f"Startup AI prediction running in background: job {status['job']['id']}")
     except Exception as e:
-        logger.error(f"Startup AI prediction FAILED: {e}")
+        logger.error(f"Failed to start startup AI prediction: {e}")
         logger.error(traceback.format_exc())
 
 
@@ -210,54 +292,71 @@ def run_startup_ai_prediction():
 
 @app.route('/api/images', methods=['GET'])
 def get_images():
-    """获取待标注图片列表（包含 AI 预测结果）"""
+    """获取待标注图片列表（包含 AI 预测结果）
+
+    支持键集分页：limit 为每页数量（不传则返回全部），after 为上一页返回的 next_cursor；
+    sort 可选 filename / confidence / outlier_score / priority；
+    过滤条件 is_new_class、quality_pass（0/1）以及 min_confidence、max_confidence
+    """
     user_id = request.args.get('user_id', '')
-    labeled_files = db.get_labeled_original_filenames()
-    skipped_files = db.get_skipped_filenames()
+    after = request.args.get('after') or None
+    limit = request.args.get('limit', type=int)
+    sort = request.args.get('sort', 'filename')
+    filters = {
+        'is_new_class': request.args.get('is_new_class', type=int),
+        'quality_pass': request.args.get('quality_pass', type=int),
+        'min_confidence': request.args.get('min_confidence', type=float),
+        'max_confidence': request.args.get('max_confidence', type=float)
+    }
+
+    if limit is not None and not 1 <= limit <= MAX_IMAGES_PAGE_SIZE:
+        return jsonify({'error': f'limit 必须在 1-{MAX_IMAGES_PAGE_SIZE} 之间'}), 400
+
+    get_image_inventory().refresh()
+    try:
+        # 翻页时不再重复统计总数
+        view = db.get_inbox_view(
+            user_id=user_id, limit=limit, sort=sort, after=after,
+            filters=filters, with_total=after is None
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
     images = []
-    if os.path.exists(IMAGES_DIR):
-        for filename in os.listdir(IMAGES_DIR):
-            if is_image_file(filename) and filename not in labeled_files and filename not in skipped_files:
-                # 检查是否被锁定（排除自己锁定的）
-                lock_info = db.get_lock_info(filename)
-                is_locked_by_others = lock_info and lock_info['user_id'] != user_id
-
-                # 获取 AI 预测结果
-                ai_prediction = db.get_ai_prediction(filename)
-
-                image_info = {
-                    'filename': filename,
-                    'path': f'/api/images/{filename}',
-                    'locked': is_locked_by_others,
-                    'locked_by': lock_info['user_id'] if is_locked_by_others else None,
-                    'has_ai_prediction': ai_prediction is not None
-                }
-
-                # 如果有 AI 预测，添加预测信息
-                if ai_prediction:
-                    image_info['ai_prediction'] = {
-                        'aircraft_class': ai_prediction['aircraft_class'],
-                        'aircraft_confidence': ai_prediction['aircraft_confidence'],
-                        'airline_class': ai_prediction['airline_class'],
-                        'airline_confidence': ai_prediction['airline_confidence'],
-                        'registration': ai_prediction['registration'],
-                        'registration_area': ai_prediction['registration_area'],
-                        'registration_confidence': ai_prediction['registration_confidence'],
-                        'clarity': ai_prediction['clarity'],
-                        'block': ai_prediction['block'],
-                        'is_new_class': ai_prediction['is_new_class'],
-                        'quality_pass': ai_prediction.get('quality_pass', True)
-                    }
-
-                images.append(image_info)
-
-    # 按文件名排序
-    images.sort(key=lambda x: x['filename'])
+    for row in view['items']:
+        is_locked_by_others = row['locked_by'] is not None
+
+        image_info = {
+            'filename': row['filename'],
+            'path': f"/api/images/{row['filename']}",
+            'locked': is_locked_by_others,
+            'locked_by': row['locked_by'],
+            'has_ai_prediction': bool(row['has_ai_prediction'])
+        }
+
+        # 如果有 AI 预测，添加预测信息
+        if row['has_ai_prediction']:
+            image_info['ai_prediction'] = {
+                'aircraft_class': row['aircraft_class'],
+                'aircraft_confidence': row['aircraft_confidence'],
+                'airline_class': row['airline_class'],
+                'airline_confidence': row['airline_confidence'],
+                'registration': row['registration'],
+                'registration_area': row['registration_area'],
+                'registration_confidence': row['registration_confidence'],
+                'clarity': row['clarity'],
+                'block': row['block'],
+                'is_new_class': row['is_new_class'],
+                'outlier_score': row['outlier_score'],
+                'quality_pass': bool(row['quality_pass'])
+            }
+
+        images.append(image_info)
 
     return jsonify({
-        'total': len(images),
-        'items': images
+        'total': view['total'],
+        'items': images,
+        'next_cursor': view['next_cursor']
     })
 
 
@@ -482,19 +581,18 @@ def create_label():
         if field not in data:
             return jsonify({'error': f'缺少必填字段: {field}'}), 400
 
-    # 生成新文件名
-    type_id = data['type_id']
-    seq = db.get_next_sequence(type_id)
-    original_ext = os.path.splitext(data['original_file_name'])[1]
-    new_filename = f"{type_id}-{seq:04d}{original_ext}"
-
     # 移动并重命名图片
     src_path = os.path.join(IMAGES_DIR, data['original_file_name'])
-    dst_path = os.path.join(LABELED_DIR, new_filename)
-
     if not os.path.exists(src_path):
         return jsonify({'error': '原始图片不存在'}), 404
 
+    # 生成新文件名（原子分配序号，并发提交不会重名）
+    type_id = data['type_id']
+    seq = db.allocate_sequence(type_id)
+    original_ext = os.path.splitext(data['original_file_name'])[1]
+    new_filename = f"{type_id}-{seq:04d}{original_ext}"
+    dst_path = os.path.join(LABELED_DIR, new_filename)
+
     try:
         shutil.move(src_path, dst_path)
     except Exception as e:
@@ -549,138 +647,168 @@ def delete_label(label_id: int):
 
     success = db.delete_label(label_id)
     if success:
+        # 原始文件可能重新回到待标注目录，下次访问时重新扫描
+        get_image_inventory().invalidate()
         return jsonify({'message': '删除成功'})
     return jsonify({'error': '删除失败'}), 500
 
 
+def _export_delta_args() -> tuple:
+    """
+    解析导出请求的增量参数
+
+    since 为上一次导出返回的变更水位（X-Export-Watermark），
+    传入时只导出该水位之后新增、修改和删除的标注
+
+    Returns:
+        (since, until, watermark)，watermark 为本次导出的水位，下一次增量导出以它为 since
+    """
+    since = request.args.get('since', type=int)
+    watermark = db.get_label_change_watermark()
+    until = watermark if since is not None else None
+    return since, until, watermark
+
+
 @app.route('/api/labels/export', methods=['GET'])
 def export_labels():
-    """导出标注数据为 CSV，支持ID范围筛选"""
+    """导出标注数据为 CSV（流式输出），支持ID范围筛选和 since 增量导出"""
     start_id = request.args.get('start_id', type=int)
     end_id = request.args.get('end_id', type=int)
-
-    labels = db.get_all_labels_for_export(start_id, end_id)
-
-    # 获取所有机型和航司的映射（code -> id）
-    aircraft_types = {t['code']: t['id'] for t in db.get_aircraft_types()}
-    airlines = {a['code']: a['id'] for a in db.get_airlines()}
-
-    # 创建 CSV（使用 UTF-8 BOM 以支持 Excel 中文显示）
-    output = StringIO()
-    # 写入 UTF-8 BOM
-    output.write('\ufeff')
-    writer = csv.writer(output)
-
-    # 写入表头
-    writer.writerow(['filename', 'typeid', 'typename', 'airlineid',
-                     'airlinename', 'clarity', 'block', 'registration'])
-
-    # 写入数据
-    # typeid/airlineid 使用数据库数字id，typename/airlinename 使用 code
-    for label in labels:
-        type_code = label['type_id']  # 当前存储的是code
-        airline_code = label['airline_id']  # 当前存储的是code
-        writer.writerow([
-            label['file_name'],
-            aircraft_types.get(type_code, type_code),  # 数字id
-            type_code,  # code 作为 typename
-            airlines.get(airline_code, airline_code),  # 数字id
-            airline_code,  # code 作为 airlinename
-            label['clarity'],
-            label['block'],
-            label['registration']
-        ])
-
-    output.seek(0)
+    since, until, watermark = _export_delta_args()
 
     return Response(
-        output.getvalue().encode('utf-8-sig'),
+        iter_export(db, 'csv', LABELED_DIR, start_id, end_id, since=since, until=until),
         mimetype='text/csv; charset=utf-8-sig',
-        headers={'Content-Disposition': 'attachment; filename=labels.csv'}
+        headers={
+            'Content-Disposition': 'attachment; filename=labels.csv',
+            'X-Export-Watermark': str(watermark)
+        }
     )
 
 
 @app.route('/api/labels/export-yolo', methods=['GET'])
 def export_yolo_labels():
-    """导出 YOLO 格式标注文件（zip 包含所有 txt 文件），支持ID范围筛选"""
+    """导出 YOLO 格式标注文件（zip 包含所有 txt 文件，流式输出），支持ID范围筛选和 since 增量导出"""
     start_id = request.args.get('start_id', type=int)
     end_id = request.args.get('end_id', type=int)
+    since, until, watermark = _export_delta_args()
 
-    labels = db.get_all_labels_with_area(start_id, end_id)
-
-    # 创建内存中的 zip 文件
-    zip_buffer = BytesIO()
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for label in labels:
-            # 生成 txt 文件名（与图片同名）
-            img_name = os.path.splitext(label['file_name'])[0]
-            txt_filename = f"{img_name}.txt"
-
-            # YOLO 格式: class_id x_center y_center width height
-            # registration_area 已经是 "x_center y_center width height" 格式
-            if label['registration_area']:
-                content = f"0 {label['registration_area']}"
-            else:
-                content = ""
-
-            zip_file.writestr(txt_filename, content)
-
-    zip_buffer.seek(0)
-
-    return send_file(
-        zip_buffer,
+    return Response(
+        iter_export(db, 'yolo', LABELED_DIR, start_id, end_id, since=since, until=until),
         mimetype='application/zip',
-        as_attachment=True,
-        download_name='yolo_labels.zip'
+        headers={
+            'Content-Disposition': 'attachment; filename=yolo_labels.zip',
+            'X-Export-Watermark': str(watermark)
+        }
     )
 
 
 @app.route('/api/labels/export-images', methods=['GET'])
 def export_images():
-    """导出已标注的照片（zip 包含所有图片），支持ID范围筛选
+    """导出已标注的照片（zip 包含所有图片，流式输出），支持ID范围筛选和 since 增量导出
 
-    如果照片数量超过阈值，返回错误提示
+    图片以不压缩（ZIP_STORED）方式分块写入，内存占用与照片数量无关；
+    大量照片建议使用后台导出任务 POST /api/exports
     """
     start_id = request.args.get('start_id', type=int)
     end_id = request.args.get('end_id', type=int)
+    since, until, watermark = _export_delta_args()
 
-    labels = db.get_all_labels_for_export(start_id, end_id)
+    missing_files = []
 
-    # 检查照片数量
-    if len(labels) > EXPORT_IMAGES_THRESHOLD:
-        return jsonify({
-            'error': f'照片数量({len(labels)})超过限制({EXPORT_IMAGES_THRESHOLD})，无法打包下载',
-            'count': len(labels),
-            'threshold': EXPORT_IMAGES_THRESHOLD
-        }), 400
+    def generate():
+        yield from iter_export(
+            db, 'images', LABELED_DIR, start_id, end_id, missing=missing_files,
+            since=since, until=until
+        )
+        # 如果有缺失的文件，记录警告
+        if missing_files:
+            logger.warning(f"以下文件未找到: {', '.join(missing_files)}")
 
-    # 创建内存中的 zip 文件
-    zip_buffer = BytesIO()
-    missing_files = []
+    return Response(
+        generate(),
+        mimetype='application/zip',
+        headers={
+            'Content-Disposition': 'attachment; filename=labeled_images.zip',
+            'X-Export-Watermark': str(watermark)
+        }
+    )
 
-    with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zip_file:
-        for label in labels:
-            # 查找图片文件
-            img_path = os.path.join(LABELED_DIR, label['file_name'])
 
-            if os.path.exists(img_path):
-                # 读取图片文件并添加到ZIP
-                zip_file.write(img_path, arcname=label['file_name'])
-            else:
-                missing_files.append(label['file_name'])
+# ==================== 后台导出任务 API ====================
 
-    # 如果有缺失的文件，记录警告
-    if missing_files:
-        logger.warning(f"以下文件未找到: {', '.join(missing_files)}")
+@app.route('/api/exports', methods=['POST'])
+def create_export_job():
+    """创建后台导出任务
 
-    zip_buffer.seek(0)
+    type: csv / yolo / images / dataset（CSV + YOLO + 照片），可选 start_id、end_id，
+    since 为增量导出的起始变更水位；任务的 watermark 字段为本次导出的水位
+    """
+    data = request.get_json() or {}
+    export_type = data.get('type')
+    if export_type not in EXPORT_FILE_NAMES:
+        return jsonify({
+            'error': f'Unsupported export type: {export_type}',
+            'supported': list(EXPORT_FILE_NAMES)
+        }), 400
 
-    return send_file(
-        zip_buffer,
-        mimetype='application/zip',
+    params = {}
+    for key in ('start_id', 'end_id', 'since'):
+        if data.get(key) is not None:
+            try:
+                params[key] = int(data[key])
+            except (TypeError, ValueError):
+                return jsonify({'error': f'Invalid {key}'}), 400
+
+    job = get_export_manager().submit(export_type, params)
+    return jsonify(job), 202
+
+
+@app.route('/api/exports', methods=['GET'])
+def get_export_jobs():
+    """获取导出任务列表"""
+    limit = request.args.get('limit', 50, type=int)
+    get_export_manager().cleanup_expired()
+    return jsonify({'jobs': db.get_export_jobs(limit)})
+
+
+@app.route('/api/exports/<int:job_id>', methods=['GET'])
+def get_export_job(job_id: int):
+    """获取导出任务状态和进度"""
+    job = db.get_export_job(job_id)
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+    return jsonify(job)
+
+
+@app.route('/api/exports/<int:job_id>/download', methods=['GET'])
+def download_export(job_id: int):
+    """下载导出产物（支持 Range 请求，断点续传）"""
+    job = db.get_export_job(job_id)
+    if not job:
+        return jsonify({'error': 'Export job not found'}), 404
+    if job['status'] != 'completed':
+        return jsonify({'error': 'Export job not completed', 'status': job['status']}), 409
+    if not job.get('file_path') or not os.path.exists(job['file_path']):
+        return jsonify({'error': 'Export file not found'}), 410
+
+    response = send_file(
+        os.path.abspath(job['file_path']),
         as_attachment=True,
-        download_name='labeled_images.zip'
+        download_name=ExportJobManager.download_name(job),
+        conditional=True
     )
+    if job.get('watermark') is not None:
+        response.headers['X-Export-Watermark'] = str(job['watermark'])
+    return response
+
+
+@app.route('/api/exports/<int:job_id>', methods=['DELETE'])
+def delete_export_job(job_id: int):
+    """取消并删除导出任务及其产物"""
+    if get_export_manager().delete(job_id):
+        return jsonify({'message': '删除成功'})
+    return jsonify({'error': 'Export job not found'}), 404
 
 
 # ==================== 航司相关 API ====================
@@ -765,15 +893,7 @@ def get_stats():
     stats = db.get_stats()
 
     # 添加未标注数量（排除废图）
-    labeled_files = db.get_labeled_original_filenames()
-    skipped_files = db.get_skipped_filenames()
-    unlabeled_count = 0
-    if os.path.exists(IMAGES_DIR):
-        for filename in os.listdir(IMAGES_DIR):
-            if is_image_file(filename) and filename not in labeled_files and filename not in skipped_files:
-                unlabeled_count += 1
-
-    stats['unlabeled'] = unlabeled_count
+    stats['unlabeled'] = get_image_inventory().count_pending()
 
     return jsonify(stats)
 
@@ -923,30 +1043,23 @@ def run_ai_predict():
 
 @app.route('/api/ai/predict-batch', methods=['POST'])
 def run_ai_predict_batch():
-    """批量运行AI预测（用于新图片自动触发）"""
+    """批量运行AI预测（用于新图片自动触发，后台预测任务执行中或已暂停时返回 409）"""
     if not ai_enabled:
         return jsonify({'error': 'AI service not enabled'}), 503
 
+    status = get_prediction_job_manager().get_status()
+    if status['active'] or (status['job'] and status['job']['status'] == 'paused'):
+        return jsonify({'error': 'Prediction job in progress', **status}), 409
+    if not _batch_prediction_lock.acquire(blocking=False):
+        return jsonify({'error': 'Batch prediction already in progress'}), 409
+
     try:
-        # 获取images/文件夹下所有未标注的图片
-        labeled_files = db.get_labeled_original_filenames()
-        skipped_files = db.get_skipped_filenames()
-
-        # 检查哪些图片已有AI预测
-        conn = db.get_connection()
-        cursor = conn.cursor()
-        cursor.execute('SELECT filename FROM ai_predictions')
-        predicted_files = {row[0] for row in cursor.fetchall()}
-        conn.close()
-
-        # 获取需要预测的图片
-        image_paths = []
-        for filename in os.listdir(IMAGES_DIR):
-            if (is_image_file(filename) and
-                filename not in labeled_files and
-                filename not in skipped_files and
-                filename not in predicted_files):
-                image_paths.append(os.path.join(IMAGES_DIR, filename))
+        # 从图片清单获取未标注、未跳过且尚无AI预测的图片
+        get_image_inventory().refresh()
+        image_paths = [
+            os.path.join(IMAGES_DIR, filename)
+            for filename in db.get_inventory_filenames((INVENTORY_UNLABELED,))
+        ]
 
         if not image_paths:
             return jsonify({
@@ -954,34 +1067,92 @@ def run_ai_predict_batch():
                 'count': 0
             })
 
-        # 实时保存回调
-        saved = 0
-        def save_to_db(index, result):
-            nonlocal saved
-            resp = db.add_ai_prediction(result)
-            if not (isinstance(resp, dict) and resp.get('error')):
-                saved += 1
-
-        # 批量预测（使用流式回调）
-        batch_result = ai_predictor.predict_batch(image_paths, detect_new_classes=True, on_prediction_callback=save_to_db)
+        # 批量预测（结果经缓冲批量写入数据库）
+        with create_prediction_writer() as writer:
+            batch_result = ai_predictor.predict_batch(
+                image_paths, detect_new_classes=True, on_prediction_callback=writer.on_prediction,
+                on_embeddings_callback=get_embedding_store().add
+            )
 
-        # 预测结束后，更新新类别标记
-        if batch_result.get('new_class_indices'):
-            for idx in batch_result['new_class_indices']:
-                if idx < len(batch_result['predictions']):
-                    pred = batch_result['predictions'][idx]
-                    db.update_ai_prediction_new_class_flag(pred['filename'], 1, pred.get('outlier_score', 0.0))
+        # 预测结束后，批量更新新类别标记
+        mark_new_classes(batch_result)
 
         return jsonify({
             'message': f'AI prediction completed for {len(batch_result["predictions"])} images',
             'total': len(batch_result['predictions']),
-            'saved': saved,
+            'saved': writer.saved,
             'statistics': batch_result['statistics']
         })
 
     except Exception as e:
         logger.error(f"Batch AI prediction error: {str(e)}")
         return jsonify({'error': f'Batch AI prediction failed: {str(e)}'}), 500
+    finally:
+        _batch_prediction_lock.release()
+
+
+@app.route('/api/ai/embeddings', methods=['GET'])
+def get_embedding_sets():
+    """获取已存储的特征向量集合（按模型版本）和持久化 HDBSCAN 聚类器状态"""
+    clusterer = ai_predictor.hdbscan.get_model_info() if ai_enabled else None
+    return jsonify({'sets': get_embedding_store().versions(), 'clusterer': clusterer})
+
+
+@app.route('/api/ai/cache', methods=['GET'])
+def get_result_cache_stats():
+    """获取AI结果缓存统计"""
+    if not ai_enabled:
+        return jsonify({'error': 'AI service not enabled'}), 503
+
+    stats = ai_predictor.get_cache_stats()
+    if stats is None:
+        return jsonify({'enabled': False})
+    return jsonify({'enabled': True, **stats})
+
+
+@app.route('/api/ai/prediction-job', methods=['GET'])
+def get_prediction_job():
+    """获取后台预测任务的进度和断点"""
+    if not ai_enabled:
+        return jsonify({'error': 'AI service not enabled'}), 503
+    return jsonify(get_prediction_job_manager().get_status())
+
+
+@app.route('/api/ai/prediction-job', methods=['POST'])
+def start_prediction_job():
+    """启动后台预测（已有任务在执行或已暂停时返回 409）"""
+    if not ai_enabled:
+        return jsonify({'error': 'AI service not enabled'}), 503
+
+    manager = get_prediction_job_manager()
+    status = manager.get_status()
+    if status['active'] or (status['job'] and status['job']['status'] == 'paused'):
+        return jsonify({'error': 'Prediction job already in progress', **status}), 409
+    return jsonify(manager.start(trigger='manual')), 202
+
+
+@app.route('/api/ai/prediction-job/pause', methods=['POST'])
+def pause_prediction_job():
+    """暂停后台预测（当前一轮完成后生效）"""
+    if not ai_enabled:
+        return jsonify({'error': 'AI service not enabled'}), 503
+
+    manager = get_prediction_job_manager()
+    if not manager.pause():
+        return jsonify({'error': 'No running prediction job'}), 409
+    return jsonify(manager.get_status())
+
+
+@app.route('/api/ai/prediction-job/resume', methods=['POST'])
+def resume_prediction_job():
+    """继续已暂停的后台预测（从断点开始）"""
+    if not ai_enabled:
+        return jsonify({'error': 'AI service not enabled'}), 503
+
+    manager = get_prediction_job_manager()
+    if not manager.resume():
+        return jsonify({'error': 'No paused prediction job'}), 409
+    return jsonify(manager.get_status())
 
 
 @app.route('/api/ai/review/pending', methods=['GET'])
@@ -1037,9 +1208,9 @@ def approve_prediction():
         return jsonify({'error': 'Image not found'}), 404
 
     try:
-        # 生成新文件名
+        # 生成新文件名（原子分配序号）
         type_id = ai_pred['aircraft_class']
-        seq = db.get_next_sequence(type_id)
+        seq = db.allocate_sequence(type_id)
         original_ext = os.path.splitext(filename)[1]
         new_filename = f"{type_id}-{seq:04d}{original_ext}"
 
@@ -1084,9 +1255,30 @@ def approve_prediction():
         return jsonify({'error': f'Failed to approve prediction: {str(e)}'}), 500
 
 
+# 后台批量批准任务：job_id -> {'approver', 'status', 'result'}
+_bulk_approve_jobs = {}
+_bulk_approve_jobs_lock = threading.Lock()
+BULK_APPROVE_JOBS_KEPT = 20
+
+
+def _bulk_approve_response(result: dict) -> dict:
+    """批量批准结果的响应格式"""
+    return {
+        'message': f'Bulk approve completed: {len(result["results"])} succeeded, {len(result["errors"])} failed',
+        'success_count': len(result['results']),
+        'failed_count': len(result['errors']),
+        'results': result['results'],
+        'errors': result['errors']
+    }
+
+
 @app.route('/api/ai/review/bulk-approve', methods=['POST'])
 def bulk_approve_predictions():
-    """批量批准AI预测"""
+    """批量批准AI预测
+
+    传入 async=true 时在后台执行并立即返回 job_id，
+    通过 GET /api/ai/review/bulk-approve/<job_id> 查询进度和结果
+    """
     if not ai_enabled:
         return jsonify({'error': 'AI service not enabled'}), 503
 
@@ -1096,71 +1288,47 @@ def bulk_approve_predictions():
     if not filenames:
         return jsonify({'error': 'No filenames provided'}), 400
 
-    results = []
-    errors = []
+    approver = BulkApprover(db, IMAGES_DIR, LABELED_DIR, max_workers=BULK_APPROVE_WORKERS)
+
+    if not data.get('async', False):
+        return jsonify(_bulk_approve_response(approver.run(filenames)))
 
-    for filename in filenames:
+    job_id = uuid.uuid4().hex
+    job = {'approver': approver, 'status': 'running', 'result': None}
+    with _bulk_approve_jobs_lock:
+        # 只保留最近的已结束任务
+        finished = [k for k, v in _bulk_approve_jobs.items() if v['status'] != 'running']
+        for key in finished[:-BULK_APPROVE_JOBS_KEPT]:
+            del _bulk_approve_jobs[key]
+        _bulk_approve_jobs[job_id] = job
+
+    def run_job():
         try:
-            # 获取AI预测结果
-            ai_pred = db.get_ai_prediction(filename)
-            if not ai_pred:
-                errors.append({'filename': filename, 'error': 'AI prediction not found'})
-                continue
-
-            # 检查图片是否存在
-            file_path = os.path.join(IMAGES_DIR, filename)
-            if not os.path.exists(file_path):
-                errors.append({'filename': filename, 'error': 'Image not found'})
-                continue
-
-            # 生成新文件名
-            type_id = ai_pred['aircraft_class']
-            seq = db.get_next_sequence(type_id)
-            original_ext = os.path.splitext(filename)[1]
-            new_filename = f"{type_id}-{seq:04d}{original_ext}"
-
-            # 移动并重命名图片
-            dst_path = os.path.join(LABELED_DIR, new_filename)
-            shutil.move(file_path, dst_path)
-
-            # 保存标注
-            label_data = {
-                'file_name': new_filename,
-                'original_file_name': filename,
-                'type_id': ai_pred['aircraft_class'],
-                'type_name': ai_pred['aircraft_class'],
-                'airline_id': ai_pred['airline_class'],
-                'airline_name': ai_pred['airline_class'],
-                'clarity': ai_pred['clarity'],
-                'block': ai_pred['block'],
-                'registration': ai_pred['registration'] or '',
-                'registration_area': ai_pred['registration_area'] or ''
-            }
+            job['result'] = _bulk_approve_response(approver.run(filenames))
+            job['status'] = 'completed'
+        except Exception as e:
+            logger.error(f"Bulk approve job {job_id} failed: {e}")
+            job['result'] = {'error': str(e)}
+            job['status'] = 'failed'
 
-            result = db.add_label(label_data)
-            db.mark_prediction_processed(filename)
+    threading.Thread(target=run_job, daemon=True).start()
 
-            # 更新标注的AI相关字段
-            db.update_label_with_ai_data(result['id'], {
-                'review_status': 'auto_approved',
-                'ai_approved': 1
-            })
+    return jsonify({'job_id': job_id, 'status': 'running', 'total': len(filenames)}), 202
 
-            results.append({
-                'filename': filename,
-                'id': result['id'],
-                'file_name': new_filename
-            })
 
-        except Exception as e:
-            errors.append({'filename': filename, 'error': str(e)})
+@app.route('/api/ai/review/bulk-approve/<job_id>', methods=['GET'])
+def get_bulk_approve_job(job_id: str):
+    """查询后台批量批准任务的进度和结果"""
+    with _bulk_approve_jobs_lock:
+        job = _bulk_approve_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
 
     return jsonify({
-        'message': f'Bulk approve completed: {len(results)} succeeded, {len(errors)} failed',
-        'success_count': len(results),
-        'failed_count': len(errors),
-        'results': results,
-        'errors': errors
+        'job_id': job_id,
+        'status': job['status'],
+        'progress': job['approver'].get_progress(),
+        'result': job['result']
     })
 
 
@@ -1394,10 +1562,7 @@ def serve_frontend(path):
         return send_from_directory(app.static_folder, 'index.html')
 
 
-# 在应用启动时运行 AI 预测（全局作用域，gunicorn 会执行）
-logger.info("="*80)
-logger.info("Flask app initialized, starting AI prediction...")
-logger.info("="*80)
+# 在应用启动时于后台运行 AI 预测（全局作用域，gunicorn 会执行；不阻塞启动）
 run_startup_ai_prediction()
 logger.info("="*80)
 logger.info("Flask app startup complete")
@@ -0,0 +1,211 @@
+"""
+AI 预测批量批准
+一次查询获取预测、按机型批量预留序号、线程池并行重命名文件，
+所有标注在一个事务中写入；数据库写入失败时回滚并把文件移回原位
+"""
+
+import os
+import errno
+import shutil
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+class BulkApprover:
+    """AI 预测批量批准"""
+
+    def __init__(
+        self,
+        db: Database,
+        images_dir: str,
+        labeled_dir: str,
+        max_workers: int = 8,
+        review_status: str = "auto_approved",
+    ):
+        """
+        初始化批量批准
+
+        Args:
+            db: 数据库实例
+            images_dir: 待标注图片目录
+            labeled_dir: 已标注图片目录
+            max_workers: 并行移动文件的线程数
+            review_status: 写入标注的复审状态
+        """
+        self.db = db
+        self.images_dir = images_dir
+        self.labeled_dir = labeled_dir
+        self.max_workers = max(1, max_workers)
+        self.review_status = review_status
+
+        self._lock = threading.Lock()
+        self.progress = {"stage": "pending", "done": 0, "total": 0}
+
+    def _set_progress(self, stage: str, done: int, total: int):
+        with self._lock:
+            self.progress = {"stage": stage, "done": done, "total": total}
+
+    def get_progress(self) -> dict:
+        """获取当前进度"""
+        with self._lock:
+            return dict(self.progress)
+
+    @staticmethod
+    def _move(src: str, dst: str):
+        """移动文件，同一文件系统内为 os.rename，不覆盖已存在的目标文件"""
+        if os.path.exists(dst):
+            raise FileExistsError(f"Target already exists: {os.path.basename(dst)}")
+        try:
+            os.rename(src, dst)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # 跨文件系统时退化为复制 + 删除
+            shutil.move(src, dst)
+
+    def _move_all(self, moves: list, stage: str) -> list:
+        """并行移动文件，返回每项的异常（成功为 None）"""
+        total = len(moves)
+        outcomes = [None] * total
+        self._set_progress(stage, 0, total)
+
+        def run(index):
+            src, dst = moves[index]
+            try:
+                self._move(src, dst)
+            except Exception as e:
+                outcomes[index] = e
+
+        done = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for _ in executor.map(run, range(total)):
+                done += 1
+                if done % 100 == 0 or done == total:
+                    self._set_progress(stage, done, total)
+        return outcomes
+
+    @staticmethod
+    def _label_data(filename: str, new_filename: str, ai_pred: dict) -> dict:
+        """由AI预测生成标注数据"""
+        return {
+            "file_name": new_filename,
+            "original_file_name": filename,
+            "type_id": ai_pred["aircraft_class"],
+            "type_name": ai_pred["aircraft_class"],
+            "airline_id": ai_pred["airline_class"],
+            "airline_name": ai_pred["airline_class"],
+            "clarity": ai_pred["clarity"],
+            "block": ai_pred["block"],
+            "registration": ai_pred["registration"] or "",
+            "registration_area": ai_pred["registration_area"] or "",
+        }
+
+    def run(
+        self,
+        filenames: list,
+        progress_callback: Optional[Callable[[dict], None]] = None,
+    ) -> dict:
+        """
+        批量批准
+
+        Args:
+            filenames: 待批准的文件名列表
+            progress_callback: 阶段切换时的回调，接收 get_progress() 的结果
+
+        Returns:
+            {"results": [{"filename","id","file_name"}], "errors": [{"filename","error"}]}
+        """
+        def notify():
+            if progress_callback:
+                progress_callback(self.get_progress())
+
+        results = []
+        errors = []
+
+        # 1. 一次查询获取所有预测并校验
+        self._set_progress("validating", 0, len(filenames))
+        notify()
+        predictions = self.db.get_ai_predictions(filenames)
+        approvable = []
+        seen = set()
+        for filename in filenames:
+            if filename in seen:
+                continue
+            seen.add(filename)
+            ai_pred = predictions.get(filename)
+            if not ai_pred:
+                errors.append({"filename": filename, "error": "AI prediction not found"})
+                continue
+            src = os.path.join(self.images_dir, filename)
+            if not os.path.exists(src):
+                errors.append({"filename": filename, "error": "Image not found"})
+                continue
+            approvable.append((filename, src, ai_pred))
+
+        if not approvable:
+            self._set_progress("done", 0, 0)
+            notify()
+            return {"results": results, "errors": errors}
+
+        # 2. 按机型批量预留序号
+        by_type = {}
+        for item in approvable:
+            by_type.setdefault(item[2]["aircraft_class"], []).append(item)
+        planned = []
+        for type_id, items in by_type.items():
+            for (filename, src, ai_pred), seq in zip(
+                items, self.db.reserve_sequences(type_id, len(items))
+            ):
+                ext = os.path.splitext(filename)[1]
+                new_filename = f"{type_id}-{seq:04d}{ext}"
+                dst = os.path.join(self.labeled_dir, new_filename)
+                planned.append((filename, src, dst, new_filename, ai_pred))
+
+        # 3. 并行移动文件
+        notify()
+        outcomes = self._move_all([(p[1], p[2]) for p in planned], "moving")
+        moved = []
+        for plan, error in zip(planned, outcomes):
+            if error is None:
+                moved.append(plan)
+            else:
+                errors.append({"filename": plan[0], "error": str(error)})
+        notify()
+
+        # 4. 单个事务写入所有标注，失败时把文件移回原位
+        self._set_progress("saving", 0, len(moved))
+        notify()
+        try:
+            label_ids = self.db.add_approved_labels(
+                [self._label_data(p[0], p[3], p[4]) for p in moved],
+                review_status=self.review_status,
+            )
+        except Exception as e:
+            logger.error(f"Bulk approve failed to save labels, rolling back: {e}")
+            restore = self._move_all([(p[2], p[1]) for p in moved], "rolling_back")
+            for plan, restore_error in zip(moved, restore):
+                if restore_error is not None:
+                    logger.error(
+                        f"Failed to restore {plan[3]} -> {plan[0]}: {restore_error}"
+                    )
+                errors.append({"filename": plan[0], "error": f"Failed to save label: {e}"})
+            self._set_progress("failed", 0, len(moved))
+            notify()
+            return {"results": results, "errors": errors}
+
+        for plan, label_id in zip(moved, label_ids):
+            results.append({"filename": plan[0], "id": label_id, "file_name": plan[3]})
+
+        self._set_progress("done", len(moved), len(moved))
+        notify()
+        logger.info(
+            f"Bulk approve completed: {len(results)} succeeded, {len(errors)} failed"
+        )
+        return {"results": results, "errors": errors}
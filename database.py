@@ -6,22 +6,295 @@ import sqlite3
 import os
 import json
 import time
+import base64
+import logging
+import threading
+from contextlib import contextmanager
 from typing import Optional
 
+logger = logging.getLogger(__name__)
+
 # 锁超时时间（秒）- 10分钟后自动释放
 LOCK_TIMEOUT = 600
 
+# SQLite 连接参数
+SQLITE_BUSY_TIMEOUT_MS = 5000  # 写锁等待时间
+SQLITE_CACHE_SIZE_KB = 64 * 1024  # 每个连接的页缓存
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024  # 内存映射读取大小
+# 复用连接前的健康检查间隔（秒）
+CONNECTION_HEALTH_CHECK_INTERVAL = 30
+# 流式导出时每次 fetchmany 读取的行数
+EXPORT_FETCH_SIZE = 1000
+
+# 图片清单状态（image_inventory.status）
+# 锁定状态不落盘，查询时由 image_locks 推导（锁会过期）
+INVENTORY_UNLABELED = "unlabeled"
+INVENTORY_PREDICTED = "predicted"
+INVENTORY_LABELED = "labeled"
+INVENTORY_SKIPPED = "skipped"
+
+# 仍在待标注队列中的状态
+INBOX_STATUSES = (INVENTORY_UNLABELED, INVENTORY_PREDICTED)
+# 以字面量写入 SQL，查询条件与部分索引 idx_image_inventory_inbox 的 WHERE 一致时才能使用该索引
+INBOX_STATUS_SQL = "(" + ", ".join(f"'{status}'" for status in INBOX_STATUSES) + ")"
+
+# 待标注视图支持的排序：排序名 -> (排序键表达式, 方向)
+# 排序键为 None 表示仅按文件名排序；按预测字段排序时只返回已有 AI 预测的图片
+# 表达式需与 ai_predictions 上的索引定义保持一致，才能走索引范围扫描
+INBOX_SORTS = {
+    "filename": (None, "ASC"),
+    "confidence": ("MIN(p.aircraft_confidence, p.airline_confidence)", "ASC"),
+    "outlier_score": ("p.outlier_score", "DESC"),
+    "priority": ("p.review_priority", "ASC"),
+}
+
+# 标注文件名 {type_id}-{序号}{扩展名} 的序号解析（CAST 取数字前缀，忽略扩展名）
+LABEL_SEQUENCE_MATCH_SQL = (
+    "substr({row}.file_name, 1, length({row}.type_id) + 1) = {row}.type_id || '-'"
+)
+LABEL_SEQUENCE_SQL = "CAST(substr({row}.file_name, length({row}.type_id) + 2) AS INTEGER)"
+
+# 标注变更日志记录的内容字段（其余字段变化不产生增量导出记录）
+LABEL_CHANGE_COLUMNS = (
+    "file_name", "original_file_name", "type_id", "type_name",
+    "airline_id", "airline_name", "clarity", "block",
+    "registration", "registration_area", "review_status", "ai_approved",
+)
+# label_changes.op
+LABEL_CHANGE_UPSERT = "upsert"
+LABEL_CHANGE_DELETE = "delete"
+
+# 复审优先级：样本量低于该值的已知类别优先复审
+REVIEW_MIN_SAMPLES = 8
+# 复审优先级分档间隔，各档内的排序值需小于该值
+REVIEW_TIER_STEP = 1000000
+# 复审优先级键（越小越优先），由触发器写入 ai_predictions.review_priority：
+# 1. 新类别 - 按 outlier_score 降序
+# 2. 样本量不足的已知类别 - 按样本量升序
+# 3. 其余已知类别 - 按较低置信度升序
+_CLASS_COUNT_SQL = (
+    "COALESCE((SELECT label_count FROM class_counts "
+    "WHERE type_id = ai_predictions.aircraft_class), 0)"
+)
+REVIEW_PRIORITY_SQL = f"""CASE
+    WHEN ai_predictions.is_new_class = 1 THEN -ai_predictions.outlier_score
+    WHEN {_CLASS_COUNT_SQL} < {REVIEW_MIN_SAMPLES}
+        THEN {REVIEW_TIER_STEP} + {_CLASS_COUNT_SQL}
+    ELSE {2 * REVIEW_TIER_STEP}
+        + MIN(ai_predictions.aircraft_confidence, ai_predictions.airline_confidence)
+END"""
+
+
+class ConnectionPool:
+    """
+    SQLite 连接池
+    每个线程复用一个连接（WAL 模式下读写互不阻塞），同一线程内可嵌套获取
+    """
+
+    def __init__(
+        self,
+        db_path: str,
+        busy_timeout_ms: int = SQLITE_BUSY_TIMEOUT_MS,
+        cache_size_kb: int = SQLITE_CACHE_SIZE_KB,
+        mmap_size: int = SQLITE_MMAP_SIZE,
+    ):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size = mmap_size
+
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # 线程 ident -> 连接，用于关闭和回收已退出线程的连接
+        self._connections = {}
+        self._closed = False
+
+    def _create_connection(self) -> sqlite3.Connection:
+        """创建并配置新连接"""
+        # check_same_thread=False 仅用于关闭时跨线程 close，连接本身只在所属线程使用
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000.0,
+            check_same_thread=False,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        return conn
+
+    def _is_healthy(self, conn: sqlite3.Connection) -> bool:
+        """检查连接是否可用"""
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, ident: int):
+        """关闭并移除指定线程的连接"""
+        with self._lock:
+            conn = self._connections.pop(ident, None)
+        if conn is not None:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+
+    def _prune_dead_threads(self):
+        """关闭已退出线程遗留的连接"""
+        alive = {t.ident for t in threading.enumerate()}
+        with self._lock:
+            dead = [ident for ident in self._connections if ident not in alive]
+        for ident in dead:
+            self._discard(ident)
+
+    def acquire(self) -> sqlite3.Connection:
+        """获取当前线程的连接（必须与 release 成对调用）"""
+        if self._closed:
+            raise sqlite3.ProgrammingError("Connection pool is closed")
+
+        state = self._local
+        conn = getattr(state, "conn", None)
+        depth = getattr(state, "depth", 0)
+
+        if conn is not None and depth == 0:
+            now = time.monotonic()
+            if now - state.checked_at >= CONNECTION_HEALTH_CHECK_INTERVAL:
+                if not self._is_healthy(conn):
+                    logger.warning("Discarding unhealthy SQLite connection")
+                    self._discard(threading.get_ident())
+                    conn = None
+                else:
+                    state.checked_at = now
+            if conn is not None and conn.in_transaction:
+                # 上一次使用遗留的未提交事务（异常路径未释放），回滚以免长期占用写锁
+                conn.rollback()
+
+        if conn is None:
+            self._prune_dead_threads()
+            conn = self._create_connection()
+            with self._lock:
+                self._connections[threading.get_ident()] = conn
+            state.conn = conn
+            state.checked_at = time.monotonic()
+            depth = 0
+
+        state.depth = depth + 1
+        return conn
+
+    def release(self, conn: sqlite3.Connection):
+        """归还连接，最外层释放时回滚未提交的事务（与关闭连接的语义一致）"""
+        state = self._local
+        if getattr(state, "conn", None) is not conn:
+            # 连接已被关闭或替换
+            return
+        state.depth = max(getattr(state, "depth", 1) - 1, 0)
+        if state.depth == 0 and conn.in_transaction:
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+
+    @contextmanager
+    def connection(self):
+        """以上下文管理器方式获取连接，异常时回滚"""
+        conn = self.acquire()
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self.release(conn)
+
+    def health_check(self) -> dict:
+        """检查当前线程连接的健康状态"""
+        with self.connection() as conn:
+            journal_mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            ok = self._is_healthy(conn)
+        with self._lock:
+            open_connections = len(self._connections)
+        return {
+            "ok": ok,
+            "journal_mode": journal_mode,
+            "open_connections": open_connections,
+        }
+
+    def close_all(self):
+        """关闭所有连接（进程退出时调用）"""
+        self._closed = True
+        with self._lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        self._local = threading.local()
+        logger.info(f"Closed {len(connections)} SQLite connections")
+
+
+class PooledConnection:
+    """连接池中连接的包装，close() 归还连接而不是真正关闭"""
+
+    def __init__(self, pool: ConnectionPool):
+        self._pool = pool
+        self._conn = pool.acquire()
+        self._released = False
+
+    def close(self):
+        """归还连接"""
+        if not self._released:
+            self._released = True
+            self._pool.release(self._conn)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self._conn.__exit__(exc_type, exc_value, traceback)
+
+    def __del__(self):
+        # 异常路径上未调用 close() 时兜底归还
+        try:
+            self.close()
+        except Exception:
+            pass
+
 
 class Database:
-    def __init__(self, db_path: str = "./labels.db"):
+    def __init__(self, db_path: str = "./labels.db", **pool_options):
         self.db_path = db_path
+        self.pool = ConnectionPool(db_path, **pool_options)
+        # 机型/航司 code -> id 映射缓存，新增机型或航司时失效
+        self._code_maps = None
         self.init_db()
 
     def get_connection(self):
-        """获取数据库连接"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
+        """获取数据库连接（来自连接池，close() 时归还）"""
+        return PooledConnection(self.pool)
+
+    def connection(self):
+        """获取数据库连接的上下文管理器"""
+        return self.pool.connection()
+
+    def health_check(self) -> dict:
+        """数据库连接健康检查"""
+        return self.pool.health_check()
+
+    def close(self):
+        """关闭连接池中的所有连接"""
+        self.pool.close_all()
 
     def init_db(self):
         """初始化数据库表"""
@@ -44,7 +317,8 @@ class Database:
                 registration_area TEXT NOT NULL,
                 review_status TEXT DEFAULT 'pending',
                 ai_approved INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
 
@@ -52,6 +326,42 @@ class Database:
         cursor.execute(
             "CREATE INDEX IF NOT EXISTS idx_labels_type_id ON labels (type_id)"
         )
+        # 原始文件名索引（图片清单同步时按原始文件名判断是否已标注）
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_labels_original_file_name ON labels (original_file_name)"
+        )
+
+        # 创建机型序号表（标注文件名 {机型}-{序号} 的分配计数器）
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='type_sequences'"
+        )
+        type_sequences_missing = cursor.fetchone() is None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS type_sequences (
+                type_id TEXT PRIMARY KEY,
+                last_seq INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        if type_sequences_missing:
+            # 从已有文件名中按数值取最大序号（字符串排序在 9999 之后会出错）
+            cursor.execute(f"""
+                INSERT INTO type_sequences (type_id, last_seq)
+                SELECT type_id, MAX({LABEL_SEQUENCE_SQL.format(row="labels")})
+                FROM labels
+                WHERE {LABEL_SEQUENCE_MATCH_SQL.format(row="labels")}
+                GROUP BY type_id
+            """)
+        # 直接写入带序号文件名的标注（导入、脚本等）也推进计数器，避免之后分配到重复序号
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_labels_type_sequence
+            AFTER INSERT ON labels
+            WHEN {LABEL_SEQUENCE_MATCH_SQL.format(row="NEW")}
+            BEGIN
+                INSERT INTO type_sequences (type_id, last_seq)
+                VALUES (NEW.type_id, {LABEL_SEQUENCE_SQL.format(row="NEW")})
+                ON CONFLICT(type_id) DO UPDATE SET last_seq = MAX(last_seq, excluded.last_seq);
+            END
+        """)
 
         # 检查并添加review_status字段（用于数据库迁移）
         cursor.execute("PRAGMA table_info(labels)")
@@ -64,6 +374,36 @@ class Database:
             cursor.execute(
                 "ALTER TABLE labels ADD COLUMN ai_approved INTEGER DEFAULT 0"
             )
+        if "updated_at" not in columns:
+            # ALTER TABLE 不支持 CURRENT_TIMESTAMP 默认值，由触发器在插入后补写
+            cursor.execute("ALTER TABLE labels ADD COLUMN updated_at TIMESTAMP")
+            cursor.execute("UPDATE labels SET updated_at = created_at")
+
+        # 创建标注变更日志（增量导出使用）
+        # 每条标注只保留最新一条变更，seq 单调递增作为同步水位；删除的标注保留为墓碑
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='label_changes'"
+        )
+        label_changes_missing = cursor.fetchone() is None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS label_changes (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                label_id INTEGER NOT NULL UNIQUE,
+                file_name TEXT NOT NULL,
+                op TEXT NOT NULL,
+                changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        if label_changes_missing:
+            # 已有标注作为初始变更，since=0 的增量导出等同于全量导出
+            cursor.execute(
+                """
+                INSERT INTO label_changes (label_id, file_name, op)
+                SELECT id, file_name, ? FROM labels ORDER BY id
+            """,
+                (LABEL_CHANGE_UPSERT,),
+            )
+        self._create_label_change_triggers(cursor)
 
         # 创建航司表
         cursor.execute("""
@@ -119,12 +459,75 @@ class Database:
                 quality_confidence REAL DEFAULT 0.0,
                 is_new_class INTEGER DEFAULT 0,
                 outlier_score REAL DEFAULT 0.0,
+                quality_pass INTEGER DEFAULT 1,
                 prediction_time REAL NOT NULL,
                 processed INTEGER DEFAULT 0,
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         """)
 
+        # 检查并添加quality_pass字段（用于数据库迁移）
+        cursor.execute("PRAGMA table_info(ai_predictions)")
+        columns = [col[1] for col in cursor.fetchall()]
+        if "quality_pass" not in columns:
+            cursor.execute(
+                "ALTER TABLE ai_predictions ADD COLUMN quality_pass INTEGER DEFAULT 1"
+            )
+
+        # 检查并添加review_priority字段（用于数据库迁移）
+        review_priority_missing = "review_priority" not in columns
+        if review_priority_missing:
+            cursor.execute("ALTER TABLE ai_predictions ADD COLUMN review_priority REAL")
+
+        # 待标注视图排序索引（表达式需与 INBOX_SORTS 一致）
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ai_predictions_confidence
+            ON ai_predictions (MIN(aircraft_confidence, airline_confidence), filename)
+        """)
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_ai_predictions_outlier_score ON ai_predictions (outlier_score, filename)"
+        )
+
+        # 创建机型标注计数表（复审优先级使用，由 labels 上的触发器维护）
+        cursor.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' AND name='class_counts'"
+        )
+        class_counts_missing = cursor.fetchone() is None
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS class_counts (
+                type_id TEXT PRIMARY KEY,
+                label_count INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        if class_counts_missing or review_priority_missing:
+            self._rebuild_review_priority(cursor)
+        self._create_review_priority_triggers(cursor)
+
+        # 待复审队列索引：按优先级范围扫描未处理的预测
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ai_predictions_review
+            ON ai_predictions (review_priority, filename) WHERE processed = 0
+        """)
+        # 标注计数变化时按机型刷新未处理预测的优先级
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_ai_predictions_pending_class
+            ON ai_predictions (aircraft_class) WHERE processed = 0
+        """)
+
+        # 创建图片清单表（待标注目录的持久化索引）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS image_inventory (
+                filename TEXT PRIMARY KEY,
+                status TEXT NOT NULL DEFAULT 'unlabeled',
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # 待标注图片的部分索引，按文件名有序，支持键集分页
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_image_inventory_inbox
+            ON image_inventory (filename) WHERE status IN {INBOX_STATUS_SQL}
+        """)
+
         # 创建训练任务表
         cursor.execute("""
             CREATE TABLE IF NOT EXISTS training_jobs (
@@ -181,6 +584,70 @@ class Database:
             )
         """)
 
+        # 创建导出任务表（后台导出，产物写入导出目录）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS export_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                export_type TEXT NOT NULL,
+                status TEXT NOT NULL,
+                params_json TEXT,
+                progress INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                file_path TEXT,
+                file_size INTEGER,
+                error_message TEXT,
+                watermark INTEGER,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                completed_at TIMESTAMP
+            )
+        """)
+        cursor.execute("PRAGMA table_info(export_jobs)")
+        if "watermark" not in [col[1] for col in cursor.fetchall()]:
+            cursor.execute("ALTER TABLE export_jobs ADD COLUMN watermark INTEGER")
+
+        # 创建后台预测任务表（启动预测的进度和断点：last_filename 之前的图片已处理）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS prediction_jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                trigger TEXT NOT NULL,
+                status TEXT NOT NULL,
+                total INTEGER DEFAULT 0,
+                processed INTEGER DEFAULT 0,
+                saved INTEGER DEFAULT 0,
+                duplicates INTEGER DEFAULT 0,
+                errors INTEGER DEFAULT 0,
+                new_class_count INTEGER DEFAULT 0,
+                last_filename TEXT,
+                error_message TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                started_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                completed_at TIMESTAMP
+            )
+        """)
+
+        # 创建特征向量集合表（每个模型版本一个内存映射矩阵文件，row_count 为已提交的行数）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_sets (
+                model_version TEXT PRIMARY KEY,
+                dim INTEGER NOT NULL,
+                dtype TEXT NOT NULL,
+                row_count INTEGER NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # 创建特征向量索引表（文件名 -> 矩阵行号）
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS embedding_index (
+                model_version TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                row INTEGER NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (model_version, filename)
+            )
+        """)
+
         # 兼容性处理：如果表结构不正确（有 user_id 字段），则重建表
         cursor.execute("PRAGMA table_info(skipped_images)")
         columns = [col[1] for col in cursor.fetchall()]
@@ -208,6 +675,129 @@ class Database:
         conn.commit()
         conn.close()
 
+    @staticmethod
+    def _create_label_change_triggers(cursor):
+        """创建维护 labels.updated_at 和 label_changes 的触发器"""
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_labels_change_insert
+            AFTER INSERT ON labels
+            BEGIN
+                UPDATE labels SET updated_at = CURRENT_TIMESTAMP
+                WHERE id = NEW.id AND NEW.updated_at IS NULL;
+                INSERT OR REPLACE INTO label_changes (label_id, file_name, op)
+                VALUES (NEW.id, NEW.file_name, '{LABEL_CHANGE_UPSERT}');
+            END
+        """)
+        # 仅内容字段实际变化时记录（重复保存相同内容不产生增量）
+        changed = " OR ".join(f"OLD.{col} IS NOT NEW.{col}" for col in LABEL_CHANGE_COLUMNS)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_labels_change_update
+            AFTER UPDATE OF {", ".join(LABEL_CHANGE_COLUMNS)} ON labels
+            WHEN {changed}
+            BEGIN
+                UPDATE labels SET updated_at = CURRENT_TIMESTAMP WHERE id = NEW.id;
+                INSERT OR REPLACE INTO label_changes (label_id, file_name, op)
+                VALUES (NEW.id, NEW.file_name, '{LABEL_CHANGE_UPSERT}');
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_labels_change_delete
+            AFTER DELETE ON labels
+            BEGIN
+                INSERT OR REPLACE INTO label_changes (label_id, file_name, op)
+                VALUES (OLD.id, OLD.file_name, '{LABEL_CHANGE_DELETE}');
+            END
+        """)
+
+    @staticmethod
+    def _rebuild_review_priority(cursor):
+        """根据 labels 重建机型计数，并重算所有未处理预测的复审优先级"""
+        cursor.execute("DELETE FROM class_counts")
+        cursor.execute("""
+            INSERT INTO class_counts (type_id, label_count)
+            SELECT type_id, COUNT(*) FROM labels GROUP BY type_id
+        """)
+        cursor.execute(
+            f"UPDATE ai_predictions SET review_priority = {REVIEW_PRIORITY_SQL} WHERE processed = 0"
+        )
+
+    @staticmethod
+    def _create_review_priority_triggers(cursor):
+        """创建维护机型计数和复审优先级的触发器"""
+        # labels 变化 -> 维护 class_counts
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_labels_class_count_insert
+            AFTER INSERT ON labels
+            BEGIN
+                INSERT INTO class_counts (type_id, label_count) VALUES (NEW.type_id, 1)
+                ON CONFLICT(type_id) DO UPDATE SET label_count = label_count + 1;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_labels_class_count_delete
+            AFTER DELETE ON labels
+            BEGIN
+                UPDATE class_counts SET label_count = label_count - 1
+                WHERE type_id = OLD.type_id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_labels_class_count_update
+            AFTER UPDATE OF type_id ON labels
+            WHEN OLD.type_id IS NOT NEW.type_id
+            BEGIN
+                UPDATE class_counts SET label_count = label_count - 1
+                WHERE type_id = OLD.type_id;
+                INSERT INTO class_counts (type_id, label_count) VALUES (NEW.type_id, 1)
+                ON CONFLICT(type_id) DO UPDATE SET label_count = label_count + 1;
+            END
+        """)
+
+        # 计数变化 -> 刷新该机型未处理预测的优先级（计数始终不低于阈值时排序不变）
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_class_counts_priority_insert
+            AFTER INSERT ON class_counts
+            WHEN NEW.label_count < {REVIEW_MIN_SAMPLES}
+            BEGIN
+                UPDATE ai_predictions SET review_priority = {REVIEW_PRIORITY_SQL}
+                WHERE processed = 0 AND aircraft_class = NEW.type_id;
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_class_counts_priority_update
+            AFTER UPDATE OF label_count ON class_counts
+            WHEN MIN(OLD.label_count, NEW.label_count) < {REVIEW_MIN_SAMPLES}
+            BEGIN
+                UPDATE ai_predictions SET review_priority = {REVIEW_PRIORITY_SQL}
+                WHERE processed = 0 AND aircraft_class = NEW.type_id;
+            END
+        """)
+
+        # 预测写入或相关字段变化 -> 重算该条预测的优先级
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_ai_predictions_priority_insert
+            AFTER INSERT ON ai_predictions
+            BEGIN
+                UPDATE ai_predictions SET review_priority = {REVIEW_PRIORITY_SQL}
+                WHERE id = NEW.id;
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_ai_predictions_priority_update
+            AFTER UPDATE OF aircraft_class, aircraft_confidence, airline_confidence,
+                is_new_class, outlier_score, processed ON ai_predictions
+            BEGIN
+                UPDATE ai_predictions SET review_priority = {REVIEW_PRIORITY_SQL}
+                WHERE id = NEW.id;
+            END
+        """)
+
+    def rebuild_review_priority(self):
+        """全量重建机型计数和复审优先级（数据被外部修改后使用）"""
+        with self.connection() as conn:
+            self._rebuild_review_priority(conn.cursor())
+            conn.commit()
+
     def load_preset_data(self, data_dir: str):
         """加载预置数据（航司和机型）"""
         airlines_file = os.path.join(data_dir, "airlines.json")
@@ -248,6 +838,7 @@ class Database:
                 "INSERT INTO airlines (code, name) VALUES (?, ?)", (code, name)
             )
             conn.commit()
+            self._code_maps = None
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             if not ignore_exists:
@@ -278,6 +869,7 @@ class Database:
                 "INSERT INTO aircraft_types (code, name) VALUES (?, ?)", (code, name)
             )
             conn.commit()
+            self._code_maps = None
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             if not ignore_exists:
@@ -322,30 +914,62 @@ class Database:
         conn.close()
         return row["code"] if row else None
 
+    def get_code_id_maps(self) -> dict:
+        """获取机型和航司的 code -> 数字 id 映射（缓存）
+
+        Returns:
+            {"aircraft_types": {code: id}, "airlines": {code: id}}
+        """
+        code_maps = self._code_maps
+        if code_maps is None:
+            code_maps = {
+                "aircraft_types": {t["code"]: t["id"] for t in self.get_aircraft_types()},
+                "airlines": {a["code"]: a["id"] for a in self.get_airlines()},
+            }
+            self._code_maps = code_maps
+        return code_maps
+
     # ==================== 标注操作 ====================
 
     def get_next_sequence(self, type_id: str) -> int:
-        """获取指定机型的下一个序号"""
+        """获取指定机型的下一个序号（仅查看，不分配；生成文件名请使用 allocate_sequence）"""
         conn = self.get_connection()
         cursor = conn.cursor()
         cursor.execute(
-            "SELECT file_name FROM labels WHERE type_id = ? ORDER BY file_name DESC LIMIT 1",
-            (type_id,),
+            "SELECT last_seq FROM type_sequences WHERE type_id = ?", (type_id,)
         )
         row = cursor.fetchone()
         conn.close()
+        return row["last_seq"] + 1 if row else 1
 
-        if row is None:
-            return 1
+    def reserve_sequences(self, type_id: str, count: int) -> list:
+        """
+        原子地为指定机型预留 count 个连续序号（单条 UPDATE ... RETURNING）
+        并发调用不会得到重复序号；预留后未使用的序号不会回收
 
-        # 解析文件名获取序号，格式：A320-0001.jpg
-        try:
-            file_name = row["file_name"]
-            name_part = os.path.splitext(file_name)[0]  # A320-0001
-            seq_str = name_part.split("-")[-1]  # 0001
-            return int(seq_str) + 1
-        except (ValueError, IndexError):
-            return 1
+        Returns:
+            预留的序号列表（升序）
+        """
+        if count <= 0:
+            return []
+
+        with self.connection() as conn:
+            row = conn.execute(
+                """
+                INSERT INTO type_sequences (type_id, last_seq) VALUES (?, ?)
+                ON CONFLICT(type_id) DO UPDATE SET last_seq = last_seq + excluded.last_seq
+                RETURNING last_seq
+            """,
+                (type_id, count),
+            ).fetchone()
+            conn.commit()
+
+        last_seq = row["last_seq"]
+        return list(range(last_seq - count + 1, last_seq + 1))
+
+    def allocate_sequence(self, type_id: str) -> int:
+        """原子地分配指定机型的下一个序号"""
+        return self.reserve_sequences(type_id, 1)[0]
 
     def add_label(self, data: dict) -> dict:
         """添加标注记录"""
@@ -373,9 +997,12 @@ class Database:
                 data["registration_area"],
             ),
         )
+        label_id = cursor.lastrowid
+        self._set_inventory_status(
+            cursor, data["original_file_name"], INVENTORY_LABELED
+        )
 
         conn.commit()
-        label_id = cursor.lastrowid
         conn.close()
 
         return {"id": label_id, "file_name": data["file_name"]}
@@ -407,105 +1034,141 @@ class Database:
             "items": [dict(row) for row in rows],
         }
 
-    def get_all_labels_for_export(
-        self, start_id: int = None, end_id: int = None
-    ) -> list:
-        """获取标注数据用于导出，支持ID范围筛选"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+    @staticmethod
+    def _export_filter(
+        start_id: int = None,
+        end_id: int = None,
+        since: int = None,
+        until: int = None,
+    ) -> tuple:
+        """
+        导出筛选条件
 
-        if start_id is not None and end_id is not None:
-            cursor.execute(
-                """
-                SELECT file_name, type_id, type_name, airline_id, airline_name,
-                       clarity, block, registration
-                FROM labels
-                WHERE id >= ? AND id <= ?
-                ORDER BY file_name
-            """,
-                (start_id, end_id),
-            )
-        elif start_id is not None:
-            cursor.execute(
-                """
-                SELECT file_name, type_id, type_name, airline_id, airline_name,
-                       clarity, block, registration
-                FROM labels
-                WHERE id >= ?
-                ORDER BY file_name
-            """,
-                (start_id,),
+        Args:
+            start_id, end_id: 标注ID范围
+            since: 只选择变更水位 seq > since 的标注（增量导出）
+            until: 只选择 seq <= until 的变更，与 since 一起使用
+
+        Returns:
+            (WHERE 子句, 参数列表)
+        """
+        clauses = []
+        params = []
+        if start_id is not None:
+            clauses.append("id >= ?")
+            params.append(start_id)
+        if end_id is not None:
+            clauses.append("id <= ?")
+            params.append(end_id)
+        if since is not None:
+            clauses.append(
+                "id IN (SELECT label_id FROM label_changes "
+                "WHERE seq > ? AND (? IS NULL OR seq <= ?) AND op = ?)"
             )
-        elif end_id is not None:
-            cursor.execute(
-                """
-                SELECT file_name, type_id, type_name, airline_id, airline_name,
-                       clarity, block, registration
-                FROM labels
-                WHERE id <= ?
-                ORDER BY file_name
-            """,
-                (end_id,),
+            params.extend([since, until, until, LABEL_CHANGE_UPSERT])
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        return where, params
+
+    def iter_labels_for_export(
+        self,
+        start_id: int = None,
+        end_id: int = None,
+        columns: tuple = (
+            "file_name", "type_id", "type_name", "airline_id", "airline_name",
+            "clarity", "block", "registration",
+        ),
+        batch_size: int = EXPORT_FETCH_SIZE,
+        since: int = None,
+        until: int = None,
+    ):
+        """
+        逐批读取导出用的标注数据（按文件名排序，支持ID范围筛选）
+        使用 fetchmany 分批读取，内存占用与标注总数无关；
+        传入 since 时只返回变更水位之后新增或修改的标注
+        """
+        where, params = self._export_filter(start_id, end_id, since, until)
+
+        with self.connection() as conn:
+            cursor = conn.execute(
+                f"SELECT {', '.join(columns)} FROM labels {where} ORDER BY file_name",
+                params,
             )
-        else:
-            cursor.execute("""
-                SELECT file_name, type_id, type_name, airline_id, airline_name,
-                       clarity, block, registration
-                FROM labels
-                ORDER BY file_name
-            """)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(row)
+
+    def count_labels_for_export(
+        self,
+        start_id: int = None,
+        end_id: int = None,
+        since: int = None,
+        until: int = None,
+    ) -> int:
+        """统计导出范围内的标注数量"""
+        where, params = self._export_filter(start_id, end_id, since, until)
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) AS count FROM labels {where}", params)
+        count = cursor.fetchone()["count"]
+        conn.close()
+        return count
 
+    def get_label_change_watermark(self) -> int:
+        """获取当前变更水位（最新一条标注变更的 seq，没有变更时为 0）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(seq), 0) AS seq FROM label_changes")
+        watermark = cursor.fetchone()["seq"]
+        conn.close()
+        return watermark
+
+    def get_deleted_labels(
+        self,
+        since: int,
+        until: int = None,
+        start_id: int = None,
+        end_id: int = None,
+    ) -> list:
+        """
+        获取变更水位之后删除的标注（墓碑）
+
+        Returns:
+            [{"label_id", "file_name", "seq"}]，按 seq 排序
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT label_id, file_name, seq FROM label_changes
+            WHERE seq > ? AND (? IS NULL OR seq <= ?) AND op = ?
+              AND (? IS NULL OR label_id >= ?) AND (? IS NULL OR label_id <= ?)
+            ORDER BY seq
+        """,
+            (since, until, until, LABEL_CHANGE_DELETE,
+             start_id, start_id, end_id, end_id),
+        )
         rows = cursor.fetchall()
         conn.close()
         return [dict(row) for row in rows]
 
+    def get_all_labels_for_export(
+        self, start_id: int = None, end_id: int = None
+    ) -> list:
+        """获取标注数据用于导出，支持ID范围筛选"""
+        return list(self.iter_labels_for_export(start_id, end_id))
+
     def get_all_labels_with_area(
         self, start_id: int = None, end_id: int = None
     ) -> list:
         """获取标注数据（包含区域信息）用于 YOLO 导出，支持ID范围筛选"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
-
-        if start_id is not None and end_id is not None:
-            cursor.execute(
-                """
-                SELECT file_name, registration_area
-                FROM labels
-                WHERE id >= ? AND id <= ?
-                ORDER BY file_name
-            """,
-                (start_id, end_id),
-            )
-        elif start_id is not None:
-            cursor.execute(
-                """
-                SELECT file_name, registration_area
-                FROM labels
-                WHERE id >= ?
-                ORDER BY file_name
-            """,
-                (start_id,),
-            )
-        elif end_id is not None:
-            cursor.execute(
-                """
-                SELECT file_name, registration_area
-                FROM labels
-                WHERE id <= ?
-                ORDER BY file_name
-            """,
-                (end_id,),
+        return list(
+            self.iter_labels_for_export(
+                start_id, end_id, columns=("file_name", "registration_area")
             )
-        else:
-            cursor.execute("""
-                SELECT file_name, registration_area
-                FROM labels
-                ORDER BY file_name
-            """)
-
-        rows = cursor.fetchall()
-        conn.close()
-        return [dict(row) for row in rows]
+        )
 
     def get_labeled_original_filenames(self) -> set:
         """获取所有已标注的原始文件名集合"""
@@ -563,6 +1226,16 @@ class Database:
         """删除标注记录"""
         conn = self.get_connection()
         cursor = conn.cursor()
+        # 移除清单记录，由下一次目录同步重新推导状态
+        cursor.execute(
+            """
+            DELETE FROM image_inventory
+            WHERE status = ? AND filename IN (
+                SELECT original_file_name FROM labels WHERE id = ?
+            )
+        """,
+            (INVENTORY_LABELED, label_id),
+        )
         cursor.execute("DELETE FROM labels WHERE id = ?", (label_id,))
         conn.commit()
         affected = cursor.rowcount
@@ -759,6 +1432,7 @@ class Database:
             cursor.execute(
                 "INSERT INTO skipped_images (filename) VALUES (?)", (filename,)
             )
+            self._set_inventory_status(cursor, filename, INVENTORY_SKIPPED)
             conn.commit()
             conn.close()
             return True
@@ -767,50 +1441,365 @@ class Database:
             conn.close()
             return False
 
-    # ==================== AI预测操作 ====================
+    # ==================== 图片清单操作 ====================
 
-    def add_ai_prediction(self, data: dict) -> dict:
-        """添加AI预测记录"""
+    def _set_inventory_status(
+        self, cursor, filename: str, status: str, only_from: str = None
+    ):
+        """在当前事务中更新图片清单状态（清单中不存在的文件由目录同步补齐）"""
+        if only_from:
+            cursor.execute(
+                """
+                UPDATE image_inventory SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE filename = ? AND status = ?
+            """,
+                (status, filename, only_from),
+            )
+        else:
+            cursor.execute(
+                """
+                UPDATE image_inventory SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE filename = ?
+            """,
+                (status, filename),
+            )
+
+    def sync_image_inventory(self, filenames) -> dict:
+        """
+        用目录扫描结果同步图片清单
+        新文件根据标注/跳过/预测记录推导状态；已从目录消失的待标注文件被移除，
+        已标注和已跳过的记录保留（已标注图片会被移出待标注目录）
+        """
         conn = self.get_connection()
         cursor = conn.cursor()
-
         try:
+            cursor.execute(
+                "CREATE TEMP TABLE IF NOT EXISTS inventory_scan (filename TEXT PRIMARY KEY)"
+            )
+            cursor.execute("DELETE FROM inventory_scan")
+            cursor.executemany(
+                "INSERT OR IGNORE INTO inventory_scan (filename) VALUES (?)",
+                ((filename,) for filename in filenames),
+            )
+
             cursor.execute(
                 """
-                INSERT INTO ai_predictions (
-                    filename, aircraft_class, aircraft_confidence,
-                    airline_class, airline_confidence, registration,
-                    registration_area, registration_confidence,
-                    clarity, block, quality_confidence,
-                    is_new_class, outlier_score, prediction_time
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                INSERT INTO image_inventory (filename, status)
+                SELECT s.filename,
+                    CASE
+                        WHEN EXISTS (SELECT 1 FROM labels l WHERE l.original_file_name = s.filename) THEN ?
+                        WHEN EXISTS (SELECT 1 FROM skipped_images k WHERE k.filename = s.filename) THEN ?
+                        WHEN EXISTS (SELECT 1 FROM ai_predictions p WHERE p.filename = s.filename) THEN ?
+                        ELSE ?
+                    END
+                FROM inventory_scan s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM image_inventory i WHERE i.filename = s.filename
+                )
             """,
                 (
-                    data["filename"],
-                    data["aircraft_class"],
-                    data["aircraft_confidence"],
-                    data["airline_class"],
-                    data["airline_confidence"],
-                    data.get("registration", ""),
-                    data.get("registration_area", ""),
-                    data.get("registration_confidence", 0.0),
-                    data.get("clarity", 0.0),
-                    data.get("block", 0.0),
-                    data.get("quality_confidence", 0.0),
-                    data.get("is_new_class", 0),
-                    data.get("outlier_score", 0.0),
-                    data["prediction_time"],
+                    INVENTORY_LABELED,
+                    INVENTORY_SKIPPED,
+                    INVENTORY_PREDICTED,
+                    INVENTORY_UNLABELED,
                 ),
             )
+            added = cursor.rowcount
+
+            cursor.execute(f"""
+                DELETE FROM image_inventory
+                WHERE status IN {INBOX_STATUS_SQL}
+                  AND filename NOT IN (SELECT filename FROM inventory_scan)
+            """)
+            removed = cursor.rowcount
 
+            cursor.execute("DELETE FROM inventory_scan")
             conn.commit()
+            return {"added": added, "removed": removed}
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            conn.close()
+
+    def get_inventory_filenames(self, statuses: tuple = INBOX_STATUSES) -> list:
+        """获取指定状态的图片文件名（按文件名排序）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        placeholders = ",".join("?" * len(statuses))
+        cursor.execute(
+            f"SELECT filename FROM image_inventory WHERE status IN ({placeholders}) ORDER BY filename",
+            tuple(statuses),
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return [row["filename"] for row in rows]
+
+    def get_inventory_counts(self) -> dict:
+        """按状态统计图片清单数量"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT status, COUNT(*) as count FROM image_inventory GROUP BY status"
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return {row["status"]: row["count"] for row in rows}
+
+    def get_inbox_view(
+        self,
+        user_id: str = "",
+        offset: int = 0,
+        limit: int = None,
+        sort: str = "filename",
+        after: str = None,
+        filters: dict = None,
+        with_total: bool = True,
+    ) -> dict:
+        """
+        获取待标注图片视图（一次查询关联清单、锁和 AI 预测）
+
+        Args:
+            user_id: 当前用户，自己持有的锁不视为锁定
+            offset: 偏移量（建议使用 after 游标分页）
+            limit: 返回数量，None 表示全部
+            sort: 排序方式，见 INBOX_SORTS
+            after: 上一页返回的 next_cursor（键集分页）
+            filters: 过滤条件，支持 is_new_class、quality_pass、
+                     min_confidence、max_confidence（按机型/航司较低置信度）
+            with_total: 是否统计总数
+
+        Returns:
+            {"total": 总数或 None, "items": [扁平化的行], "next_cursor": 下一页游标或 None}
+        """
+        if sort not in INBOX_SORTS:
+            raise ValueError(f"Unsupported sort: {sort}")
+        sort_key, direction = INBOX_SORTS[sort]
+        filters = {k: v for k, v in (filters or {}).items() if v is not None}
+
+        unknown = set(filters) - {
+            "is_new_class", "quality_pass", "min_confidence", "max_confidence"
+        }
+        if unknown:
+            raise ValueError(f"Unsupported filters: {', '.join(sorted(unknown))}")
+
+        # 按预测字段排序或过滤时以 ai_predictions 驱动查询（CROSS JOIN 固定连接顺序，
+        # 使 ORDER BY ... LIMIT 直接走 ai_predictions 上的索引），否则以图片清单驱动
+        prediction_driven = sort_key is not None or bool(filters)
+        if prediction_driven:
+            from_sql = """
+            FROM ai_predictions p
+            CROSS JOIN image_inventory i ON i.filename = p.filename"""
+            name_col = "p.filename"
+        else:
+            from_sql = """
+            FROM image_inventory i
+            LEFT JOIN ai_predictions p ON p.filename = i.filename"""
+            name_col = "i.filename"
+
+        where = [f"i.status IN {INBOX_STATUS_SQL}"]
+        where_params = []
+        if sort == "priority":
+            # 复审优先级索引只覆盖未处理的预测
+            where.append("p.processed = 0")
+        confidence_expr = INBOX_SORTS["confidence"][0]
+        if "is_new_class" in filters:
+            where.append("p.is_new_class = ?")
+            where_params.append(1 if filters["is_new_class"] else 0)
+        if "quality_pass" in filters:
+            where.append("p.quality_pass = ?")
+            where_params.append(1 if filters["quality_pass"] else 0)
+        if "min_confidence" in filters:
+            where.append(f"{confidence_expr} >= ?")
+            where_params.append(float(filters["min_confidence"]))
+        if "max_confidence" in filters:
+            where.append(f"{confidence_expr} <= ?")
+            where_params.append(float(filters["max_confidence"]))
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        total = None
+        if with_total:
+            cursor.execute(
+                f"SELECT COUNT(*) as count {from_sql} WHERE {' AND '.join(where)}",
+                where_params,
+            )
+            total = cursor.fetchone()["count"]
+
+        # 键集分页：从游标位置之后继续，代价与页码无关
+        page_where = list(where)
+        page_params = list(where_params)
+        if after:
+            cursor_values = self._decode_inbox_cursor(after, sort)
+            op = ">" if direction == "ASC" else "<"
+            if sort_key is None:
+                page_where.append(f"{name_col} {op} ?")
+                page_params.extend(cursor_values)
+            else:
+                # 拆成 key >= v AND (key > v OR name > f)，前半部分可作为索引范围起点
+                key_value, last_name = cursor_values
+                page_where.append(
+                    f"{sort_key} {op}= ? AND ({sort_key} {op} ? OR {name_col} {op} ?)"
+                )
+                page_params.extend([key_value, key_value, last_name])
+
+        if sort_key is None:
+            order_sql = f"{name_col} {direction}"
+        else:
+            order_sql = f"{sort_key} {direction}, {name_col} {direction}"
+
+        # 过期的锁在连接条件中排除，无需先执行清理写操作
+        sql = f"""
+            SELECT
+                i.filename,
+                l.user_id AS locked_by,
+                p.id IS NOT NULL AS has_ai_prediction,
+                p.aircraft_class, p.aircraft_confidence,
+                p.airline_class, p.airline_confidence,
+                p.registration, p.registration_area, p.registration_confidence,
+                p.clarity, p.block, p.is_new_class, p.outlier_score, p.quality_pass,
+                p.review_priority
+            {from_sql}
+            LEFT JOIN image_locks l
+                ON l.filename = i.filename AND l.locked_at >= ? AND l.user_id != ?
+            WHERE {' AND '.join(page_where)}
+            ORDER BY {order_sql}
+        """
+        params = [time.time() - LOCK_TIMEOUT, user_id, *page_params]
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            params.extend([limit, offset])
+        elif offset:
+            sql += " LIMIT -1 OFFSET ?"
+            params.append(offset)
+
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+        conn.close()
+
+        items = [dict(row) for row in rows]
+        next_cursor = None
+        if limit is not None and len(items) == limit:
+            next_cursor = self._encode_inbox_cursor(items[-1], sort)
+
+        return {"total": total, "items": items, "next_cursor": next_cursor}
+
+    @staticmethod
+    def _encode_inbox_cursor(row: dict, sort: str) -> str:
+        """将一行的排序键编码为不透明游标"""
+        if sort == "confidence":
+            values = [min(row["aircraft_confidence"], row["airline_confidence"])]
+        elif sort == "outlier_score":
+            values = [row["outlier_score"]]
+        elif sort == "priority":
+            values = [row["review_priority"]]
+        else:
+            values = []
+        values.append(row["filename"])
+        raw = json.dumps([sort, values], ensure_ascii=False).encode("utf-8")
+        return base64.urlsafe_b64encode(raw).decode("ascii")
+
+    @staticmethod
+    def _decode_inbox_cursor(cursor_str: str, sort: str) -> list:
+        """解析游标，游标与排序方式不匹配时抛出 ValueError"""
+        try:
+            cursor_sort, values = json.loads(
+                base64.urlsafe_b64decode(cursor_str.encode("ascii"))
+            )
+        except Exception:
+            raise ValueError("Invalid cursor")
+        if cursor_sort != sort:
+            raise ValueError("Cursor does not match sort")
+        return values
+
+    # ==================== AI预测操作 ====================
+
+    _AI_PREDICTION_INSERT_SQL = """
+        INSERT INTO ai_predictions (
+            filename, aircraft_class, aircraft_confidence,
+            airline_class, airline_confidence, registration,
+            registration_area, registration_confidence,
+            clarity, block, quality_confidence,
+            is_new_class, outlier_score, quality_pass, prediction_time
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """
+
+    @staticmethod
+    def _ai_prediction_params(data: dict) -> tuple:
+        """AI预测结果转换为插入参数"""
+        return (
+            data["filename"],
+            data["aircraft_class"],
+            data["aircraft_confidence"],
+            data["airline_class"],
+            data["airline_confidence"],
+            data.get("registration", ""),
+            data.get("registration_area", ""),
+            data.get("registration_confidence", 0.0),
+            data.get("clarity", 0.0),
+            data.get("block", 0.0),
+            data.get("quality_confidence", 0.0),
+            data.get("is_new_class", 0),
+            data.get("outlier_score", 0.0),
+            1 if data.get("quality_pass", True) else 0,
+            data["prediction_time"],
+        )
+
+    def add_ai_prediction(self, data: dict) -> dict:
+        """添加AI预测记录"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+
+        try:
+            cursor.execute(
+                self._AI_PREDICTION_INSERT_SQL, self._ai_prediction_params(data)
+            )
             pred_id = cursor.lastrowid
+            self._set_inventory_status(
+                cursor,
+                data["filename"],
+                INVENTORY_PREDICTED,
+                only_from=INVENTORY_UNLABELED,
+            )
+
+            conn.commit()
             conn.close()
             return {"id": pred_id, "filename": data["filename"]}
         except sqlite3.IntegrityError:
             conn.close()
             return {"error": "Prediction already exists"}
 
+    def add_ai_predictions(self, items: list) -> dict:
+        """
+        批量添加AI预测记录（单个事务）
+        已存在预测的文件被忽略，计入 duplicates
+        """
+        if not items:
+            return {"inserted": 0, "duplicates": 0}
+
+        with self.connection() as conn:
+            # rowcount 不包含触发器产生的修改
+            inserted = conn.executemany(
+                self._AI_PREDICTION_INSERT_SQL.replace(
+                    "INSERT INTO", "INSERT OR IGNORE INTO", 1
+                ),
+                [self._ai_prediction_params(data) for data in items],
+            ).rowcount
+            conn.executemany(
+                """
+                UPDATE image_inventory SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE filename = ? AND status = ?
+            """,
+                [
+                    (INVENTORY_PREDICTED, data["filename"], INVENTORY_UNLABELED)
+                    for data in items
+                ],
+            )
+            conn.commit()
+
+        return {"inserted": inserted, "duplicates": len(items) - inserted}
+
     def get_ai_prediction(self, filename: str) -> Optional[dict]:
         """获取指定文件的AI预测结果"""
         conn = self.get_connection()
@@ -820,59 +1809,50 @@ class Database:
         conn.close()
         return dict(row) if row else None
 
+    def get_ai_predictions(self, filenames: list) -> dict:
+        """批量获取AI预测结果（单次查询），返回 {filename: 预测}"""
+        if not filenames:
+            return {}
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT * FROM ai_predictions
+            WHERE filename IN (SELECT value FROM json_each(?))
+        """,
+            (json.dumps(list(filenames)),),
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return {row["filename"]: dict(row) for row in rows}
+
     def get_unprocessed_predictions(self, limit: int = None) -> list:
         """获取未处理的AI预测记录（按优先级排序）"""
         conn = self.get_connection()
         cursor = conn.cursor()
 
-        # 排序优先级：
+        # 排序优先级（预先计算在 review_priority 中，见 REVIEW_PRIORITY_SQL）：
         # 1. 新类别 (is_new_class=1) - 按outlier_score降序
         # 2. 样本量<8的已知类别 - 按样本量升序（样本越少越优先）
         # 3. 样本量>=8的已知类别 - 按置信度升序（置信度越低越优先）
-        if limit:
-            cursor.execute(
-                """
-                SELECT 
-                    p.*,
-                    CASE 
-                        WHEN p.is_new_class = 1 THEN 0
-                        WHEN (SELECT COUNT(*) FROM labels WHERE type_id = p.aircraft_class) < 8 THEN 1
-                        ELSE 2
-                    END AS priority,
-                    (SELECT COUNT(*) FROM labels WHERE type_id = p.aircraft_class) AS sample_count
-                FROM ai_predictions p
-                WHERE p.processed = 0
-                ORDER BY 
-                    priority ASC,
-                    CASE 
-                        WHEN priority = 0 THEN -p.outlier_score
-                        WHEN priority = 1 THEN sample_count
-                        ELSE MIN(p.aircraft_confidence, p.airline_confidence)
-                    END ASC
-                LIMIT ?
-            """,
-                (limit,),
-            )
-        else:
-            cursor.execute("""
-                SELECT 
-                    p.*,
-                    CASE 
-                        WHEN p.is_new_class = 1 THEN 0
-                        WHEN (SELECT COUNT(*) FROM labels WHERE type_id = p.aircraft_class) < 8 THEN 1
-                        ELSE 2
-                    END AS priority,
-                    (SELECT COUNT(*) FROM labels WHERE type_id = p.aircraft_class) AS sample_count
-                FROM ai_predictions p
-                WHERE p.processed = 0
-                ORDER BY 
-                    priority ASC,
-                    CASE 
-                        WHEN priority = 0 THEN -p.outlier_score
-                        WHEN priority = 1 THEN sample_count
-                        ELSE MIN(p.aircraft_confidence, p.airline_confidence)
-                    END ASC
-            """)
+        cursor.execute(
+            f"""
+            SELECT
+                p.*,
+                CASE
+                    WHEN p.is_new_class = 1 THEN 0
+                    WHEN COALESCE(c.label_count, 0) < {REVIEW_MIN_SAMPLES} THEN 1
+                    ELSE 2
+                END AS priority,
+                COALESCE(c.label_count, 0) AS sample_count
+            FROM ai_predictions p
+            LEFT JOIN class_counts c ON c.type_id = p.aircraft_class
+            WHERE p.processed = 0
+            ORDER BY p.review_priority, p.filename
+            LIMIT ?
+        """,
+            (limit if limit else -1,),
+        )
 
         rows = cursor.fetchall()
         conn.close()
@@ -910,6 +1890,64 @@ class Database:
         conn.close()
         return affected > 0
 
+    def add_approved_labels(self, labels: list, review_status: str = "auto_approved") -> list:
+        """
+        批量写入由AI预测批准的标注（单个事务）
+        插入标注、标记预测为已处理并更新图片清单，任一步失败则整体回滚
+
+        Args:
+            labels: 标注数据列表（字段同 add_label）
+            review_status: 标注的复审状态
+
+        Returns:
+            新标注的 id 列表（与 labels 顺序一致）
+        """
+        if not labels:
+            return []
+
+        with self.connection() as conn:
+            cursor = conn.cursor()
+            label_ids = []
+            for data in labels:
+                cursor.execute(
+                    """
+                    INSERT INTO labels (
+                        file_name, original_file_name, type_id, type_name,
+                        airline_id, airline_name, clarity, block,
+                        registration, registration_area, review_status, ai_approved
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 1)
+                """,
+                    (
+                        data["file_name"],
+                        data["original_file_name"],
+                        data["type_id"],
+                        data["type_name"],
+                        data["airline_id"],
+                        data["airline_name"],
+                        data["clarity"],
+                        data["block"],
+                        data["registration"],
+                        data["registration_area"],
+                        review_status,
+                    ),
+                )
+                label_ids.append(cursor.lastrowid)
+
+            originals = [(data["original_file_name"],) for data in labels]
+            cursor.executemany(
+                "UPDATE ai_predictions SET processed = 1 WHERE filename = ?", originals
+            )
+            cursor.executemany(
+                """
+                UPDATE image_inventory SET status = ?, updated_at = CURRENT_TIMESTAMP
+                WHERE filename = ?
+            """,
+                [(INVENTORY_LABELED, name) for (name,) in originals],
+            )
+            conn.commit()
+
+        return label_ids
+
     def update_ai_prediction_new_class_flag(
         self, filename: str, is_new_class: int, outlier_score: float = 0.0
     ) -> bool:
@@ -925,6 +1963,27 @@ class Database:
         conn.close()
         return affected > 0
 
+    def bulk_update_new_class_flags(self, items: list) -> int:
+        """
+        批量标记新类别（单个事务）
+
+        Args:
+            items: (filename, outlier_score) 列表
+
+        Returns:
+            更新的记录数
+        """
+        if not items:
+            return 0
+
+        with self.connection() as conn:
+            affected = conn.executemany(
+                "UPDATE ai_predictions SET is_new_class = 1, outlier_score = ? WHERE filename = ?",
+                [(outlier_score, filename) for filename, outlier_score in items],
+            ).rowcount
+            conn.commit()
+        return affected
+
     def update_label_with_ai_data(self, label_id: int, ai_data: dict) -> bool:
         """更新标注记录的AI相关字段"""
         conn = self.get_connection()
@@ -1353,3 +2412,298 @@ class Database:
             conn.rollback()
             conn.close()
             raise e
+
+    # ==================== 导出任务操作 ====================
+
+    @staticmethod
+    def _parse_export_job(row) -> dict:
+        job = dict(row)
+        job["params"] = json.loads(job["params_json"]) if job.get("params_json") else {}
+        return job
+
+    def create_export_job(self, export_type: str, params: dict = None) -> int:
+        """创建导出任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO export_jobs (export_type, status, params_json) VALUES (?, ?, ?)",
+            (export_type, "queued", json.dumps(params or {})),
+        )
+        conn.commit()
+        job_id = cursor.lastrowid
+        conn.close()
+        return job_id
+
+    def update_export_job(self, job_id: int, status: str = None, **kwargs) -> bool:
+        """更新导出任务状态和进度"""
+        update_fields = []
+        values = []
+
+        if status is not None:
+            update_fields.append("status = ?")
+            values.append(status)
+            if status == "running":
+                update_fields.append("started_at = CURRENT_TIMESTAMP")
+            if status in ["completed", "failed", "cancelled"]:
+                update_fields.append("completed_at = CURRENT_TIMESTAMP")
+        for field in ["progress", "total", "file_path", "file_size", "error_message", "watermark"]:
+            if field in kwargs:
+                update_fields.append(f"{field} = ?")
+                values.append(kwargs[field])
+
+        if not update_fields:
+            return False
+        values.append(job_id)
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"UPDATE export_jobs SET {', '.join(update_fields)} WHERE id = ?", values
+        )
+        conn.commit()
+        affected = cursor.rowcount
+        conn.close()
+        return affected > 0
+
+    def get_export_job(self, job_id: int) -> Optional[dict]:
+        """获取导出任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM export_jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return self._parse_export_job(row) if row else None
+
+    def get_export_jobs(self, limit: int = None) -> list:
+        """获取导出任务列表（最新的在前）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM export_jobs ORDER BY id DESC LIMIT ?",
+            (limit if limit else -1,),
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return [self._parse_export_job(row) for row in rows]
+
+    def get_expired_export_jobs(self, max_age_seconds: float) -> list:
+        """获取已结束且超过保留时间的导出任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT * FROM export_jobs
+            WHERE status IN ('completed', 'failed', 'cancelled')
+              AND completed_at < datetime('now', ?)
+        """,
+            (f"-{int(max_age_seconds)} seconds",),
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return [self._parse_export_job(row) for row in rows]
+
+    def fail_interrupted_export_jobs(self) -> int:
+        """将上次进程退出时未完成的导出任务标记为失败"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            UPDATE export_jobs
+            SET status = 'failed', error_message = 'Interrupted by restart',
+                completed_at = CURRENT_TIMESTAMP
+            WHERE status IN ('queued', 'running')
+        """
+        )
+        conn.commit()
+        affected = cursor.rowcount
+        conn.close()
+        return affected
+
+    def delete_export_job(self, job_id: int) -> bool:
+        """删除导出任务记录"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM export_jobs WHERE id = ?", (job_id,))
+        conn.commit()
+        affected = cursor.rowcount
+        conn.close()
+        return affected > 0
+
+    # ==================== 后台预测任务操作 ====================
+
+    def create_prediction_job(self, trigger: str) -> int:
+        """创建后台预测任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO prediction_jobs (trigger, status, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)",
+            (trigger, "queued"),
+        )
+        conn.commit()
+        job_id = cursor.lastrowid
+        conn.close()
+        return job_id
+
+    def update_prediction_job(self, job_id: int, status: str = None, **kwargs) -> bool:
+        """更新后台预测任务状态、进度和断点"""
+        update_fields = ["updated_at = CURRENT_TIMESTAMP"]
+        values = []
+
+        if status is not None:
+            update_fields.append("status = ?")
+            values.append(status)
+            if status == "running":
+                update_fields.append("started_at = COALESCE(started_at, CURRENT_TIMESTAMP)")
+            if status in ["completed", "failed"]:
+                update_fields.append("completed_at = CURRENT_TIMESTAMP")
+        for field in ["total", "processed", "saved", "duplicates", "errors",
+                      "new_class_count", "last_filename", "error_message"]:
+            if field in kwargs:
+                update_fields.append(f"{field} = ?")
+                values.append(kwargs[field])
+        values.append(job_id)
+
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            f"UPDATE prediction_jobs SET {', '.join(update_fields)} WHERE id = ?", values
+        )
+        conn.commit()
+        affected = cursor.rowcount
+        conn.close()
+        return affected > 0
+
+    def get_prediction_job(self, job_id: int) -> Optional[dict]:
+        """获取后台预测任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM prediction_jobs WHERE id = ?", (job_id,))
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def get_latest_prediction_job(self) -> Optional[dict]:
+        """获取最近一次后台预测任务"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM prediction_jobs ORDER BY id DESC LIMIT 1")
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    # ==================== 特征向量索引操作 ====================
+
+    def get_embedding_set(self, model_version: str) -> Optional[dict]:
+        """获取模型版本的特征向量集合信息"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT * FROM embedding_sets WHERE model_version = ?", (model_version,)
+        )
+        row = cursor.fetchone()
+        conn.close()
+        return dict(row) if row else None
+
+    def get_embedding_sets(self) -> list:
+        """获取所有特征向量集合（含已索引的文件数）"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            """
+            SELECT s.*, (
+                SELECT COUNT(*) FROM embedding_index i WHERE i.model_version = s.model_version
+            ) AS indexed_count
+            FROM embedding_sets s
+            ORDER BY s.created_at
+        """
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        return [dict(row) for row in rows]
+
+    def create_embedding_set(self, model_version: str, dim: int, dtype: str) -> dict:
+        """创建特征向量集合（已存在时保持不变），返回集合信息"""
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT OR IGNORE INTO embedding_sets (model_version, dim, dtype) VALUES (?, ?, ?)",
+            (model_version, dim, dtype),
+        )
+        conn.commit()
+        conn.close()
+        return self.get_embedding_set(model_version)
+
+    def add_embedding_rows(self, model_version: str, filenames: list, start_row: int) -> int:
+        """
+        登记追加到矩阵文件中的特征向量（单个事务）
+
+        Args:
+            model_version: 模型版本
+            filenames: 按行顺序排列的文件名，第 i 个对应第 start_row + i 行
+            start_row: 本次追加的起始行号
+
+        Returns:
+            集合的总行数
+        """
+        row_count = start_row + len(filenames)
+        with self.connection() as conn:
+            conn.executemany(
+                """
+                INSERT INTO embedding_index (model_version, filename, row)
+                VALUES (?, ?, ?)
+                ON CONFLICT(model_version, filename) DO UPDATE SET
+                    row = excluded.row, updated_at = CURRENT_TIMESTAMP
+            """,
+                [
+                    (model_version, filename, start_row + i)
+                    for i, filename in enumerate(filenames)
+                ],
+            )
+            conn.execute(
+                "UPDATE embedding_sets SET row_count = ? WHERE model_version = ?",
+                (row_count, model_version),
+            )
+            conn.commit()
+        return row_count
+
+    def get_embedding_rows(self, model_version: str, filenames: list = None) -> dict:
+        """
+        获取文件名对应的矩阵行号
+
+        Args:
+            filenames: 文件名列表，为 None 时返回集合中的全部文件
+
+        Returns:
+            {filename: row}
+        """
+        conn = self.get_connection()
+        cursor = conn.cursor()
+        if filenames is None:
+            cursor.execute(
+                "SELECT filename, row FROM embedding_index WHERE model_version = ? ORDER BY row",
+                (model_version,),
+            )
+        else:
+            cursor.execute(
+                """
+                SELECT filename, row FROM embedding_index
+                WHERE model_version = ? AND filename IN (SELECT value FROM json_each(?))
+                ORDER BY row
+            """,
+                (model_version, json.dumps(list(filenames))),
+            )
+        rows = cursor.fetchall()
+        conn.close()
+        return {row["filename"]: row["row"] for row in rows}
+
+    def delete_embedding_set(self, model_version: str) -> bool:
+        """删除特征向量集合及其索引"""
+        with self.connection() as conn:
+            conn.execute(
+                "DELETE FROM embedding_index WHERE model_version = ?", (model_version,)
+            )
+            affected = conn.execute(
+                "DELETE FROM embedding_sets WHERE model_version = ?", (model_version,)
+            ).rowcount
+            conn.commit()
+        return affected > 0
@@ -0,0 +1,159 @@
+"""
+特征向量存储
+预测时捕获的特征向量按模型版本追加写入矩阵文件（float16/float32 行主序），
+文件名 -> 行号的索引保存在 SQLite；读取时以内存映射方式打开矩阵，
+聚类、近重复检索等无需加载模型也不必把整个矩阵读入内存
+"""
+
+import os
+import re
+import logging
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+from database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+# 支持的存储精度
+EMBEDDING_DTYPES = ("float16", "float32")
+
+
+class EmbeddingStore:
+    """按模型版本组织的内存映射特征向量存储"""
+
+    def __init__(self, db: Database, store_dir: str, dtype: str = "float16"):
+        """
+        初始化特征向量存储
+
+        Args:
+            db: 数据库实例
+            store_dir: 矩阵文件目录
+            dtype: 新建集合的存储精度（float16 / float32）
+        """
+        if dtype not in EMBEDDING_DTYPES:
+            raise ValueError(f"Unsupported embedding dtype: {dtype}")
+        self.db = db
+        self.store_dir = store_dir
+        self.dtype = dtype
+
+        os.makedirs(store_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def matrix_path(self, model_version: str) -> str:
+        """模型版本对应的矩阵文件路径"""
+        safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", model_version)
+        return os.path.join(self.store_dir, f"{safe_name}.emb")
+
+    def add(self, model_version: str, filenames: list, embeddings) -> int:
+        """
+        追加特征向量
+
+        同一文件名再次写入时索引指向新行，旧行不再被引用
+
+        Args:
+            model_version: 生成特征的模型版本
+            filenames: 文件名列表
+            embeddings: 与 filenames 对齐的 (n, dim) 矩阵
+
+        Returns:
+            写入的行数
+        """
+        if not filenames:
+            return 0
+        embeddings = np.asarray(embeddings)
+        if embeddings.ndim != 2 or len(embeddings) != len(filenames):
+            raise ValueError(
+                f"Embeddings shape {embeddings.shape} does not match {len(filenames)} filenames"
+            )
+
+        with self._lock:
+            info = self.db.get_embedding_set(model_version) or self.db.create_embedding_set(
+                model_version, embeddings.shape[1], self.dtype
+            )
+            if info["dim"] != embeddings.shape[1]:
+                raise ValueError(
+                    f"Embedding dim {embeddings.shape[1]} does not match "
+                    f"{info['dim']} of model version {model_version}"
+                )
+
+            dtype = np.dtype(info["dtype"])
+            row_bytes = info["dim"] * dtype.itemsize
+            start_row = info["row_count"]
+            path = self.matrix_path(model_version)
+
+            # 先写文件再提交索引：上次写入后未提交的尾部数据在这里截掉
+            with open(path, "ab") as f:
+                f.truncate(start_row * row_bytes)
+                f.write(np.ascontiguousarray(embeddings, dtype=dtype).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+            self.db.add_embedding_rows(model_version, list(filenames), start_row)
+
+        logger.debug(f"Stored {len(filenames)} embeddings for {model_version}")
+        return len(filenames)
+
+    def matrix(self, model_version: str) -> Optional[np.ndarray]:
+        """
+        以只读内存映射方式打开模型版本的全部特征向量（包含已被覆盖的旧行）
+
+        Returns:
+            (row_count, dim) 矩阵，集合不存在时返回 None
+        """
+        info = self.db.get_embedding_set(model_version)
+        if info is None:
+            return None
+        dtype = np.dtype(info["dtype"])
+        if info["row_count"] == 0:
+            return np.empty((0, info["dim"]), dtype=dtype)
+        return np.memmap(
+            self.matrix_path(model_version),
+            dtype=dtype,
+            mode="r",
+            shape=(info["row_count"], info["dim"]),
+        )
+
+    def get(
+        self,
+        model_version: str,
+        filenames: list = None,
+        limit: int = None,
+    ) -> Tuple[list, np.ndarray]:
+        """
+        读取文件的特征向量
+
+        Args:
+            filenames: 文件名列表，为 None 时读取集合中的全部文件
+            limit: 最多读取的条数，超过时随机抽样（只读取抽中的行）
+
+        Returns:
+            (找到的文件名列表, 对应的特征矩阵)；未找到的文件不包含在结果中
+        """
+        matrix = self.matrix(model_version)
+        if matrix is None:
+            return [], np.empty((0, 0), dtype=np.dtype(self.dtype))
+        rows = self.db.get_embedding_rows(model_version, filenames)
+        found = list(rows)
+        if limit is not None and len(found) > limit:
+            rng = np.random.default_rng(0)
+            found = [found[i] for i in np.sort(rng.choice(len(found), limit, replace=False))]
+        return found, np.asarray(matrix[[rows[name] for name in found]])
+
+    def versions(self) -> list:
+        """列出已存储的模型版本"""
+        return self.db.get_embedding_sets()
+
+    def delete(self, model_version: str) -> bool:
+        """删除模型版本的特征向量及矩阵文件"""
+        with self._lock:
+            deleted = self.db.delete_embedding_set(model_version)
+            try:
+                os.remove(self.matrix_path(model_version))
+            except FileNotFoundError:
+                pass
+        return deleted
@@ -0,0 +1,427 @@
+"""
+标注数据导出
+提供 CSV / YOLO / 照片 / 完整数据集的流式导出内容生成（全量或按变更水位增量），
+以及在后台线程池中执行导出、把产物写入导出目录的导出任务管理
+"""
+
+import os
+import csv
+import time
+import logging
+import threading
+import zipfile
+from io import StringIO
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Optional
+
+from database import Database, LABEL_CHANGE_DELETE, LABEL_CHANGE_UPSERT
+from zip_stream import iter_zip_stream
+
+
+logger = logging.getLogger(__name__)
+
+
+# 支持的导出类型 -> 下载文件名
+EXPORT_FILE_NAMES = {
+    "csv": "labels.csv",
+    "yolo": "yolo_labels.zip",
+    "images": "labeled_images.zip",
+    "dataset": "dataset.zip",
+}
+# 各导出类型需要遍历标注的次数（用于计算进度总数）
+EXPORT_PASSES = {"csv": 1, "yolo": 1, "images": 1, "dataset": 3}
+
+# 流式 CSV 导出时累积到该大小（字符）再输出
+CSV_STREAM_CHUNK_SIZE = 64 * 1024
+# 进度写入数据库的最小间隔（秒）
+PROGRESS_UPDATE_INTERVAL = 1.0
+# 增量 ZIP 导出中记录已删除标注文件名的条目
+DELETED_LIST_NAME = "deleted.txt"
+
+
+class ExportCancelled(Exception):
+    """导出任务被取消"""
+
+
+# ==================== 导出内容 ====================
+
+def iter_labels_csv(
+    db: Database,
+    start_id: int = None,
+    end_id: int = None,
+    on_row: Optional[Callable[[], None]] = None,
+    since: int = None,
+    until: int = None,
+) -> Iterator[bytes]:
+    """
+    生成标注数据 CSV（UTF-8 BOM，typeid/airlineid 为数字 id）
+    增量导出（传入 since）时增加 change 列：新增或修改的标注为 upsert，
+    已删除的标注以只有 filename 的 delete 行（墓碑）附在末尾
+    """
+    # 机型和航司的映射（code -> id）
+    code_maps = db.get_code_id_maps()
+    aircraft_types = code_maps["aircraft_types"]
+    airlines = code_maps["airlines"]
+
+    buffer = StringIO()
+    # 写入 UTF-8 BOM 以支持 Excel 中文显示
+    buffer.write("\ufeff")
+    writer = csv.writer(buffer)
+
+    delta = since is not None
+    change = [LABEL_CHANGE_UPSERT] if delta else []
+
+    # 写入表头
+    writer.writerow(["filename", "typeid", "typename", "airlineid",
+                     "airlinename", "clarity", "block", "registration"]
+                    + (["change"] if delta else []))
+
+    # typeid/airlineid 使用数据库数字id，typename/airlinename 使用 code
+    for label in db.iter_labels_for_export(start_id, end_id, since=since, until=until):
+        type_code = label["type_id"]  # 当前存储的是code
+        airline_code = label["airline_id"]  # 当前存储的是code
+        writer.writerow([
+            label["file_name"],
+            aircraft_types.get(type_code, type_code),  # 数字id
+            type_code,  # code 作为 typename
+            airlines.get(airline_code, airline_code),  # 数字id
+            airline_code,  # code 作为 airlinename
+            label["clarity"],
+            label["block"],
+            label["registration"],
+        ] + change)
+        if on_row:
+            on_row()
+
+        if buffer.tell() >= CSV_STREAM_CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    if delta:
+        for deleted in db.get_deleted_labels(since, until, start_id, end_id):
+            writer.writerow([deleted["file_name"]] + [""] * 7 + [LABEL_CHANGE_DELETE])
+
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_yolo_entries(
+    db: Database,
+    start_id: int = None,
+    end_id: int = None,
+    on_row: Optional[Callable[[], None]] = None,
+    prefix: str = "",
+    since: int = None,
+    until: int = None,
+):
+    """生成 YOLO 标注文件的 ZIP 条目（与图片同名的 txt）"""
+    for label in db.iter_labels_for_export(
+        start_id, end_id, columns=("file_name", "registration_area"),
+        since=since, until=until,
+    ):
+        img_name = os.path.splitext(label["file_name"])[0]
+
+        # YOLO 格式: class_id x_center y_center width height
+        # registration_area 已经是 "x_center y_center width height" 格式
+        if label["registration_area"]:
+            content = f"0 {label['registration_area']}"
+        else:
+            content = ""
+
+        yield f"{prefix}{img_name}.txt", None, content.encode("utf-8")
+        if on_row:
+            on_row()
+
+
+def iter_image_entries(
+    db: Database,
+    labeled_dir: str,
+    start_id: int = None,
+    end_id: int = None,
+    on_row: Optional[Callable[[], None]] = None,
+    prefix: str = "",
+    since: int = None,
+    until: int = None,
+):
+    """生成已标注照片的 ZIP 条目"""
+    for label in db.iter_labels_for_export(
+        start_id, end_id, columns=("file_name",), since=since, until=until
+    ):
+        yield (
+            f"{prefix}{label['file_name']}",
+            os.path.join(labeled_dir, label["file_name"]),
+            None,
+        )
+        if on_row:
+            on_row()
+
+
+def iter_deleted_entry(
+    db: Database,
+    since: int,
+    until: int = None,
+    start_id: int = None,
+    end_id: int = None,
+):
+    """生成增量 ZIP 中记录已删除标注文件名（每行一个）的条目"""
+    deleted = db.get_deleted_labels(since, until, start_id, end_id)
+    content = "".join(f"{item['file_name']}\n" for item in deleted)
+    yield DELETED_LIST_NAME, None, content.encode("utf-8")
+
+
+def iter_export(
+    db: Database,
+    export_type: str,
+    labeled_dir: str,
+    start_id: int = None,
+    end_id: int = None,
+    on_row: Optional[Callable[[], None]] = None,
+    missing: Optional[list] = None,
+    since: int = None,
+    until: int = None,
+) -> Iterator[bytes]:
+    """
+    生成指定类型的导出内容
+
+    Args:
+        export_type: csv / yolo / images / dataset（CSV + YOLO + 照片的 zip）
+        on_row: 每处理一条标注调用一次（进度和取消检查）
+        missing: 记录缺失的照片文件名
+        since: 增量导出，只包含变更水位之后新增、修改和删除的标注；
+               ZIP 导出的已删除文件名写入 deleted.txt
+        until: 增量导出的截止水位（通常为导出开始时的 get_label_change_watermark()）
+    """
+    delta = {"since": since, "until": until}
+
+    def with_deleted(entries):
+        yield from entries
+        if since is not None:
+            yield from iter_deleted_entry(db, since, until, start_id, end_id)
+
+    if export_type == "csv":
+        return iter_labels_csv(db, start_id, end_id, on_row, **delta)
+    if export_type == "yolo":
+        return iter_zip_stream(
+            with_deleted(iter_yolo_entries(db, start_id, end_id, on_row, **delta)),
+            compression=zipfile.ZIP_DEFLATED,
+        )
+    if export_type == "images":
+        # 图片本身已压缩，不再 deflate
+        return iter_zip_stream(
+            with_deleted(
+                iter_image_entries(db, labeled_dir, start_id, end_id, on_row, **delta)
+            ),
+            missing=missing,
+        )
+    if export_type == "dataset":
+        def entries():
+            yield "labels.csv", None, iter_labels_csv(db, start_id, end_id, on_row, **delta)
+            yield from iter_yolo_entries(
+                db, start_id, end_id, on_row, prefix="labels/", **delta
+            )
+            yield from iter_image_entries(
+                db, labeled_dir, start_id, end_id, on_row, prefix="images/", **delta
+            )
+        return iter_zip_stream(with_deleted(entries()), missing=missing)
+    raise ValueError(f"Unsupported export type: {export_type}")
+
+
+# ==================== 后台导出任务 ====================
+
+class ExportJobManager:
+    """后台导出任务管理"""
+
+    def __init__(
+        self,
+        db: Database,
+        labeled_dir: str,
+        spool_dir: str,
+        max_workers: int = 2,
+        retention_seconds: float = 24 * 3600,
+    ):
+        """
+        初始化导出任务管理
+
+        Args:
+            db: 数据库实例
+            labeled_dir: 已标注图片目录
+            spool_dir: 导出产物目录
+            max_workers: 同时执行的导出任务数
+            retention_seconds: 已结束任务及其产物的保留时间
+        """
+        self.db = db
+        self.labeled_dir = labeled_dir
+        self.spool_dir = spool_dir
+        self.retention_seconds = retention_seconds
+
+        os.makedirs(spool_dir, exist_ok=True)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="export"
+        )
+        self._lock = threading.Lock()
+        self._cancelled = set()
+
+        # 上次进程退出时未完成的任务无法继续，标记失败并清理残留的临时文件
+        interrupted = db.fail_interrupted_export_jobs()
+        if interrupted:
+            logger.warning(f"Marked {interrupted} interrupted export jobs as failed")
+        for name in os.listdir(spool_dir):
+            if name.endswith(".part"):
+                self._remove_file(os.path.join(spool_dir, name))
+
+    def submit(self, export_type: str, params: dict = None) -> dict:
+        """
+        创建并排队导出任务
+
+        Args:
+            export_type: 导出类型，见 EXPORT_FILE_NAMES
+            params: 导出参数（start_id、end_id，增量导出时为 since）
+
+        Returns:
+            任务记录
+        """
+        if export_type not in EXPORT_FILE_NAMES:
+            raise ValueError(f"Unsupported export type: {export_type}")
+
+        self.cleanup_expired()
+        job_id = self.db.create_export_job(export_type, params or {})
+        job = self.db.get_export_job(job_id)
+        self._executor.submit(self._run, job_id)
+        logger.info(f"Export job {job_id} queued: {export_type} {params}")
+        return job
+
+    def cancel(self, job_id: int) -> bool:
+        """取消排队中或执行中的任务"""
+        job = self.db.get_export_job(job_id)
+        if not job or job["status"] not in ("queued", "running"):
+            return False
+        with self._lock:
+            self._cancelled.add(job_id)
+        return True
+
+    def delete(self, job_id: int) -> bool:
+        """删除任务及其产物（执行中的任务先取消）"""
+        job = self.db.get_export_job(job_id)
+        if not job:
+            return False
+        self.cancel(job_id)
+        if job.get("file_path"):
+            self._remove_file(job["file_path"])
+        return self.db.delete_export_job(job_id)
+
+    def cleanup_expired(self) -> int:
+        """删除超过保留时间的已结束任务及其产物"""
+        expired = self.db.get_expired_export_jobs(self.retention_seconds)
+        for job in expired:
+            if job.get("file_path"):
+                self._remove_file(job["file_path"])
+            self.db.delete_export_job(job["id"])
+        return len(expired)
+
+    def shutdown(self):
+        """停止接收新任务并取消执行中的任务"""
+        with self._lock:
+            self._cancelled.update(
+                job["id"] for job in self.db.get_export_jobs()
+                if job["status"] in ("queued", "running")
+            )
+        self._executor.shutdown(wait=False)
+
+    @staticmethod
+    def download_name(job: dict) -> str:
+        """下载文件名"""
+        name, ext = os.path.splitext(EXPORT_FILE_NAMES[job["export_type"]])
+        return f"{name}-{job['id']}{ext}"
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _is_cancelled(self, job_id: int) -> bool:
+        with self._lock:
+            return job_id in self._cancelled
+
+    def _run(self, job_id: int):
+        """执行导出任务（在线程池中运行）"""
+        job = self.db.get_export_job(job_id)
+        if job is None:
+            return
+        if self._is_cancelled(job_id):
+            self.db.update_export_job(job_id, "cancelled")
+            return
+
+        export_type = job["export_type"]
+        params = job["params"]
+        start_id = params.get("start_id")
+        end_id = params.get("end_id")
+        since = params.get("since")
+
+        # 导出开始时的变更水位：增量导出只包含该水位之前的变更，
+        # 之后的变更留给下一次以该水位为 since 的导出
+        watermark = self.db.get_label_change_watermark()
+        until = watermark if since is not None else None
+
+        total = self.db.count_labels_for_export(
+            start_id, end_id, since, until
+        ) * EXPORT_PASSES[export_type]
+        self.db.update_export_job(
+            job_id, "running", progress=0, total=total, watermark=watermark
+        )
+
+        final_path = os.path.join(
+            self.spool_dir, f"{job_id}{os.path.splitext(EXPORT_FILE_NAMES[export_type])[1]}"
+        )
+        part_path = final_path + ".part"
+        progress = 0
+        last_update = time.monotonic()
+        missing = []
+
+        def on_row():
+            nonlocal progress, last_update
+            progress += 1
+            now = time.monotonic()
+            if now - last_update >= PROGRESS_UPDATE_INTERVAL:
+                last_update = now
+                if self._is_cancelled(job_id):
+                    raise ExportCancelled()
+                self.db.update_export_job(job_id, progress=progress)
+
+        try:
+            with open(part_path, "wb") as f:
+                for chunk in iter_export(
+                    self.db, export_type, self.labeled_dir,
+                    start_id, end_id, on_row=on_row, missing=missing,
+                    since=since, until=until
+                ):
+                    f.write(chunk)
+            if self._is_cancelled(job_id):
+                raise ExportCancelled()
+            # 完整写入后才出现在最终路径，下载不会读到半成品
+            os.replace(part_path, final_path)
+        except ExportCancelled:
+            self._remove_file(part_path)
+            self.db.update_export_job(job_id, "cancelled", progress=progress)
+            logger.info(f"Export job {job_id} cancelled")
+            return
+        except Exception as e:
+            self._remove_file(part_path)
+            self.db.update_export_job(job_id, "failed", progress=progress, error_message=str(e))
+            logger.error(f"Export job {job_id} failed: {e}")
+            return
+        finally:
+            with self._lock:
+                self._cancelled.discard(job_id)
+
+        if missing:
+            logger.warning(f"Export job {job_id}: 以下文件未找到: {', '.join(missing)}")
+
+        self.db.update_export_job(
+            job_id, "completed",
+            progress=progress,
+            file_path=final_path,
+            file_size=os.path.getsize(final_path),
+        )
+        logger.info(f"Export job {job_id} completed: {final_path}")
@@ -18,7 +18,8 @@ const getUserId = () => {
 export const userId = getUserId()
 
 // 图片相关
-export const getImages = () => api.get('/images', { params: { user_id: userId } })
+// params: { limit, after, sort, is_new_class, quality_pass, min_confidence, max_confidence }
+export const getImages = (params = {}) => api.get('/images', { params: { user_id: userId, ...params } })
 export const getImageUrl = (filename) => `/api/images/${encodeURIComponent(filename)}`
 export const getLabeledImageUrl = (filename) => `/api/labeled-images/${encodeURIComponent(filename)}`
 
@@ -0,0 +1,114 @@
+"""
+待标注图片清单
+以 image_inventory 表为持久化索引，通过目录 mtime 判断是否需要重新扫描，
+避免每次请求都 os.listdir 整个待标注目录
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Optional
+
+from database import Database, INBOX_STATUSES
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageInventory:
+    """待标注目录的图片清单"""
+
+    def __init__(
+        self,
+        db: Database,
+        images_dir: str,
+        extensions: set,
+        rescan_interval: float = 300.0,
+    ):
+        """
+        初始化图片清单
+
+        Args:
+            db: 数据库实例
+            images_dir: 待标注图片目录
+            extensions: 支持的图片扩展名集合（小写，包含点号）
+            rescan_interval: 即使目录 mtime 未变化，超过该秒数也强制重新扫描
+                             （兜底网络文件系统等 mtime 不可靠的场景），<=0 表示不强制
+        """
+        self.db = db
+        self.images_dir = images_dir
+        self.extensions = extensions
+        self.rescan_interval = rescan_interval
+
+        self._lock = threading.Lock()
+        self._dir_mtime_ns: Optional[int] = None
+        self._last_scan = 0.0
+
+    def _is_image_file(self, filename: str) -> bool:
+        """检查是否是图片文件"""
+        return os.path.splitext(filename)[1].lower() in self.extensions
+
+    def _get_dir_mtime(self) -> Optional[int]:
+        """获取目录的 mtime（纳秒），目录不存在时返回 None"""
+        try:
+            return os.stat(self.images_dir).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def refresh(self, force: bool = False) -> bool:
+        """
+        如果目录发生变化则重新扫描并同步到数据库
+
+        Args:
+            force: 是否忽略 mtime 强制扫描
+
+        Returns:
+            是否执行了扫描
+        """
+        with self._lock:
+            # 先读取 mtime 再扫描：扫描期间新增的文件会使下次检查时 mtime 不一致
+            mtime = self._get_dir_mtime()
+            expired = (
+                self.rescan_interval > 0
+                and time.time() - self._last_scan >= self.rescan_interval
+            )
+            if not force and not expired and mtime == self._dir_mtime_ns:
+                return False
+
+            filenames = []
+            if mtime is not None:
+                with os.scandir(self.images_dir) as entries:
+                    for entry in entries:
+                        if self._is_image_file(entry.name) and entry.is_file():
+                            filenames.append(entry.name)
+
+            result = self.db.sync_image_inventory(filenames)
+            self._dir_mtime_ns = mtime
+            self._last_scan = time.time()
+
+        logger.debug(
+            f"Image inventory synced: {len(filenames)} files, "
+            f"{result['added']} added, {result['removed']} removed"
+        )
+        return True
+
+    def invalidate(self):
+        """标记清单失效，下次访问时重新扫描目录"""
+        with self._lock:
+            self._dir_mtime_ns = None
+
+    def list_pending(self) -> list:
+        """获取待标注（未标注、未跳过）的文件名列表，按文件名排序"""
+        self.refresh()
+        return self.db.get_inventory_filenames(INBOX_STATUSES)
+
+    def count_pending(self) -> int:
+        """获取待标注图片数量"""
+        counts = self.get_counts()
+        return sum(counts.get(status, 0) for status in INBOX_STATUSES)
+
+    def get_counts(self) -> dict:
+        """按状态统计图片数量"""
+        self.refresh()
+        return self.db.get_inventory_counts()
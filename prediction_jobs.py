@@ -0,0 +1,238 @@
+"""
+后台 AI 预测任务
+启动时对待标注图片的预测在后台线程中分轮执行，Web 服务导入后即可响应请求：
+- 每轮预测 chunk_size 张图片，完成后把进度和断点（本轮最后一个文件名）写入数据库
+- 可暂停和继续，暂停在当前一轮完成后生效
+- 进程重启后继续上次未完成或已暂停的任务，断点之前的图片不再预测
+"""
+
+import os
+import time
+import logging
+import threading
+from typing import Callable, List, Optional
+
+from database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+# 任务状态
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_PAUSED = "paused"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+# 可以继续的任务状态（上次进程退出时未结束）
+RESUMABLE_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_PAUSED)
+
+# 每轮预测的图片数
+DEFAULT_CHUNK_SIZE = 256
+# 等待继续时检查停止标志的间隔（秒）
+WAIT_INTERVAL = 0.5
+
+
+class PredictionJobManager:
+    """后台预测任务管理（同一时间只执行一个任务）"""
+
+    def __init__(
+        self,
+        db: Database,
+        collect_images: Callable[[], List[str]],
+        predict_chunk: Callable[[List[str]], dict],
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+    ):
+        """
+        初始化预测任务管理
+
+        Args:
+            db: 数据库实例
+            collect_images: 返回待预测图片路径列表（按文件名排序）
+            predict_chunk: 预测并保存一轮图片，返回
+                           {'saved', 'duplicates', 'errors', 'new_class_count'}
+            chunk_size: 每轮预测的图片数（进度和断点的粒度）
+        """
+        self.db = db
+        self.collect_images = collect_images
+        self.predict_chunk = predict_chunk
+        self.chunk_size = max(1, int(chunk_size))
+
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._job_id: Optional[int] = None
+        # 置位表示未暂停
+        self._resume_event = threading.Event()
+        self._stop_event = threading.Event()
+        # 本次进程内的处理速度
+        self._session_started: Optional[float] = None
+        self._session_processed = 0
+
+    def start(self, trigger: str = "startup") -> dict:
+        """
+        在后台启动预测（立即返回）
+
+        上次未结束的任务从断点继续（已暂停的任务保持暂停，等待 resume），否则创建新任务；
+        已有任务在执行时直接返回其状态
+
+        Args:
+            trigger: 触发方式（startup / manual）
+
+        Returns:
+            任务状态，见 get_status()
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self._status_unlocked()
+
+            latest = self.db.get_latest_prediction_job()
+            if latest and latest["status"] in RESUMABLE_STATUSES:
+                job_id = latest["id"]
+                paused = latest["status"] == JOB_PAUSED
+                logger.info(
+                    f"Resuming prediction job {job_id} from checkpoint "
+                    f"({latest['processed']}/{latest['total']}, last={latest['last_filename']}, "
+                    f"paused={paused})"
+                )
+            else:
+                job_id = self.db.create_prediction_job(trigger)
+                paused = False
+                logger.info(f"Prediction job {job_id} created ({trigger})")
+
+            self._job_id = job_id
+            if paused:
+                self._resume_event.clear()
+            else:
+                self._resume_event.set()
+            self._stop_event.clear()
+            self._thread = threading.Thread(
+                target=self._run, args=(job_id,), name="prediction-job", daemon=True
+            )
+            self._thread.start()
+            return self._status_unlocked()
+
+    def pause(self) -> bool:
+        """暂停执行中的任务（当前一轮完成后生效），没有执行中的任务时返回 False"""
+        with self._lock:
+            job = self._current_job()
+            if not job or job["status"] != JOB_RUNNING:
+                return False
+            self._resume_event.clear()
+            self.db.update_prediction_job(job["id"], status=JOB_PAUSED)
+        logger.info(f"Prediction job {job['id']} paused")
+        return True
+
+    def resume(self) -> bool:
+        """继续已暂停的任务，没有已暂停的任务时返回 False"""
+        with self._lock:
+            job = self._current_job()
+            if not job or job["status"] != JOB_PAUSED:
+                return False
+            self.db.update_prediction_job(job["id"], status=JOB_RUNNING)
+            self._resume_event.set()
+            alive = self._thread is not None and self._thread.is_alive()
+        logger.info(f"Prediction job {job['id']} resumed")
+        if not alive:
+            # 任务线程已退出（如重启后未启动），从断点重新开始
+            self.start()
+        return True
+
+    def shutdown(self):
+        """停止后台任务（当前一轮完成后退出，任务保持未结束状态，下次启动时继续）"""
+        self._stop_event.set()
+        self._resume_event.set()
+
+    def get_status(self) -> dict:
+        """
+        任务状态：数据库中的进度和断点，加上 active（线程是否在执行）、
+        rate（本次进程内每秒处理图片数）和 eta_seconds（预计剩余时间）
+        """
+        with self._lock:
+            return self._status_unlocked()
+
+    def _current_job(self) -> Optional[dict]:
+        if self._job_id is not None:
+            return self.db.get_prediction_job(self._job_id)
+        return self.db.get_latest_prediction_job()
+
+    def _status_unlocked(self) -> dict:
+        job = self._current_job()
+        if not job:
+            return {"job": None, "active": False}
+
+        active = self._thread is not None and self._thread.is_alive()
+        rate = None
+        eta_seconds = None
+        if active and self._session_started and self._session_processed:
+            rate = self._session_processed / max(time.time() - self._session_started, 1e-6)
+            eta_seconds = max(job["total"] - job["processed"], 0) / rate
+        return {
+            "job": job,
+            "active": active,
+            "rate": round(rate, 2) if rate is not None else None,
+            "eta_seconds": round(eta_seconds) if eta_seconds is not None else None,
+        }
+
+    def _wait_resumed(self) -> bool:
+        """暂停时等待继续，收到停止请求时返回 False"""
+        while not self._resume_event.wait(WAIT_INTERVAL):
+            if self._stop_event.is_set():
+                return False
+        return not self._stop_event.is_set()
+
+    def _run(self, job_id: int):
+        job = self.db.get_prediction_job(job_id)
+        processed = job["processed"]
+        counters = {key: job[key] for key in ("saved", "duplicates", "errors", "new_class_count")}
+
+        if self._resume_event.is_set():
+            self.db.update_prediction_job(job_id, status=JOB_RUNNING)
+        if not self._wait_resumed():
+            return
+
+        try:
+            image_paths = self.collect_images()
+            # 断点之前的图片已在本任务中处理过（包括预测失败的图片）
+            if job["last_filename"]:
+                image_paths = [
+                    path for path in image_paths
+                    if os.path.basename(path) > job["last_filename"]
+                ]
+            total = processed + len(image_paths)
+            self.db.update_prediction_job(job_id, total=total)
+            logger.info(f"Prediction job {job_id}: {len(image_paths)} images to predict ({processed} done)")
+
+            self._session_started = time.time()
+            self._session_processed = 0
+            for start in range(0, len(image_paths), self.chunk_size):
+                if not self._wait_resumed():
+                    logger.info(f"Prediction job {job_id} stopped at {processed}/{total}")
+                    return
+
+                chunk = image_paths[start:start + self.chunk_size]
+                try:
+                    stats = self.predict_chunk(chunk) or {}
+                except Exception as e:
+                    # 单轮失败不中止整个任务，这些图片在下次任务中重新预测
+                    logger.error(f"Prediction job {job_id} failed on {len(chunk)} images: {e}")
+                    stats = {"errors": len(chunk)}
+                for key in counters:
+                    counters[key] += stats.get(key, 0)
+                processed += len(chunk)
+                self._session_processed += len(chunk)
+
+                self.db.update_prediction_job(
+                    job_id,
+                    processed=processed,
+                    last_filename=os.path.basename(chunk[-1]),
+                    **counters,
+                )
+                logger.info(f"Prediction job {job_id}: {processed}/{total} images processed")
+
+            self.db.update_prediction_job(job_id, status=JOB_COMPLETED)
+            logger.info(f"Prediction job {job_id} completed: {counters}")
+        except Exception as e:
+            logger.error(f"Prediction job {job_id} failed: {e}", exc_info=True)
+            self.db.update_prediction_job(job_id, status=JOB_FAILED, error_message=str(e))
+        finally:
+            self._resume_event.set()
@@ -0,0 +1,135 @@
+"""
+AI 预测结果批量写入
+缓冲 predict_batch 回调产生的结果，每 N 条或每 T 毫秒在一个事务中批量写入数据库，
+避免每张图片单独提交一次事务
+"""
+
+import time
+import logging
+import threading
+from typing import Optional
+
+from database import Database
+
+
+logger = logging.getLogger(__name__)
+
+
+class PredictionWriter:
+    """AI 预测结果的批量写入缓冲"""
+
+    def __init__(
+        self,
+        db: Database,
+        batch_size: int = 64,
+        flush_interval_ms: int = 500,
+    ):
+        """
+        初始化写入缓冲
+
+        Args:
+            db: 数据库实例
+            batch_size: 缓冲达到该条数时立即写入
+            flush_interval_ms: 缓冲中最早的结果等待超过该毫秒数时写入
+        """
+        self.db = db
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(0, flush_interval_ms) / 1000.0
+
+        self._buffer = []
+        self._first_buffered_at: Optional[float] = None
+        # 缓冲锁：保护 _buffer；写入锁：保证批次按顺序写入
+        self._cond = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._should_stop = False
+
+        self.saved = 0
+        self.duplicates = 0
+        self.errors = 0
+
+    def start(self):
+        """启动定时写入线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._should_stop = False
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止定时写入线程并写入剩余结果"""
+        with self._cond:
+            self._should_stop = True
+            self._cond.notify()
+        if self._thread:
+            self._thread.join(timeout=5.0)
+            self._thread = None
+        self.flush()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add(self, result: dict):
+        """添加一条预测结果，达到批量大小时立即写入"""
+        with self._cond:
+            if not self._buffer:
+                self._first_buffered_at = time.monotonic()
+                # 唤醒定时线程开始计时
+                self._cond.notify()
+            self._buffer.append(result)
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self.flush()
+
+    def on_prediction(self, index: int, result: dict):
+        """predict_batch 的 on_prediction_callback"""
+        self.add(result)
+
+    def flush(self) -> int:
+        """立即写入缓冲中的结果，返回新写入的条数"""
+        with self._write_lock:
+            with self._cond:
+                batch = self._buffer
+                self._buffer = []
+                self._first_buffered_at = None
+            if not batch:
+                return 0
+
+            try:
+                result = self.db.add_ai_predictions(batch)
+            except Exception as e:
+                self.errors += len(batch)
+                logger.error(f"Failed to save {len(batch)} predictions to DB: {e}")
+                return 0
+
+            self.saved += result["inserted"]
+            self.duplicates += result["duplicates"]
+            if result["duplicates"]:
+                logger.warning(
+                    f"{result['duplicates']} predictions already exist, skipped"
+                )
+            logger.info(
+                f"Saved {result['inserted']} predictions to DB (total: {self.saved})"
+            )
+            return result["inserted"]
+
+    def _run_loop(self):
+        """定时写入主循环"""
+        while True:
+            with self._cond:
+                if self._should_stop:
+                    return
+                if self._first_buffered_at is None:
+                    self._cond.wait()
+                    continue
+                remaining = (
+                    self._first_buffered_at + self.flush_interval - time.monotonic()
+                )
+                if remaining > 0:
+                    self._cond.wait(remaining)
+                    continue
+            self.flush()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HDBSCAN 降维基准测试
+
+比较原始特征与降维（PCA / 随机投影 + L2 归一化）后的聚类耗时和离群点稳定性：
+- 耗时：降维（拟合 + 变换）和 HDBSCAN 拟合分别计时
+- 稳定性：多次随机抽取 80% 样本聚类，两两比较共同样本上离群点集合的 Jaccard 相似度
+- 与原始特征的一致性：全量数据上离群点集合与原始特征结果的 Jaccard 相似度
+
+默认使用合成数据；指定 --db 和 --model-version 时从特征向量存储读取真实特征
+
+用法:
+    python scripts/benchmark_hdbscan.py --samples 2000 --dim 1280
+    python scripts/benchmark_hdbscan.py --db data/labels.db --model-version yolo-cls-aircraft-0123456789ab
+"""
+
+import sys
+import os
+import time
+import argparse
+from itertools import combinations
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hdbscan
+
+from ai_service.hdbscan_service import EmbeddingReducer
+
+
+def make_synthetic(n_samples: int, dim: int, n_clusters: int, outlier_ratio: float, seed: int) -> np.ndarray:
+    """生成高维高斯簇 + 均匀分布离群点"""
+    rng = np.random.default_rng(seed)
+    n_outliers = int(n_samples * outlier_ratio)
+    n_clustered = n_samples - n_outliers
+
+    centers = rng.normal(0.0, 1.0, size=(n_clusters, dim))
+    assignments = rng.integers(0, n_clusters, size=n_clustered)
+    clustered = centers[assignments] + rng.normal(0.0, 0.15, size=(n_clustered, dim))
+    outliers = rng.uniform(-2.0, 2.0, size=(n_outliers, dim))
+
+    data = np.vstack([clustered, outliers])
+    return data[rng.permutation(len(data))]
+
+
+def load_from_store(db_path: str, store_dir: str, model_version: str, limit: int) -> np.ndarray:
+    """从特征向量存储读取真实特征"""
+    from database import Database
+    from embedding_store import EmbeddingStore
+
+    db = Database(db_path)
+    try:
+        store_dir = store_dir or os.path.join(os.path.dirname(os.path.abspath(db_path)), "embeddings")
+        _, embeddings = EmbeddingStore(db, store_dir).get(model_version, limit=limit)
+    finally:
+        db.close()
+    if len(embeddings) == 0:
+        raise SystemExit(f"没有找到模型版本 {model_version} 的特征向量")
+    return np.asarray(embeddings, dtype=np.float64)
+
+
+def cluster(data: np.ndarray, reduction: dict, args) -> tuple:
+    """
+    降维并聚类
+
+    Returns:
+        (离群点下标集合, 降维耗时, 聚类耗时, 降维后维度)
+    """
+    start = time.perf_counter()
+    reduced = EmbeddingReducer(reduction).fit_transform(data)
+    reduce_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    clusterer = hdbscan.HDBSCAN(
+        min_cluster_size=args.min_cluster_size,
+        min_samples=args.min_samples,
+        metric="euclidean",
+        cluster_selection_method="eom",
+    )
+    clusterer.fit(reduced)
+    cluster_time = time.perf_counter() - start
+
+    outliers = set(np.where(clusterer.labels_ == -1)[0].tolist())
+    return outliers, reduce_time, cluster_time, reduced.shape[1]
+
+
+def jaccard(a: set, b: set) -> float:
+    """Jaccard 相似度（两个集合都为空时为 1）"""
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def stability(data: np.ndarray, reduction: dict, args) -> float:
+    """多次 80% 子采样聚类，两两比较共同样本上的离群点集合"""
+    rng = np.random.default_rng(args.seed)
+    runs = []
+    for _ in range(args.runs):
+        subset = np.sort(rng.choice(len(data), int(len(data) * 0.8), replace=False))
+        outliers, _, _, _ = cluster(data[subset], reduction, args)
+        runs.append((set(subset.tolist()), {int(subset[i]) for i in outliers}))
+
+    scores = []
+    for (members_a, outliers_a), (members_b, outliers_b) in combinations(runs, 2):
+        common = members_a & members_b
+        scores.append(jaccard(outliers_a & common, outliers_b & common))
+    return float(np.mean(scores)) if scores else 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HDBSCAN 降维基准测试")
+    parser.add_argument("--samples", type=int, default=2000, help="合成数据样本数")
+    parser.add_argument("--dim", type=int, default=1280, help="合成数据维度")
+    parser.add_argument("--clusters", type=int, default=20, help="合成数据簇数")
+    parser.add_argument("--outlier-ratio", type=float, default=0.05, help="合成数据离群点比例")
+    parser.add_argument("--db", help="数据库路径（从特征向量存储读取真实特征）")
+    parser.add_argument("--store-dir", help="特征向量存储目录（默认数据库同目录下的 embeddings）")
+    parser.add_argument("--model-version", help="特征向量的模型版本")
+    parser.add_argument("--n-components", type=int, default=64, help="降维后的维度")
+    parser.add_argument("--min-cluster-size", type=int, default=5)
+    parser.add_argument("--min-samples", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=5, help="稳定性测试的子采样次数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.db:
+        if not args.model_version:
+            parser.error("--db 需要同时指定 --model-version")
+        data = load_from_store(args.db, args.store_dir, args.model_version, args.samples)
+        print(f"真实特征: {data.shape[0]} 个样本, {data.shape[1]} 维 ({args.model_version})")
+    else:
+        data = make_synthetic(args.samples, args.dim, args.clusters, args.outlier_ratio, args.seed)
+        print(f"合成特征: {data.shape[0]} 个样本, {data.shape[1]} 维, {args.clusters} 个簇")
+
+    variants = [
+        ("raw", {"method": "none", "normalize": False}),
+        ("pca", {"method": "pca", "n_components": args.n_components, "normalize": True}),
+        ("random_projection", {
+            "method": "random_projection",
+            "n_components": args.n_components,
+            "normalize": True,
+            "random_state": args.seed,
+        }),
+    ]
+
+    print(f"\n{'方法':<20}{'维度':>6}{'降维(s)':>10}{'聚类(s)':>10}{'离群点':>8}{'稳定性':>8}{'与raw一致':>10}")
+    baseline = None
+    for name, reduction in variants:
+        outliers, reduce_time, cluster_time, reduced_dim = cluster(data, reduction, args)
+        if baseline is None:
+            baseline = outliers
+        score = stability(data, reduction, args)
+        print(
+            f"{name:<20}{reduced_dim:>6}{reduce_time:>10.3f}{cluster_time:>10.3f}"
+            f"{len(outliers):>8}{score:>8.3f}{jaccard(outliers, baseline):>10.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
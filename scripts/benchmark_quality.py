@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+图片质量评估基准测试
+
+比较原图分辨率评估（analysis_max_side=0，与历史评分一致）和降采样评估的耗时与评分差异：
+- 耗时：每张图片的平均评估耗时
+- 评分差异：各指标和总分的平均/最大绝对误差
+- 通过一致率：pass 判定与原图分辨率评估一致的比例
+
+用法:
+    python scripts/benchmark_quality.py data/images --max-side 1024 2048
+    python scripts/benchmark_quality.py a.jpg b.jpg --limit 50
+"""
+
+import sys
+import os
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai_service.quality import ImageQualityAssessor
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+METRICS = ["sharpness", "exposure", "composition", "noise", "color"]
+
+
+def collect_images(inputs, limit):
+    """展开目录并按文件名排序"""
+    paths = []
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            paths.extend(sorted(p for p in path.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS))
+        elif path.is_file():
+            paths.append(path)
+    return [str(p) for p in paths[:limit]] if limit else [str(p) for p in paths]
+
+
+def run(assessor, paths):
+    """评估全部图片，返回 (结果列表, 平均耗时)"""
+    results = []
+    start = time.perf_counter()
+    for path in paths:
+        results.append(assessor.assess(path))
+    return results, (time.perf_counter() - start) / len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图片质量评估基准测试")
+    parser.add_argument("inputs", nargs="+", help="图片文件或目录")
+    parser.add_argument("--max-side", type=int, nargs="+", default=[1024, 2048],
+                        help="对比的评估分辨率（最长边）")
+    parser.add_argument("--limit", type=int, default=200, help="最多评估的图片数（0 表示不限制）")
+    args = parser.parse_args()
+
+    paths = collect_images(args.inputs, args.limit)
+    if not paths:
+        raise SystemExit("没有找到图片")
+    print(f"图片: {len(paths)} 张")
+
+    baseline, baseline_time = run(ImageQualityAssessor(), paths)
+    valid = [i for i, result in enumerate(baseline) if result["success"]]
+    print(f"原图分辨率: {baseline_time * 1000:.1f} ms/张, {len(valid)} 张评估成功")
+
+    print(f"\n{'最长边':>8}{'ms/张':>10}{'加速':>8}{'通过一致':>10}  " + "".join(f"{m:>14}" for m in METRICS + ["score"]))
+    for max_side in args.max_side:
+        results, elapsed = run(ImageQualityAssessor({"analysis_max_side": max_side}), paths)
+        both = [i for i in valid if results[i]["success"]]
+        agreement = np.mean([results[i]["pass"] == baseline[i]["pass"] for i in both]) if both else 0.0
+
+        errors = []
+        for metric in METRICS + ["score"]:
+            diff = np.array([
+                abs((results[i]["details"][metric] if metric != "score" else results[i]["score"])
+                    - (baseline[i]["details"][metric] if metric != "score" else baseline[i]["score"]))
+                for i in both
+            ]) if both else np.zeros(1)
+            errors.append(f"{diff.mean():>7.3f}/{diff.max():<6.3f}")
+
+        print(f"{max_side:>8}{elapsed * 1000:>10.1f}{baseline_time / elapsed:>7.1f}x{agreement:>10.1%}  "
+              + "".join(f"{e:>14}" for e in errors))
+    print("\n误差列为 平均/最大 绝对误差")
+
+
+if __name__ == "__main__":
+    main()
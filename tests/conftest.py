@@ -33,6 +33,7 @@ def temp_db():
     yield db, db_path
 
     # 清理
+    db.close()
     os.unlink(db_path)
 
 
@@ -17,7 +17,9 @@ from ai_service.ai_predictor import AIPredictor
 from ai_service.predictor import ModelPredictor
 from ai_service.ocr_service import RegistrationOCR
 from ai_service.quality import ImageQualityAssessor
-from ai_service.hdbscan_service import HDBSCANNewClassDetector
+from ai_service.hdbscan_service import HDBSCANNewClassDetector, EmbeddingReducer
+from ai_service.result_cache import ResultCache
+from ai_service.decoded_image import DecodedImage
 
 
 @pytest.fixture
@@ -118,6 +120,151 @@ class TestModelPredictor:
         finally:
             os.unlink(test_image)
 
+    def test_predict_many_batches(self, sample_config):
+        """测试批量预测：每张图片解码一次，按批大小送入模型"""
+
+        def make_model(names):
+            model = MagicMock()
+            model.model.names = names
+
+            def predict(images, **kwargs):
+                results = []
+                for _ in images:
+                    result = MagicMock()
+                    result.probs.top1 = 1
+                    result.probs.top5 = [1, 0]
+                    result.probs.data = np.array([0.1, 0.9])
+                    results.append(result)
+                return results
+
+            model.predict.side_effect = predict
+            return model
+
+        class FakeTensor:
+            """模拟倒数第二层输出的 tensor"""
+
+            def __init__(self, array):
+                self.array = array
+                self.ndim = array.ndim
+
+            def detach(self):
+                return self
+
+            def mean(self, dim):
+                return FakeTensor(self.array.mean(axis=dim))
+
+            def float(self):
+                return self
+
+            def cpu(self):
+                return self
+
+            def numpy(self):
+                return self.array
+
+        predictor = ModelPredictor(sample_config["models"], batch_size=2)
+        predictor._aircraft_model = make_model({0: "A320", 1: "B738"})
+        predictor._airline_model = make_model({0: "CCA", 1: "CES"})
+
+        # 分类推理时 forward hook 捕获特征；第一次推理前有一次预热
+        hooks = []
+        layer = predictor._aircraft_model.model.model[-2]
+        layer.register_forward_hook.side_effect = lambda hook: hooks.append(hook) or MagicMock()
+        aircraft_predict = predictor._aircraft_model.predict.side_effect
+
+        def predict_with_hook(images, **kwargs):
+            if predictor._aircraft_model.predict.call_count == 1:
+                hooks[-1](layer, None, FakeTensor(np.zeros((1, 4, 2, 2))))
+            hooks[-1](layer, None, FakeTensor(np.ones((len(images), 4, 2, 2))))
+            return aircraft_predict(images, **kwargs)
+
+        predictor._aircraft_model.predict.side_effect = predict_with_hook
+
+        image = np.zeros((8, 8, 3), dtype=np.uint8)
+        paths = ["a.jpg", "bad.jpg", "c.jpg", "d.jpg", "e.jpg"]
+        with patch(
+            "ai_service.predictor.read_image",
+            side_effect=lambda path: None if path == "bad.jpg" else image,
+        ) as mock_read:
+            results = predictor.predict_many(paths)
+
+        assert mock_read.call_count == len(paths)
+        assert len(results) == len(paths)
+        assert "error" in results[1]
+        for i in (0, 2, 3, 4):
+            assert results[i]["aircraft"]["class_name"] == "B738"
+            assert results[i]["airline"]["class_name"] == "CES"
+            assert results[i]["aircraft"]["confidence"] == pytest.approx(0.9)
+            np.testing.assert_array_equal(results[i]["embedding"], np.ones(4))
+        assert "detection" not in results[0]
+
+        # 批次 [a, bad] [c, d] [e]，无法读取的图片不送入模型
+        batch_sizes = [len(call.args[0]) for call in predictor._aircraft_model.predict.call_args_list]
+        assert batch_sizes == [1, 2, 1]
+        assert predictor._airline_model.predict.call_count == 3
+
+    def test_predict_with_embeddings_concurrent(self, sample_config):
+        """测试并发分类推理时特征 hook 只捕获本次调用的输出"""
+        import threading
+        import time
+
+        class FakeTensor:
+            def __init__(self, array):
+                self.array = array
+                self.ndim = array.ndim
+
+            def detach(self):
+                return self
+
+            def float(self):
+                return self
+
+            def cpu(self):
+                return self
+
+            def numpy(self):
+                return self.array
+
+        predictor = ModelPredictor(sample_config["models"])
+        model = MagicMock()
+        layer = model.model.model[-2]
+        hooks = []
+
+        def register(hook):
+            hooks.append(hook)
+            handle = MagicMock()
+            handle.remove.side_effect = lambda: hooks.remove(hook)
+            return handle
+
+        def predict(images, **kwargs):
+            # 逐张前向，期间让出 CPU；所有已注册的 hook 都会收到输出
+            for image in images:
+                for hook in list(hooks):
+                    hook(layer, None, FakeTensor(np.full((1, 4), float(image[0, 0, 0]))))
+                time.sleep(0.01)
+            return [MagicMock() for _ in images]
+
+        layer.register_forward_hook.side_effect = register
+        model.predict.side_effect = predict
+
+        outputs = {}
+
+        def run(value):
+            images = [np.full((2, 2, 3), value, dtype=np.uint8) for _ in range(5)]
+            outputs[value] = predictor._predict_with_embeddings(model, images)[1]
+
+        threads = [threading.Thread(target=run, args=(value,)) for value in (1, 2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        for value in (1, 2):
+            assert len(outputs[value]) == 5
+            for embedding in outputs[value]:
+                np.testing.assert_array_equal(embedding, np.full(4, float(value)))
+        assert hooks == []
+
     def test_unload_models(self):
         """测试卸载模型"""
         # 使用正确的配置结构
@@ -152,7 +299,7 @@ class TestOCRService:
 
         assert ocr.enabled is False
 
-    @patch("ai_service.ocr_service.requests.post")
+    @patch("ai_service.ocr_service.requests.Session.post")
     def test_ocr_recognize_success(self, mock_post):
         """测试OCR识别成功"""
         # 模拟API响应
@@ -206,7 +353,7 @@ class TestOCRService:
         finally:
             os.unlink(test_image)
 
-    @patch("ai_service.ocr_service.requests.post")
+    @patch("ai_service.ocr_service.requests.Session.post")
     def test_ocr_recognize_api_error(self, mock_post):
         """测试OCR识别API错误"""
         # 模拟API错误
@@ -229,6 +376,185 @@ class TestOCRService:
             os.unlink(test_image)
 
 
+    @staticmethod
+    def _ocr_response(text="B-1234"):
+        """构造 OCR API 响应"""
+        import json
+
+        response = MagicMock()
+        response.status_code = 200
+        response.json.return_value = {
+            "outputs": [
+                {
+                    "name": "output",
+                    "data": [json.dumps({"result": {"ocrResults": [{"prunedResult": {
+                        "rec_texts": [text], "rec_scores": [0.95], "rec_boxes": [[10, 10, 20, 12]],
+                    }}]}})],
+                }
+            ]
+        }
+        return response
+
+    @staticmethod
+    def _write_image(path):
+        from PIL import Image
+
+        Image.new("RGB", (32, 32)).save(path)
+        return str(path)
+
+    @patch("ai_service.ocr_service.requests.Session.post")
+    def test_ocr_retry_then_success(self, mock_post, tmp_path):
+        """测试连接失败和5xx按退避重试后成功"""
+        import requests
+
+        server_error = MagicMock()
+        server_error.status_code = 503
+        mock_post.side_effect = [
+            requests.exceptions.ConnectionError("refused"),
+            server_error,
+            self._ocr_response(),
+        ]
+        ocr = RegistrationOCR({"enabled": True, "max_retries": 2, "retry_backoff": 0})
+
+        result = ocr.recognize(self._write_image(tmp_path / "a.jpg"))
+
+        assert result["registration"] == "B-1234"
+        assert mock_post.call_count == 3
+        assert mock_post.call_args.kwargs["timeout"] == (5, 30)
+        assert ocr.get_status()["circuit"]["state"] == "closed"
+
+    @patch("ai_service.ocr_service.requests.Session.post")
+    def test_ocr_circuit_breaker(self, mock_post, tmp_path):
+        """测试连续失败后熔断，冷却后放行试探请求并恢复"""
+        import requests
+
+        mock_post.side_effect = requests.exceptions.Timeout("timed out")
+        ocr = RegistrationOCR({
+            "enabled": True, "max_retries": 0, "breaker_threshold": 2, "breaker_reset_timeout": 60,
+        })
+        image = self._write_image(tmp_path / "a.jpg")
+
+        for _ in range(5):
+            assert ocr.recognize(image)["registration"] == ""
+        # 熔断后不再发送请求
+        assert mock_post.call_count == 2
+        assert ocr.get_status()["circuit"]["state"] == "open"
+
+        # 冷却结束后试探成功，恢复请求
+        ocr.breaker.reset_timeout = 0
+        mock_post.side_effect = None
+        mock_post.return_value = self._ocr_response()
+        assert ocr.recognize(image)["registration"] == "B-1234"
+        assert ocr.get_status()["circuit"]["state"] == "closed"
+
+    @patch("ai_service.ocr_service.requests.Session.post")
+    def test_ocr_recognize_many(self, mock_post, tmp_path):
+        """测试并发识别按输入顺序返回结果，复用同一个会话"""
+        def fake_post(url, json=None, **kwargs):
+            import base64
+            import io
+            import json as json_module
+            from PIL import Image
+
+            data = json_module.loads(json["inputs"][0]["data"][0])["file"]
+            # 按图片宽度区分返回的注册号
+            image = Image.open(io.BytesIO(base64.b64decode(data.split(",", 1)[1])))
+            return self._ocr_response(f"B-{image.width:04d}")
+
+        mock_post.side_effect = fake_post
+        ocr = RegistrationOCR({"enabled": True, "max_in_flight": 3})
+        paths = []
+        for i in range(6):
+            from PIL import Image
+
+            path = tmp_path / f"{i}.png"
+            Image.new("RGB", (8 + i * 8, 8)).save(path)
+            paths.append(str(path))
+
+        results = ocr.recognize_many(paths)
+        expected = [ocr.recognize(path)["registration"] for path in paths]
+
+        assert [r["registration"] for r in results] == [f"B-{8 + i * 8:04d}" for i in range(6)]
+        assert [r["registration"] for r in results] == expected
+        assert ocr._session is not None
+        ocr.cleanup()
+        assert ocr._session is None
+
+
+    @patch("ai_service.ocr_service.requests.Session.post")
+    def test_ocr_crop_to_detection(self, mock_post, tmp_path):
+        """测试按检测框裁剪后发送，识别框坐标映射回整张图片"""
+        import base64
+        import io
+        from PIL import Image
+
+        sent = []
+
+        def fake_post(url, json=None, **kwargs):
+            import json as json_module
+
+            data = json_module.loads(json["inputs"][0]["data"][0])["file"]
+            sent.append(data)
+            image = Image.open(io.BytesIO(base64.b64decode(data.split(",", 1)[1])))
+            response = self._ocr_response()
+            # 识别框覆盖整个发送的图片
+            payload = json_module.loads(response.json.return_value["outputs"][0]["data"][0])
+            payload["result"]["ocrResults"][0]["prunedResult"]["rec_boxes"] = [[0, 0, image.width, image.height]]
+            response.json.return_value["outputs"][0]["data"][0] = json_module.dumps(payload)
+            return response
+
+        mock_post.side_effect = fake_post
+        image_path = str(tmp_path / "big.png")
+        Image.new("RGB", (4000, 2000), (40, 80, 120)).save(image_path)
+
+        ocr = RegistrationOCR({"enabled": True, "crop_margin": 0.2, "crop_max_side": 200})
+        result = ocr.recognize(image_path, region=[0.5, 0.25, 0.1, 0.1])
+
+        # 检测框 400x200 加 20% 边距为 560x280，再缩放到最长边 200
+        sent_image = Image.open(io.BytesIO(base64.b64decode(sent[0].split(",", 1)[1])))
+        assert sent[0].startswith("data:image/jpeg;base64,")
+        assert sent_image.size == (200, 100)
+        box = result["yolo_boxes"][0]
+        assert box["x_center"] == pytest.approx(0.5, abs=1e-3)
+        assert box["y_center"] == pytest.approx(0.25, abs=1e-3)
+        assert box["width"] == pytest.approx(0.14, abs=1e-3)
+        assert box["height"] == pytest.approx(0.14, abs=1e-3)
+
+        # 没有检测框时发送原图
+        ocr.recognize(image_path)
+        assert sent[1].startswith("data:image/png;base64,")
+        full_image = Image.open(io.BytesIO(base64.b64decode(sent[1].split(",", 1)[1])))
+        assert full_image.size == (4000, 2000)
+
+    @patch("ai_service.ocr_service.requests.Session.post")
+    def test_ocr_result_cache(self, mock_post, tmp_path):
+        """测试内容相同的图片复用 OCR 结果，失败结果不缓存"""
+        import shutil
+        import requests
+
+        cache = ResultCache(str(tmp_path / "cache.db"))
+        ocr = RegistrationOCR({"enabled": True, "max_retries": 0}, result_cache=cache)
+        image_path = self._write_image(tmp_path / "a.jpg")
+
+        mock_post.side_effect = requests.exceptions.ConnectionError("refused")
+        assert not ocr.recognize(image_path)["registration"]
+        mock_post.side_effect = None
+        mock_post.return_value = self._ocr_response()
+        assert ocr.recognize(image_path)["registration"] == "B-1234"
+        assert mock_post.call_count == 2
+
+        # 改名后的同一张图片命中缓存，不再调用 OCR
+        renamed = str(tmp_path / "renamed.jpg")
+        shutil.copy(image_path, renamed)
+        assert ocr.recognize(renamed)["registration"] == "B-1234"
+        assert mock_post.call_count == 2
+
+        # 检测框不同则结果版本不同
+        ocr.recognize(renamed, region=[0.5, 0.5, 0.5, 0.5])
+        assert mock_post.call_count == 3
+        assert cache.get_stats()["kinds"]["ocr"]["hits"] == 1
+
+
 class TestImageQualityAssessor:
     """质量评估测试"""
 
@@ -263,6 +589,119 @@ class TestImageQualityAssessor:
         assert quality is not None
         assert hasattr(quality, "assess")
 
+    @staticmethod
+    def _reference_scores(image):
+        """原逐指标实现（各自转换灰度、float64 计算）的评分"""
+        import cv2
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        sharpness = min(cv2.Laplacian(gray, cv2.CV_64F).var() / 1000.0, 1.0)
+
+        l_channel = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)[:, :, 0]
+        brightness = max(0, 1.0 - abs(np.mean(l_channel) - 127) / 127.0)
+        penalty = np.sum(l_channel > 250) / l_channel.size * 0.5 + np.sum(l_channel < 5) / l_channel.size * 0.5
+        exposure = max(0, min(1, brightness * (1 - penalty)))
+
+        gray64 = gray.astype(np.float64)
+        noise = max(0, 1.0 - min(np.std(gray64 - cv2.GaussianBlur(gray64, (5, 5), 0)) / 20.0, 1.0))
+
+        saturation = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)[:, :, 1]
+        sat_score = max(0, 1.0 - abs(np.mean(saturation) - 100) / 100.0)
+        b, g, r = cv2.split(image)
+        wb_score = 1.0 - min((abs(np.mean(r) - np.mean(g)) + abs(np.mean(g) - np.mean(b))) / 50.0, 1.0)
+        color = max(0, min(1, (sat_score + wb_score) / 2))
+
+        return {"sharpness": sharpness, "exposure": exposure, "noise": noise, "color": color}
+
+    def test_assess_matches_reference(self, tmp_path):
+        """测试单次解码、共享灰度图的评估与原逐指标实现评分一致"""
+        import cv2
+
+        rng = np.random.default_rng(0)
+        image = np.zeros((300, 450, 3), dtype=np.uint8)
+        image[:] = np.linspace(0, 255, 450, dtype=np.uint8)[None, :, None]
+        cv2.rectangle(image, (100, 80), (250, 160), (200, 60, 90), -1)
+        image = np.clip(image + rng.normal(0, 6, image.shape), 0, 255).astype(np.uint8)
+        path = str(tmp_path / "a.png")
+        cv2.imwrite(path, image)
+
+        result = ImageQualityAssessor().assess(path)
+
+        assert result["success"]
+        for metric, expected in self._reference_scores(image).items():
+            assert result["details"][metric] == pytest.approx(expected, abs=1e-4), metric
+
+    def test_reduced_resolution(self, tmp_path):
+        """测试设置评估分辨率后降采样解码"""
+        import cv2
+
+        path = str(tmp_path / "big.jpg")
+        cv2.imwrite(path, np.full((1500, 3000, 3), 128, dtype=np.uint8))
+
+        assessor = ImageQualityAssessor({"analysis_max_side": 1000})
+        with patch("ai_service.quality.cv2.imdecode", wraps=cv2.imdecode) as mock_imdecode:
+            image = assessor._load_image(path)
+
+        assert mock_imdecode.call_args.args[1] == cv2.IMREAD_REDUCED_COLOR_2
+        assert image.shape == (500, 1000, 3)
+        assert assessor.assess(path)["success"]
+        assert ImageQualityAssessor()._load_image(path).shape == (1500, 3000, 3)
+
+    def test_assess_many_process_pool(self, tmp_path):
+        """测试进程池批量评估：结果按输入顺序返回，与逐张评估一致"""
+        import cv2
+
+        rng = np.random.default_rng(1)
+        paths = []
+        for i in range(4):
+            path = str(tmp_path / f"{i}.png")
+            cv2.imwrite(path, rng.integers(0, 255, (64 + i * 16, 96, 3), dtype=np.uint8))
+            paths.append(path)
+        paths.insert(2, str(tmp_path / "missing.png"))
+
+        assessor = ImageQualityAssessor({"workers": 2, "chunksize": 1})
+        try:
+            # 工作进程在构造时全部启动，之后不再 fork
+            assert len(assessor._pool._processes) == 2
+            results = assessor.assess_many(paths)
+            assert assessor._pool is not None
+        finally:
+            assessor.cleanup()
+
+        assert assessor._pool is None
+        assert len(results) == len(paths)
+        assert results[2]["success"] is False
+        for path, result in zip(paths, results):
+            assert result == assessor.assess(path)
+
+    def test_assess_many_broken_pool_falls_back(self, tmp_path):
+        """测试工作进程异常退出后改为在调用线程中评估，且不重新创建进程池"""
+        import cv2
+        import signal
+
+        rng = np.random.default_rng(2)
+        paths = []
+        for i in range(3):
+            path = str(tmp_path / f"{i}.png")
+            cv2.imwrite(path, rng.integers(0, 255, (48, 64, 3), dtype=np.uint8))
+            paths.append(path)
+
+        assessor = ImageQualityAssessor({"workers": 2, "chunksize": 1})
+        try:
+            for process in list(assessor._pool._processes.values()):
+                os.kill(process.pid, signal.SIGKILL)
+                process.join(timeout=5)
+
+            results = assessor.assess_many(paths)
+            assert assessor._pool is None
+            assert all(result["success"] for result in results)
+
+            with patch("ai_service.quality.ProcessPoolExecutor") as mock_pool:
+                assert assessor.assess_many(paths) == results
+            mock_pool.assert_not_called()
+        finally:
+            assessor.cleanup()
+
 
 class TestHDBSCANService:
     """HDBSCAN服务测试"""
@@ -296,9 +735,10 @@ class TestHDBSCANService:
         mock_embeddings = np.random.rand(6, 10)
 
         # 调用detect_new_classes并提供embeddings
-        new_class_indices = hdbscan.detect_new_classes(
+        labels, _ = hdbscan.detect_new_classes(
             mock_predictions, embeddings=mock_embeddings
         )
+        new_class_indices = hdbscan.new_class_indices(labels)
 
         # 验证：应该使用提供的embeddings
         # 检查HDBSCAN的fit方法被调用，并且使用的是embeddings
@@ -379,15 +819,280 @@ class TestHDBSCANService:
             },
         ]
 
-        new_class_indices = hdbscan.detect_new_classes(
+        labels, _ = hdbscan.detect_new_classes(
             mock_predictions, embeddings=features
         )
+        new_class_indices = hdbscan.new_class_indices(labels)
 
         assert isinstance(new_class_indices, list)
         # 噪声点（label=-1）应该被标记为新类别
         assert 4 in new_class_indices
         assert 5 in new_class_indices
 
+    @patch("ai_service.hdbscan_service.hdbscan.approximate_predict_scores")
+    @patch("ai_service.hdbscan_service.hdbscan.approximate_predict")
+    @patch("ai_service.hdbscan_service.hdbscan.HDBSCAN")
+    def test_persistent_clusterer(self, mock_hdbscan_class, mock_approximate, mock_scores, tmp_path):
+        """测试持久化聚类器：历史 + 本批拟合一次，之后增量打分，模型版本变化时重新拟合"""
+        mock_hdbscan_instance = MagicMock()
+        mock_hdbscan_instance.labels_ = np.array([0] * 9 + [-1])
+        mock_hdbscan_class.return_value = mock_hdbscan_instance
+        mock_approximate.return_value = (np.array([0, -1]), np.array([0.9, 0.0]))
+        mock_scores.return_value = np.array([0.1, 0.95])
+
+        config = {
+            "enabled": True,
+            "min_fit_samples": 5,
+            "model_path": str(tmp_path / "hdbscan_model.pkl"),
+        }
+        detector = HDBSCANNewClassDetector(config)
+
+        history_names = [f"old{i}.jpg" for i in range(8)] + ["new0.jpg"]
+        history = np.random.rand(9, 4)
+        history_provider = Mock(return_value=(history_names, history))
+        predictions = [{"filename": "new0.jpg"}, {"filename": "new1.jpg"}]
+        embeddings = np.random.rand(2, 4)
+
+        labels, outlier_scores = detector.detect_new_classes(
+            predictions, embeddings=embeddings,
+            model_version="cls-v1", history_provider=history_provider
+        )
+        assert detector.new_class_indices(labels) == [1]
+        np.testing.assert_allclose(outlier_scores, [0.1, 0.95])
+
+        # 历史中已有的 new0.jpg 不重复计入：8 条历史 + 2 条本批
+        fitted = mock_hdbscan_instance.fit.call_args[0][0]
+        assert fitted.shape == (10, 4)
+        info = detector.get_model_info()
+        assert info["embedding_model"] == "cls-v1"
+        assert info["n_samples"] == 10
+        assert info["noise_ratio"] == pytest.approx(0.1)
+
+        # 已有聚类器时只打分不重新拟合
+        detector.detect_new_classes(
+            predictions, embeddings=embeddings,
+            model_version="cls-v1", history_provider=history_provider
+        )
+        assert mock_hdbscan_instance.fit.call_count == 1
+        assert detector.get_model_info()["scored_since_fit"] == 4
+
+        # 模型版本变化后重新拟合
+        detector.detect_new_classes(
+            predictions, embeddings=embeddings,
+            model_version="cls-v2", history_provider=history_provider
+        )
+        assert mock_hdbscan_instance.fit.call_count == 2
+        assert detector.get_model_info()["embedding_model"] == "cls-v2"
+
+    @patch("ai_service.hdbscan_service.hdbscan.HDBSCAN")
+    def test_persistent_clusterer_fallback(self, mock_hdbscan_class):
+        """测试样本不足时退回到按批聚类"""
+        mock_hdbscan_instance = MagicMock()
+        mock_hdbscan_instance.labels_ = np.array([0, 0, -1])
+        mock_hdbscan_instance.outlier_scores_ = np.array([0.1, 0.2, 0.9])
+        mock_hdbscan_class.return_value = mock_hdbscan_instance
+
+        detector = HDBSCANNewClassDetector({"enabled": True, "min_fit_samples": 50})
+        predictions = [{"filename": f"test{i}.jpg"} for i in range(3)]
+
+        labels, outlier_scores = detector.detect_new_classes(
+            predictions, embeddings=np.random.rand(3, 4), model_version="cls-v1"
+        )
+
+        assert detector.new_class_indices(labels) == [2]
+        np.testing.assert_allclose(outlier_scores, [0.1, 0.2, 0.9])
+        assert detector.get_model_info() is None
+
+    @patch("ai_service.hdbscan_service.hdbscan.approximate_predict_scores")
+    @patch("ai_service.hdbscan_service.hdbscan.approximate_predict")
+    @patch("ai_service.hdbscan_service.hdbscan.HDBSCAN")
+    def test_persistent_clusterer_reload_and_drift(self, mock_hdbscan_class, mock_approximate, mock_scores, tmp_path):
+        """测试聚类器保存后重新加载，噪声比例漂移超过阈值时后台重新拟合"""
+        mock_hdbscan_class.return_value = PicklableClusterer(np.array([0] * 9 + [-1]))
+        config = {
+            "enabled": True,
+            "model_path": str(tmp_path / "hdbscan_model.pkl"),
+            "drift_window": 4,
+            "refit_drift_threshold": 0.3,
+        }
+        HDBSCANNewClassDetector(config).fit(np.random.rand(10, 4), "cls-v1")
+
+        detector = HDBSCANNewClassDetector(config)
+        assert detector.get_model_info()["embedding_model"] == "cls-v1"
+
+        history_provider = Mock(return_value=([], np.random.rand(60, 4)))
+        predictions = [{"filename": f"new{i}.jpg"} for i in range(4)]
+        mock_approximate.return_value = (np.array([-1, -1, -1, 0]), np.array([0.0, 0.0, 0.0, 0.8]))
+        mock_scores.return_value = np.array([0.9, 0.95, 0.99, 0.2])
+        with patch.object(detector, "refit_async") as mock_refit:
+            detector.detect_new_classes(
+                predictions, embeddings=np.random.rand(4, 4),
+                model_version="cls-v1", history_provider=history_provider
+            )
+
+        # 噪声比例 0.75，拟合时 0.1
+        assert detector.get_drift() == pytest.approx(0.65)
+        mock_refit.assert_called_once_with(history_provider)
+        assert detector.refit_async(history_provider) is True
+        detector._refit_thread.join(timeout=5)
+        assert detector.get_model_info()["n_samples"] == 60
+        assert detector.get_drift() is None
+
+    def test_persistent_clusterer_scores_noise_points(self, tmp_path):
+        """测试持久化聚类器（真实 hdbscan）为噪声点给出互不相同、随离群程度增大的分数"""
+        rng = np.random.default_rng(0)
+        history = np.vstack([rng.normal(0, 0.3, (60, 4)), rng.normal(5, 0.3, (60, 4))])
+        detector = HDBSCANNewClassDetector({
+            "enabled": True,
+            "min_fit_samples": 50,
+            "model_path": str(tmp_path / "hdbscan_model.pkl"),
+        })
+
+        # 两个簇内点 + 三个离簇越来越远的点
+        embeddings = np.array([
+            [0.0, 0.0, 0.0, 0.0],
+            [5.0, 5.0, 5.0, 5.0],
+            [-10.0, 0.0, 0.0, 0.0],
+            [0.0, -20.0, 0.0, 0.0],
+            [0.0, 0.0, -40.0, 0.0],
+        ])
+        predictions = [{"filename": f"new{i}.jpg"} for i in range(len(embeddings))]
+        labels, scores = detector.detect_new_classes(
+            predictions, embeddings=embeddings, model_version="cls-v1",
+            history_provider=lambda: ([f"old{i}.jpg" for i in range(len(history))], history)
+        )
+
+        new_class_indices = detector.new_class_indices(labels)
+        assert new_class_indices == [2, 3, 4]
+        noise_scores = scores[new_class_indices]
+        assert len(set(np.round(noise_scores, 6))) == 3
+        assert np.all(np.diff(noise_scores) > 0)
+        assert np.all(noise_scores < 1.0)
+        assert np.all(scores[:2] < noise_scores.min())
+        assert np.all((scores >= 0.0) & (scores <= 1.0))
+
+
+class PicklableClusterer:
+    """可序列化的聚类器替身（MagicMock 无法 pickle）"""
+
+    def __init__(self, labels):
+        self.labels_ = labels
+
+    def fit(self, embeddings):
+        return self
+
+
+class TestEmbeddingReducer:
+    """聚类前降维测试"""
+
+    def test_disabled_passthrough(self):
+        """测试未配置降维时特征原样传给聚类"""
+        reducer = EmbeddingReducer()
+        embeddings = np.random.rand(5, 8)
+
+        assert reducer.enabled is False
+        assert reducer.fit_transform(embeddings) is embeddings
+
+    def test_pca(self):
+        """测试PCA降维：拟合一次后复用，输出L2归一化"""
+        rng = np.random.default_rng(0)
+        embeddings = rng.normal(size=(40, 32))
+        reducer = EmbeddingReducer({"method": "pca", "n_components": 8, "normalize": True})
+
+        reduced = reducer.fit_transform(embeddings)
+        assert reduced.shape == (40, 8)
+        np.testing.assert_allclose(np.linalg.norm(reduced, axis=1), 1.0)
+        assert reducer.is_fitted_for(32)
+
+        # 新样本使用已拟合的投影
+        components = reducer._components.copy()
+        assert reducer.transform(rng.normal(size=(3, 32))).shape == (3, 8)
+        np.testing.assert_array_equal(reducer._components, components)
+
+        with pytest.raises(ValueError):
+            reducer.transform(rng.normal(size=(3, 16)))
+
+    def test_random_projection(self):
+        """测试随机投影降维：相同随机种子得到相同投影"""
+        embeddings = np.random.rand(10, 32)
+        config = {"method": "random_projection", "n_components": 8, "random_state": 7}
+
+        first = EmbeddingReducer(config).fit_transform(embeddings)
+        second = EmbeddingReducer(config).fit_transform(embeddings)
+        assert first.shape == (10, 8)
+        np.testing.assert_array_equal(first, second)
+
+        with pytest.raises(ValueError):
+            EmbeddingReducer({"method": "umap"})
+
+    @patch("ai_service.hdbscan_service.hdbscan.HDBSCAN")
+    def test_batch_clustering_reduced(self, mock_hdbscan_class):
+        """测试按批聚类使用降维后的特征"""
+        mock_hdbscan_instance = MagicMock()
+        mock_hdbscan_instance.labels_ = np.array([0] * 5 + [-1])
+        mock_hdbscan_instance.outlier_scores_ = np.zeros(6)
+        mock_hdbscan_class.return_value = mock_hdbscan_instance
+
+        detector = HDBSCANNewClassDetector({
+            "enabled": True,
+            "reduction": {"method": "pca", "n_components": 4, "normalize": True},
+        })
+        predictions = [{"filename": f"test{i}.jpg"} for i in range(6)]
+
+        labels, _ = detector.detect_new_classes(
+            predictions, embeddings=np.random.rand(6, 32), model_version="cls-v1"
+        )
+        assert detector.new_class_indices(labels) == [5]
+        assert mock_hdbscan_instance.fit.call_args[0][0].shape == (6, 4)
+
+        # 降维器每批重新拟合：小批次限制的成分数不影响之后的批次
+        mock_hdbscan_instance.labels_ = np.array([0, 0, -1])
+        detector.detect_new_classes(
+            predictions[:3], embeddings=np.random.rand(3, 32), model_version="cls-v1"
+        )
+        assert mock_hdbscan_instance.fit.call_args[0][0].shape == (3, 3)
+        mock_hdbscan_instance.labels_ = np.array([0] * 5 + [-1])
+        detector.detect_new_classes(
+            predictions, embeddings=np.random.rand(6, 32), model_version="cls-v1"
+        )
+        assert mock_hdbscan_instance.fit.call_args[0][0].shape == (6, 4)
+
+    @patch("ai_service.hdbscan_service.hdbscan.approximate_predict_scores")
+    @patch("ai_service.hdbscan_service.hdbscan.approximate_predict")
+    @patch("ai_service.hdbscan_service.hdbscan.HDBSCAN")
+    def test_reduction_config_change_refits(self, mock_hdbscan_class, mock_approximate, mock_scores, tmp_path):
+        """测试降维成分数或归一化配置变化后持久化聚类器重新拟合"""
+        mock_hdbscan_class.return_value = PicklableClusterer(np.array([0] * 60))
+        mock_approximate.return_value = (np.array([0, 0]), np.array([1.0, 1.0]))
+        mock_scores.return_value = np.array([0.1, 0.1])
+        model_path = str(tmp_path / "hdbscan_model.pkl")
+        history_provider = Mock(return_value=([f"old{i}.jpg" for i in range(60)], np.random.rand(60, 32)))
+        predictions = [{"filename": "new0.jpg"}, {"filename": "new1.jpg"}]
+
+        def score(reduction):
+            detector = HDBSCANNewClassDetector({
+                "enabled": True, "min_fit_samples": 5, "model_path": model_path, "reduction": reduction,
+            })
+            detector.detect_new_classes(
+                predictions, embeddings=np.random.rand(2, 32),
+                model_version="cls-v1", history_provider=history_provider
+            )
+            return detector.get_model_info()
+
+        info = score({"method": "pca", "n_components": 8})
+        assert (info["n_components"], info["normalize"], info["reduced_dim"]) == (8, False, 8)
+        fit_calls = history_provider.call_count
+
+        # 配置不变：沿用已保存的聚类器
+        score({"method": "pca", "n_components": 8})
+        assert history_provider.call_count == fit_calls
+
+        info = score({"method": "pca", "n_components": 16})
+        assert info["reduced_dim"] == 16
+        info = score({"method": "pca", "n_components": 16, "normalize": True})
+        assert info["normalize"] is True
+        assert history_provider.call_count == fit_calls + 2
+
 
 class TestModelPredictorEmbeddings:
     """ModelPredictor的embeddings功能测试"""
@@ -479,30 +1184,33 @@ class TestModelPredictorEmbeddings:
 class TestAIPredictorWithEmbeddings:
     """AIPredictor使用embeddings的集成测试"""
 
-    @patch("ai_service.ai_predictor.AIPredictor.predict_single")
+    @patch("ai_service.ai_predictor.AIPredictor.predict_many")
     @patch("ai_service.predictor.ModelPredictor.get_embeddings")
-    def test_predict_batch_uses_embeddings_for_hdbscan(self, mock_get_embeddings, mock_predict_single, temp_config_file):
-        """测试predict_batch使用embeddings而非置信度特征进行HDBSCAN聚类"""
-        # 模拟predict_single返回值
-        mock_predict_single.side_effect = [
-            {
-                "filename": f"test{i}.jpg",
-                "aircraft_class": "A320",
-                "aircraft_confidence": 0.9 + i * 0.01,
-                "airline_class": "CCA",
-                "airline_confidence": 0.85 + i * 0.01,
-                "registration": f"B-{1000+i}",
-                "registration_area": "0.5 0.5 0.2 0.1",
-                "quality_score": 0.8,
-                "quality_confidence": 0.8,
-                "prediction_time": 0.5,
-            }
-            for i in range(6)
-        ]
+    def test_predict_batch_uses_embeddings_for_hdbscan(self, mock_get_embeddings, mock_predict_many, temp_config_file):
+        """测试predict_batch使用分类推理时捕获的embeddings进行HDBSCAN聚类，不再单独调用embed"""
+        # 模拟分类时捕获的embedding - 128维
+        mock_embeddings = np.random.rand(6, 128)
+
+        def fake_predict_many(image_paths, embeddings=None):
+            if embeddings is not None:
+                embeddings.extend(mock_embeddings[:len(image_paths)])
+            return [
+                {
+                    "filename": f"test{i}.jpg",
+                    "aircraft_class": "A320",
+                    "aircraft_confidence": 0.9 + i * 0.01,
+                    "airline_class": "CCA",
+                    "airline_confidence": 0.85 + i * 0.01,
+                    "registration": f"B-{1000+i}",
+                    "registration_area": "0.5 0.5 0.2 0.1",
+                    "quality_score": 0.8,
+                    "quality_confidence": 0.8,
+                    "prediction_time": 0.5,
+                }
+                for i in range(len(image_paths))
+            ]
 
-        # 模拟get_embeddings返回值 - YOLO embed向量
-        mock_embeddings = np.random.rand(6, 128)  # 假设128维embedding
-        mock_get_embeddings.return_value = mock_embeddings
+        mock_predict_many.side_effect = fake_predict_many
 
         predictor = AIPredictor(temp_config_file)
         predictor._models_loaded = True  # 跳过模型加载
@@ -516,17 +1224,18 @@ class TestAIPredictorWithEmbeddings:
             test_images.append(path)
 
         try:
-            # 调用predict_batch，启用新类别检测
-            result = predictor.predict_batch(test_images, detect_new_classes=True)
+            with patch.object(predictor.hdbscan, "detect_new_classes",
+                              return_value=(np.zeros(6, dtype=int), np.zeros(6))) as mock_detect:
+                # 调用predict_batch，启用新类别检测
+                result = predictor.predict_batch(test_images, detect_new_classes=True)
 
-            # 验证：get_embeddings应该被调用
-            mock_get_embeddings.assert_called_once()
-            called_images = mock_get_embeddings.call_args[0][0]
-            assert len(called_images) == 6
+            # 验证：不再单独推理获取embeddings
+            mock_get_embeddings.assert_not_called()
+
+            # 验证：HDBSCAN使用分类时捕获的embeddings而不是置信度
+            embeddings = mock_detect.call_args.kwargs["embeddings"]
+            np.testing.assert_array_equal(embeddings, mock_embeddings)
 
-            # 验证：HDBSCAN应该使用embeddings而不是置信度
-            # 我们通过检查hdbscan被调用时的参数来验证
-            # 由于HDBSCAN的mock难以直接验证，我们检查结果结构
             assert "predictions" in result
             assert "new_class_indices" in result
             assert len(result["predictions"]) == 6
@@ -537,6 +1246,298 @@ class TestAIPredictorWithEmbeddings:
                     os.unlink(path)
 
 
+    @patch("ai_service.ai_predictor.AIPredictor.predict_many")
+    def test_predict_batch_skips_failed_embeddings(self, mock_predict_many, temp_config_file):
+        """测试推理失败的图片不参与新类别检测，检测结果下标映射回预测结果"""
+        mock_embeddings = np.random.rand(4, 8)
+
+        def fake_predict_many(image_paths, embeddings=None):
+            results = []
+            for i, path in enumerate(image_paths):
+                if i == 1:
+                    results.append({"filename": f"test{i}.jpg", "error": "decode failed"})
+                    embeddings.append(None)
+                else:
+                    results.append({"filename": f"test{i}.jpg", "aircraft_confidence": 0.9,
+                                    "airline_confidence": 0.9})
+                    embeddings.append(mock_embeddings[i])
+            return results
+
+        mock_predict_many.side_effect = fake_predict_many
+        predictor = AIPredictor(temp_config_file)
+        predictor._models_loaded = True
+
+        with patch.object(predictor.hdbscan, "detect_new_classes",
+                          return_value=(np.array([0, -1, 0]), np.array([0.1, 0.8, 0.2]))) as mock_detect:
+            result = predictor.predict_batch([f"/tmp/test{i}.jpg" for i in range(4)], detect_new_classes=True)
+
+        candidates = mock_detect.call_args[0][0]
+        assert [pred["filename"] for pred in candidates] == ["test0.jpg", "test2.jpg", "test3.jpg"]
+        np.testing.assert_array_equal(mock_detect.call_args.kwargs["embeddings"], mock_embeddings[[0, 2, 3]])
+
+        # 检测结果第 1 行对应 test2.jpg
+        assert result["new_class_indices"] == [2]
+        assert result["predictions"][2]["is_new_class"] == 1
+        assert result["predictions"][2]["outlier_score"] == pytest.approx(0.8)
+        assert result["predictions"][1]["is_new_class"] == 0
+
+class TestPredictionPipeline:
+    """流水线预测测试"""
+
+    def test_predict_batch_pipelined(self, sample_config, tmp_path):
+        """测试流水线预测：结果按输入顺序返回，回调在调用线程中串行执行，特征向量与结果对齐"""
+        import cv2
+        import threading
+        import yaml
+
+        sample_config["pipeline"] = {
+            "enabled": True, "decode_workers": 2, "ocr_workers": 3, "quality_workers": 2, "queue_size": 4,
+        }
+        sample_config["performance"] = {"batch_size": 3}
+        sample_config["auto_annotate"] = {"batch_size": 4}
+        config_path = tmp_path / "config.yaml"
+        config_path.write_text(yaml.dump(sample_config))
+
+        image_paths = []
+        for i in range(10):
+            path = tmp_path / f"test{i}.jpg"
+            cv2.imwrite(str(path), np.full((16, 16, 3), i, dtype=np.uint8))
+            image_paths.append(str(path))
+        # 无法解码的图片
+        (tmp_path / "broken.jpg").write_bytes(b"")
+        image_paths.insert(5, str(tmp_path / "broken.jpg"))
+
+        predictor = AIPredictor(str(config_path))
+        batch_sizes = []
+
+        def fake_predict_images(images):
+            batch_sizes.append(len(images))
+            return [
+                {
+                    "aircraft": {"class_name": "A320", "confidence": 0.9},
+                    "airline": {"class_name": "CCA", "confidence": 0.8},
+                    "embedding": np.full(4, image[0, 0, 0], dtype=np.float32),
+                }
+                for image in images
+            ]
+
+        callback_threads = set()
+        callback_indices = []
+        stored = []
+
+        def on_prediction(index, result):
+            callback_threads.add(threading.get_ident())
+            callback_indices.append(index)
+
+        with patch.object(predictor.predictor, "predict_images", side_effect=fake_predict_images), \
+                patch.object(predictor.ocr, "recognize", return_value={"registration": "B-1234", "confidence": 0.9}), \
+                patch.object(predictor.quality, "assess_many",
+                             side_effect=lambda paths: [{"score": 0.7, "pass": True} for _ in paths]), \
+                patch.object(type(predictor.predictor), "embedding_model_version", "cls-v1"), \
+                patch.object(predictor.hdbscan, "detect_new_classes",
+                             return_value=(np.zeros(10, dtype=int), np.zeros(10))) as mock_detect:
+            result = predictor.predict_batch(
+                image_paths,
+                on_prediction_callback=on_prediction,
+                on_embeddings_callback=lambda version, names, matrix: stored.append((version, names, matrix)),
+            )
+
+        predictions = result["predictions"]
+        assert [p["filename"] for p in predictions] == [os.path.basename(p) for p in image_paths]
+        assert "error" in predictions[5]
+        assert predictions[0]["registration"] == "B-1234"
+        assert predictions[0]["quality_score"] == 0.7
+
+        # 推理按 performance.batch_size 攒批
+        assert sum(batch_sizes) == 10
+        assert max(batch_sizes) <= 3
+
+        assert callback_threads == {threading.get_ident()}
+        assert sorted(callback_indices) == [i for i in range(11) if i != 5]
+
+        # 特征向量按 auto_annotate.batch_size 分组写入，只包含成功的图片
+        assert [len(names) for _, names, _ in stored] == [4, 4, 2]
+        for _, names, matrix in stored:
+            for name, row in zip(names, matrix):
+                assert row[0] == int(name[len("test"):-len(".jpg")])
+
+        # 失败图片不参与新类别检测，其余特征与传入的预测结果对齐
+        embeddings = mock_detect.call_args.kwargs["embeddings"]
+        candidates = mock_detect.call_args[0][0]
+        assert embeddings.shape == (10, 4)
+        assert "broken.jpg" not in [pred["filename"] for pred in candidates]
+        for pred, row in zip(candidates, embeddings):
+            assert row[0] == int(pred["filename"][len("test"):-len(".jpg")])
+
+
+class TestResultCache:
+    """结果缓存测试"""
+
+    @staticmethod
+    def _write_file(path, content):
+        with open(path, "wb") as f:
+            f.write(content)
+        return str(path)
+
+    def test_get_put_by_content(self, tmp_path):
+        """测试按内容哈希 + 版本读写"""
+        cache = ResultCache(str(tmp_path / "cache.db"))
+        a = self._write_file(tmp_path / "a.jpg", b"image-a")
+        copy = self._write_file(tmp_path / "copy.jpg", b"image-a")
+        b = self._write_file(tmp_path / "b.jpg", b"image-b")
+
+        assert cache.get("quality", "v1", a) is None
+        cache.put("quality", "v1", a, {"score": 0.8})
+
+        assert cache.get("quality", "v1", copy) == {"score": 0.8}
+        assert cache.get("quality", "v2", a) is None
+        assert cache.get("ocr", "v1", a) is None
+        assert cache.get("quality", "v1", b) is None
+        assert cache.get("quality", "v1", str(tmp_path / "missing.jpg")) is None
+
+        stats = cache.get_stats()
+        assert stats["entries"] == 1
+        assert stats["kinds"]["quality"]["hits"] == 1
+        assert stats["kinds"]["quality"]["misses"] == 4
+        assert stats["kinds"]["quality"]["hit_rate"] == pytest.approx(0.2)
+
+        # 重新打开后结果仍在
+        cache.close()
+        assert ResultCache(str(tmp_path / "cache.db")).get("quality", "v1", copy) == {"score": 0.8}
+
+    def test_lru_eviction(self, tmp_path):
+        """测试超过大小上限时淘汰最久未使用的结果"""
+        cache = ResultCache(str(tmp_path / "cache.db"), max_size_mb=0.01)
+        value = {"data": "x" * 3000}
+        paths = [self._write_file(tmp_path / f"{i}.jpg", bytes([i])) for i in range(4)]
+
+        for path in paths[:3]:
+            cache.put("prediction", "v1", path, value)
+        # 访问第一个结果，之后写入时淘汰最久未使用的第二个
+        assert cache.get("prediction", "v1", paths[0]) == value
+        cache.put("prediction", "v1", paths[3], value)
+
+        assert cache.get("prediction", "v1", paths[0]) == value
+        assert cache.get("prediction", "v1", paths[1]) is None
+        assert cache.get("prediction", "v1", paths[3]) == value
+        assert cache.get_stats()["size_bytes"] <= cache.max_size_bytes
+
+    def test_from_config(self, tmp_path):
+        """测试未启用时不创建缓存"""
+        assert ResultCache.from_config(None) is None
+        assert ResultCache.from_config({"enabled": False}) is None
+        cache = ResultCache.from_config({"enabled": True, "path": str(tmp_path / "c" / "cache.db")})
+        assert isinstance(cache, ResultCache)
+
+    def test_predict_many_uses_cache(self, sample_config, tmp_path):
+        """测试批量预测复用缓存结果（含特征向量），只推理未命中的图片"""
+        cache = ResultCache(str(tmp_path / "cache.db"))
+        predictor = ModelPredictor(sample_config["models"], batch_size=4, result_cache=cache)
+        a = self._write_file(tmp_path / "a.jpg", b"image-a")
+        b = self._write_file(tmp_path / "b.jpg", b"image-b")
+        renamed = self._write_file(tmp_path / "renamed.jpg", b"image-a")
+
+        def predict_images(images):
+            return [
+                {"aircraft": {"class_name": "A320"}, "embedding": np.arange(4, dtype=np.float32)}
+                for _ in images
+            ]
+
+        with patch.object(ModelPredictor, "prediction_version", "v1"), \
+                patch("ai_service.predictor.read_image", return_value=np.zeros((8, 8, 3), dtype=np.uint8)), \
+                patch.object(predictor, "predict_images", side_effect=predict_images) as mock_predict:
+            predictor.predict_many([a])
+            results = predictor.predict_many([renamed, b])
+
+        assert [len(call.args[0]) for call in mock_predict.call_args_list] == [1, 1]
+        assert results[0]["aircraft"]["class_name"] == "A320"
+        np.testing.assert_array_equal(results[0]["embedding"], np.arange(4, dtype=np.float32))
+        assert cache.get_stats()["kinds"]["prediction"]["hits"] == 1
+
+
+class TestDecodedImage:
+    """共享图片对象测试"""
+
+    def test_read_and_decode_once(self, tmp_path):
+        """测试文件只读取一次、只解码一次，各阶段共用"""
+        import cv2
+        import pickle
+
+        path = str(tmp_path / "a.jpg")
+        cv2.imwrite(path, np.full((40, 60, 3), (10, 20, 30), dtype=np.uint8))
+        cache = ResultCache(str(tmp_path / "cache.db"))
+        file_hash = cache.file_hash(path)
+
+        image = DecodedImage(path)
+        with patch("builtins.open", wraps=open) as mock_open, \
+                patch("ai_service.decoded_image.cv2.imdecode", wraps=cv2.imdecode) as mock_imdecode:
+            assert image.size == (60, 40)
+            assert image.format == "jpeg"
+            assert image.mime_type == "image/jpeg"
+            assert image.bgr.shape == (40, 60, 3)
+            assert image.rgb[0, 0, 0] == image.bgr[0, 0, 2]
+            assert image.content_hash == file_hash
+            cache.put("quality", "v1", image, {"score": 0.5})
+            ImageQualityAssessor().assess(image)
+
+        assert [call.args[0] for call in mock_open.call_args_list].count(path) == 1
+        assert mock_imdecode.call_count == 1
+
+        # 进程间传递：已解码时带像素（接收方不再解码），原始字节按需从文件读取
+        restored = pickle.loads(pickle.dumps(image))
+        assert restored.is_decoded
+        np.testing.assert_array_equal(restored.bgr, image.bgr)
+        assert restored.data == image.data
+        assert cache.get("quality", "v1", restored) == {"score": 0.5}
+
+        # 未解码时只带原始字节
+        image.release()
+        assert not image.is_decoded
+        restored = pickle.loads(pickle.dumps(image))
+        assert not restored.is_decoded
+        assert restored._read and restored.data == image.data
+        assert DecodedImage(str(tmp_path / "missing.jpg")).bgr is None
+
+    def test_decode_once_across_quality_pool(self, tmp_path):
+        """测试经过质量评估进程池时每张图片只解码一次（父进程已解码的不在工作进程中再解码）"""
+        import cv2
+        import multiprocessing
+
+        paths = []
+        for i in range(4):
+            path = str(tmp_path / f"{i}.jpg")
+            cv2.imwrite(path, np.full((40, 60, 3), i * 40, dtype=np.uint8))
+            paths.append(path)
+
+        # 计数器在 fork 前创建，工作进程中的解码也计入
+        decodes = multiprocessing.get_context("fork").Value("i", 0)
+        real_imdecode = cv2.imdecode
+
+        def counting_imdecode(*args, **kwargs):
+            with decodes.get_lock():
+                decodes.value += 1
+            return real_imdecode(*args, **kwargs)
+
+        with patch.object(cv2, "imdecode", counting_imdecode):
+            assessor = ImageQualityAssessor({"workers": 2, "chunksize": 1})
+            try:
+                assert assessor._pool is not None
+                # 前两张在父进程中已解码（如分类推理时），后两张未解码（如分类结果命中缓存）
+                images = [DecodedImage(path) for path in paths]
+                for image in images[:2]:
+                    assert image.bgr is not None
+                assert decodes.value == 2
+
+                results = assessor.assess_many(images)
+            finally:
+                assessor.cleanup()
+
+        assert all(result["success"] for result in results)
+        assert decodes.value == len(paths)
+        for path, result in zip(paths, results):
+            assert result == assessor.assess(path)
+
+
 class TestAIPredictor:
     """AIPredictor集成测试"""
 
@@ -8,6 +8,8 @@ import os
 import sys
 import tempfile
 import json
+import time
+import shutil
 from unittest.mock import Mock, patch, MagicMock
 
 # 添加项目根目录到路径
@@ -34,6 +36,7 @@ def temp_db():
     yield db, db_path
 
     # 清理
+    db.close()
     os.unlink(db_path)
 
 
@@ -169,6 +172,35 @@ class TestAPI:
         assert "total" in data
         assert "items" in data
 
+    def test_get_images_pagination(self, client):
+        """测试图片列表键集分页"""
+        test_client, db, images_dir, labeled_dir = client
+
+        for i in range(3):
+            with open(os.path.join(images_dir, f"page{i}.jpg"), "wb") as f:
+                f.write(b"fake image data")
+
+        response = test_client.get("/api/images?user_id=test_user&limit=2")
+        assert response.status_code == 200
+        data = response.get_json()
+        assert data["total"] == 3
+        assert [item["filename"] for item in data["items"]] == ["page0.jpg", "page1.jpg"]
+        assert data["next_cursor"]
+
+        response = test_client.get(
+            f"/api/images?user_id=test_user&limit=2&after={data['next_cursor']}"
+        )
+        data = response.get_json()
+        assert [item["filename"] for item in data["items"]] == ["page2.jpg"]
+        assert data["next_cursor"] is None
+
+    def test_get_images_invalid_sort(self, client):
+        """测试图片列表不支持的排序方式"""
+        test_client, db, images_dir, labeled_dir = client
+
+        response = test_client.get("/api/images?sort=unknown")
+        assert response.status_code == 400
+
     def test_skip_image(self, client):
         """测试跳过图片"""
         test_client, db, images_dir, labeled_dir = client
@@ -335,6 +367,102 @@ class TestAPI:
         assert response.status_code == 200
         assert "text/csv" in response.content_type
 
+    def test_export_labels_csv_content(self, client):
+        """测试流式导出CSV的内容"""
+        test_client, db, images_dir, labeled_dir = client
+
+        db.add_label({
+            "file_name": "A320-0001.jpg",
+            "original_file_name": "test.jpg",
+            "type_id": "A320",
+            "type_name": "空客A320",
+            "airline_id": "CCA",
+            "airline_name": "中国国航",
+            "clarity": 0.9,
+            "block": 0.1,
+            "registration": "B-1234",
+            "registration_area": "0.5 0.5 0.2 0.1",
+        })
+
+        response = test_client.get("/api/labels/export")
+        assert response.status_code == 200
+        text = response.data.decode("utf-8")
+        # 只有一个 BOM
+        assert text.startswith("\ufefffilename,")
+        lines = text[1:].splitlines()
+        assert lines[1].split(",")[:5] == [
+            "A320-0001.jpg",
+            str(db.get_aircraft_type_id_by_code("A320")),
+            "A320",
+            str(db.get_airline_id_by_code("CCA")),
+            "CCA",
+        ]
+
+    def test_export_labels_since_watermark(self, client):
+        """测试按变更水位增量导出 CSV"""
+        test_client, db, images_dir, labeled_dir = client
+
+        response = test_client.get("/api/labels/export")
+        watermark = int(response.headers["X-Export-Watermark"])
+
+        label_id = db.add_label({
+            "file_name": "B738-0001.jpg",
+            "original_file_name": "delta.jpg",
+            "type_id": "B738",
+            "type_name": "波音737-800",
+            "airline_id": "CCA",
+            "airline_name": "中国国航",
+            "clarity": 0.9,
+            "block": 0.1,
+            "registration": "B-1234",
+            "registration_area": "",
+        })["id"]
+        db.delete_label(label_id)
+
+        response = test_client.get(f"/api/labels/export?since={watermark}")
+        assert response.status_code == 200
+        assert int(response.headers["X-Export-Watermark"]) > watermark
+        lines = response.data.decode("utf-8-sig").splitlines()
+        assert lines[0].endswith(",change")
+        assert lines[1:] == ["B738-0001.jpg,,,,,,,,delete"]
+
+    def test_export_job_download_with_range(self, client, monkeypatch):
+        """测试后台导出任务和断点续传下载"""
+        test_client, db, images_dir, labeled_dir = client
+
+        import app as app_module
+        spool_dir = tempfile.mkdtemp()
+        monkeypatch.setattr(app_module, "EXPORT_SPOOL_DIR", spool_dir)
+
+        response = test_client.post("/api/exports", json={"type": "unknown"})
+        assert response.status_code == 400
+
+        response = test_client.post("/api/exports", json={"type": "csv"})
+        assert response.status_code == 202
+        job_id = response.get_json()["id"]
+
+        for _ in range(200):
+            job = test_client.get(f"/api/exports/{job_id}").get_json()
+            if job["status"] == "completed":
+                break
+            time.sleep(0.05)
+        assert job["status"] == "completed"
+
+        full = test_client.get(f"/api/exports/{job_id}/download")
+        assert full.status_code == 200
+        assert full.headers.get("Accept-Ranges") == "bytes"
+
+        partial = test_client.get(
+            f"/api/exports/{job_id}/download", headers={"Range": "bytes=3-"}
+        )
+        assert partial.status_code == 206
+        assert partial.data == full.data[3:]
+
+        assert test_client.delete(f"/api/exports/{job_id}").status_code == 200
+        assert test_client.get(f"/api/exports/{job_id}").status_code == 404
+
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
     def test_export_labels_yolo(self, client):
         """测试导出YOLO格式"""
         test_client, db, images_dir, labeled_dir = client
@@ -448,6 +576,32 @@ class TestAIAPI:
         # 验证调用
         mock_predictor.predict_single.assert_called_once()
 
+    @patch("app.ai_predictor")
+    def test_ai_predict_batch_conflicts_with_prediction_job(self, mock_predictor, client):
+        """测试后台预测任务已暂停或执行中时手动批量预测返回409"""
+        test_client, db, images_dir, labeled_dir = client
+
+        job_id = db.create_prediction_job("startup")
+        db.update_prediction_job(job_id, status="paused", processed=1, total=2)
+
+        import app as app_module
+
+        original_predictor = app_module.ai_predictor
+        original_enabled = app_module.ai_enabled
+
+        app_module.ai_predictor = mock_predictor
+        app_module.ai_enabled = True
+
+        response = test_client.post("/api/ai/predict-batch")
+
+        # 恢复原始值
+        app_module.ai_predictor = original_predictor
+        app_module.ai_enabled = original_enabled
+
+        assert response.status_code == 409
+        assert response.get_json()["job"]["id"] == job_id
+        mock_predictor.predict_batch.assert_not_called()
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
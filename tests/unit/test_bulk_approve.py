@@ -0,0 +1,97 @@
+"""
+AI 预测批量批准单元测试
+测试批量写入、序号分配和失败回滚
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import pytest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from bulk_approve import BulkApprover
+
+
+@pytest.fixture
+def approver():
+    """创建临时数据库、图片目录和预测"""
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    images_dir = tempfile.mkdtemp()
+    labeled_dir = tempfile.mkdtemp()
+
+    db = Database(db_path)
+    for i, aircraft_class in enumerate(["A320", "A320", "B738"]):
+        filename = f"img{i}.jpg"
+        with open(os.path.join(images_dir, filename), "wb") as f:
+            f.write(b"test")
+        db.add_ai_prediction({
+            "filename": filename,
+            "aircraft_class": aircraft_class,
+            "aircraft_confidence": 0.99,
+            "airline_class": "CCA",
+            "airline_confidence": 0.99,
+            "registration": "B-1234",
+            "registration_area": "0.5 0.5 0.2 0.1",
+            "clarity": 0.9,
+            "block": 0.1,
+            "prediction_time": 0.1,
+        })
+    db.sync_image_inventory(os.listdir(images_dir))
+
+    yield BulkApprover(db, images_dir, labeled_dir, max_workers=2), db, images_dir, labeled_dir
+
+    db.close()
+    shutil.rmtree(images_dir, ignore_errors=True)
+    shutil.rmtree(labeled_dir, ignore_errors=True)
+    os.unlink(db_path)
+
+
+class TestBulkApprover:
+    """批量批准测试"""
+
+    def test_bulk_approve(self, approver):
+        """测试批量批准"""
+        bulk, db, images_dir, labeled_dir = approver
+        progress = []
+
+        result = bulk.run(
+            ["img0.jpg", "img1.jpg", "img2.jpg", "missing.jpg"],
+            progress_callback=progress.append,
+        )
+
+        assert len(result["results"]) == 3
+        assert result["errors"] == [{"filename": "missing.jpg", "error": "AI prediction not found"}]
+        assert sorted(r["file_name"] for r in result["results"]) == [
+            "A320-0001.jpg", "A320-0002.jpg", "B738-0001.jpg"
+        ]
+        assert sorted(os.listdir(labeled_dir)) == ["A320-0001.jpg", "A320-0002.jpg", "B738-0001.jpg"]
+        assert os.listdir(images_dir) == []
+
+        labels = db.get_labels()["items"]
+        assert len(labels) == 3
+        assert all(l["review_status"] == "auto_approved" and l["ai_approved"] == 1 for l in labels)
+        assert db.get_unprocessed_predictions() == []
+        assert db.get_inventory_counts() == {"labeled": 3}
+        assert progress[-1] == {"stage": "done", "done": 3, "total": 3}
+
+    def test_rollback_on_save_failure(self, approver, monkeypatch):
+        """测试数据库写入失败时文件移回原位"""
+        bulk, db, images_dir, labeled_dir = approver
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("disk full")
+        monkeypatch.setattr(db, "add_approved_labels", fail)
+
+        result = bulk.run(["img0.jpg", "img2.jpg"])
+
+        assert result["results"] == []
+        assert len(result["errors"]) == 2
+        assert sorted(os.listdir(images_dir)) == ["img0.jpg", "img1.jpg", "img2.jpg"]
+        assert os.listdir(labeled_dir) == []
+        assert db.get_labels()["total"] == 0
+        assert bulk.get_progress()["stage"] == "failed"
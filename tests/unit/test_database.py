@@ -8,6 +8,7 @@ import pytest
 import os
 import tempfile
 import sqlite3
+import threading
 from pathlib import Path
 
 # 添加项目根目录到路径
@@ -26,6 +27,7 @@ def temp_db():
     yield db, db_path
 
     # 清理
+    db.close()
     os.unlink(db_path)
 
 
@@ -167,6 +169,99 @@ class TestDatabase:
         seq2 = db.get_next_sequence("A320")
         assert seq2 == 2
 
+    def test_allocate_sequences(self, db_with_data):
+        """测试原子分配和批量预留序号"""
+        db = db_with_data
+
+        assert db.allocate_sequence("A320") == 1
+        assert db.reserve_sequences("A320", 3) == [2, 3, 4]
+        assert db.reserve_sequences("B738", 2) == [1, 2]
+        assert db.get_next_sequence("A320") == 5
+
+        # 并发分配不会得到重复序号
+        allocated = []
+        lock = threading.Lock()
+
+        def worker():
+            for _ in range(20):
+                seq = db.allocate_sequence("A320")
+                with lock:
+                    allocated.append(seq)
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert sorted(allocated) == list(range(5, 85))
+
+    def test_sequence_past_9999(self, db_with_data):
+        """测试序号超过 9999 后按数值递增"""
+        db = db_with_data
+
+        for file_name, original in [("A320-9999.jpg", "a.jpg"), ("A320-10000.jpg", "b.jpg")]:
+            db.add_label(
+                {
+                    "file_name": file_name,
+                    "original_file_name": original,
+                    "type_id": "A320",
+                    "type_name": "空客A320",
+                    "airline_id": "CCA",
+                    "airline_name": "中国国航",
+                    "clarity": 0.9,
+                    "block": 0.1,
+                    "registration": "B-1234",
+                    "registration_area": "0.5 0.5 0.2 0.1",
+                }
+            )
+
+        assert db.get_next_sequence("A320") == 10001
+        assert db.allocate_sequence("A320") == 10001
+
+        # 迁移旧数据库时从已有文件名重建计数器
+        conn = db.get_connection()
+        conn.execute("DROP TABLE type_sequences")
+        conn.commit()
+        conn.close()
+        db.init_db()
+        assert db.get_next_sequence("A320") == 10001
+
+    def test_iter_labels_for_export(self, db_with_data):
+        """测试分批流式读取导出数据和 code -> id 映射缓存"""
+        db = db_with_data
+
+        ids = []
+        for i in range(5):
+            ids.append(db.add_label(
+                {
+                    "file_name": f"A320-{5 - i:04d}.jpg",
+                    "original_file_name": f"orig{i}.jpg",
+                    "type_id": "A320",
+                    "type_name": "空客A320",
+                    "airline_id": "CCA",
+                    "airline_name": "中国国航",
+                    "clarity": 0.9,
+                    "block": 0.1,
+                    "registration": "B-1234",
+                    "registration_area": "0.5 0.5 0.2 0.1",
+                }
+            )["id"])
+
+        rows = list(db.iter_labels_for_export(batch_size=2))
+        assert [r["file_name"] for r in rows] == [f"A320-{i:04d}.jpg" for i in range(1, 6)]
+
+        rows = list(db.iter_labels_for_export(start_id=ids[1], end_id=ids[2]))
+        assert [r["file_name"] for r in rows] == ["A320-0003.jpg", "A320-0004.jpg"]
+        assert db.get_all_labels_with_area(end_id=ids[0]) == [
+            {"file_name": "A320-0005.jpg", "registration_area": "0.5 0.5 0.2 0.1"}
+        ]
+
+        code_maps = db.get_code_id_maps()
+        assert set(code_maps["airlines"]) == {"CCA", "CSN"}
+        assert db.get_code_id_maps() is code_maps
+        db.add_airline("CES", "中国东方航空")
+        assert "CES" in db.get_code_id_maps()["airlines"]
+
     def test_acquire_lock(self, db_with_data):
         """测试获取锁"""
         db = db_with_data
@@ -240,6 +335,34 @@ class TestDatabase:
         assert prediction["aircraft_class"] == "A320"
         assert prediction["aircraft_confidence"] == 0.95
 
+    def test_add_ai_predictions_batch(self, db_with_data):
+        """测试批量添加AI预测和批量标记新类别"""
+        db = db_with_data
+        db.sync_image_inventory(["a.jpg", "b.jpg", "c.jpg"])
+
+        def prediction(filename):
+            return {
+                "filename": filename,
+                "aircraft_class": "A320",
+                "aircraft_confidence": 0.9,
+                "airline_class": "CCA",
+                "airline_confidence": 0.9,
+                "prediction_time": 0.1,
+            }
+
+        result = db.add_ai_predictions([prediction("a.jpg"), prediction("b.jpg")])
+        assert result == {"inserted": 2, "duplicates": 0}
+
+        # 已存在的预测被忽略
+        result = db.add_ai_predictions([prediction("b.jpg"), prediction("c.jpg")])
+        assert result == {"inserted": 1, "duplicates": 1}
+        assert db.get_inventory_counts() == {"predicted": 3}
+
+        assert db.bulk_update_new_class_flags([("a.jpg", 0.8), ("c.jpg", 0.6)]) == 2
+        assert db.get_ai_prediction("a.jpg")["is_new_class"] == 1
+        assert db.get_ai_prediction("c.jpg")["outlier_score"] == 0.6
+        assert db.get_ai_prediction("b.jpg")["is_new_class"] == 0
+
     def test_get_unprocessed_predictions(self, db_with_data):
         """测试获取未处理的预测"""
         db = db_with_data
@@ -278,6 +401,64 @@ class TestDatabase:
         predictions = db.get_unprocessed_predictions()
         assert len(predictions) == 2
 
+    def test_review_priority_maintained(self, db_with_data):
+        """测试机型计数和复审优先级随标注增删自动更新"""
+        db = db_with_data
+
+        def add_prediction(filename, aircraft_class, confidence, is_new_class=0, outlier=0.0):
+            db.add_ai_prediction({
+                "filename": filename,
+                "aircraft_class": aircraft_class,
+                "aircraft_confidence": confidence,
+                "airline_class": "CCA",
+                "airline_confidence": 0.99,
+                "is_new_class": is_new_class,
+                "outlier_score": outlier,
+                "prediction_time": 0.1,
+            })
+
+        def add_label(i, type_id):
+            return db.add_label({
+                "file_name": f"{i:04d}.jpg",
+                "original_file_name": f"orig{i}.jpg",
+                "type_id": type_id,
+                "type_name": type_id,
+                "airline_id": "CCA",
+                "airline_name": "中国国航",
+                "clarity": 0.9,
+                "block": 0.1,
+                "registration": "B-1234",
+                "registration_area": "0.5 0.5 0.2 0.1",
+            })["id"]
+
+        # A320 有 8 个样本，B738 有 2 个
+        label_ids = [add_label(i, "A320") for i in range(8)]
+        add_label(8, "B738")
+        add_label(9, "B738")
+
+        add_prediction("a320_low.jpg", "A320", 0.5)
+        add_prediction("a320_high.jpg", "A320", 0.9)
+        add_prediction("b738.jpg", "B738", 0.99)
+        add_prediction("new_low.jpg", "A320", 0.9, is_new_class=1, outlier=0.3)
+        add_prediction("new_high.jpg", "A320", 0.9, is_new_class=1, outlier=0.8)
+
+        order = [p["filename"] for p in db.get_unprocessed_predictions()]
+        assert order == ["new_high.jpg", "new_low.jpg", "b738.jpg", "a320_low.jpg", "a320_high.jpg"]
+        b738 = db.get_unprocessed_predictions()[2]
+        assert b738["priority"] == 1
+        assert b738["sample_count"] == 2
+
+        # 删除一个 A320 标注后样本不足，A320 的预测按样本量排到 B738（2 个样本）之后
+        db.delete_label(label_ids[0])
+        order = [p["filename"] for p in db.get_unprocessed_predictions(limit=5)]
+        assert order == ["new_high.jpg", "new_low.jpg", "b738.jpg", "a320_high.jpg", "a320_low.jpg"]
+        a320 = [p for p in db.get_unprocessed_predictions() if p["aircraft_class"] == "A320"]
+        assert all(p["priority"] == 1 and p["sample_count"] == 7 for p in a320 if not p["is_new_class"])
+
+        # 新类别标记更新后优先级同步刷新
+        db.bulk_update_new_class_flags([("b738.jpg", 0.9)])
+        assert db.get_unprocessed_predictions(limit=1)[0]["filename"] == "b738.jpg"
+
     def test_update_label_with_ai_data(self, db_with_data):
         """测试更新标注的AI数据"""
         db = db_with_data
@@ -307,6 +488,57 @@ class TestDatabase:
         assert label["review_status"] == "approved"
         assert label["ai_approved"] == 1
 
+    def test_label_changes_delta(self, db_with_data):
+        """测试标注变更日志和增量导出筛选"""
+        db = db_with_data
+
+        def label(i):
+            return {
+                "file_name": f"A320-{i:04d}.jpg",
+                "original_file_name": f"test{i}.jpg",
+                "type_id": "A320",
+                "type_name": "空客A320",
+                "airline_id": "CCA",
+                "airline_name": "中国国航",
+                "clarity": 0.9,
+                "block": 0.1,
+                "registration": "B-1234",
+                "registration_area": "0.5 0.5 0.2 0.1",
+            }
+
+        ids = [db.add_label(label(i))["id"] for i in range(1, 4)]
+        assert db.get_label_by_id(ids[0])["updated_at"] is not None
+        watermark = db.get_label_change_watermark()
+        assert watermark > 0
+
+        # 没有变化时增量为空，重复保存相同内容不产生变更
+        assert list(db.iter_labels_for_export(since=watermark)) == []
+        db.update_label(ids[0], label(1))
+        assert db.get_label_change_watermark() == watermark
+
+        updated = dict(label(2), registration="B-5678")
+        assert db.update_label(ids[1], updated) is True
+        assert db.delete_label(ids[2]) is True
+
+        rows = list(db.iter_labels_for_export(since=watermark))
+        assert [row["file_name"] for row in rows] == ["A320-0002.jpg"]
+        assert rows[0]["registration"] == "B-5678"
+        assert db.count_labels_for_export(since=watermark) == 1
+        deleted = db.get_deleted_labels(watermark)
+        assert [item["file_name"] for item in deleted] == ["A320-0003.jpg"]
+
+        # until 之后的变更留给下一次增量
+        new_watermark = db.get_label_change_watermark()
+        db.update_label(ids[0], dict(label(1), clarity=0.5))
+        rows = list(db.iter_labels_for_export(since=watermark, until=new_watermark))
+        assert [row["file_name"] for row in rows] == ["A320-0002.jpg"]
+        rows = list(db.iter_labels_for_export(since=new_watermark))
+        assert [row["file_name"] for row in rows] == ["A320-0001.jpg"]
+        assert db.get_deleted_labels(new_watermark) == []
+
+        # since=0 等同于全量导出
+        assert db.count_labels_for_export(since=0) == 2
+
     def test_get_stats(self, db_with_data):
         """测试获取统计信息"""
         db = db_with_data
@@ -368,6 +600,214 @@ class TestDatabase:
         predictions = db.get_unprocessed_predictions()
         assert len(predictions) == 0
 
+    def test_sync_image_inventory(self, db_with_data):
+        """测试图片清单同步及状态推导"""
+        db = db_with_data
+
+        db.add_label(
+            {
+                "file_name": "A320-0001.jpg",
+                "original_file_name": "labeled.jpg",
+                "type_id": "A320",
+                "type_name": "空客A320",
+                "airline_id": "CCA",
+                "airline_name": "中国国航",
+                "clarity": 0.9,
+                "block": 0.1,
+                "registration": "B-1234",
+                "registration_area": "0.5 0.5 0.2 0.1",
+            }
+        )
+        db.skip_image("skipped.jpg")
+
+        result = db.sync_image_inventory(
+            ["new1.jpg", "new2.jpg", "labeled.jpg", "skipped.jpg"]
+        )
+        assert result["added"] == 4
+
+        counts = db.get_inventory_counts()
+        assert counts["unlabeled"] == 2
+        assert counts["labeled"] == 1
+        assert counts["skipped"] == 1
+        assert db.get_inventory_filenames() == ["new1.jpg", "new2.jpg"]
+
+        # 从目录中消失的待标注文件被移除，已标注/已跳过记录保留
+        result = db.sync_image_inventory(["new1.jpg"])
+        assert result["removed"] == 1
+        assert db.get_inventory_filenames() == ["new1.jpg"]
+        assert db.get_inventory_counts()["labeled"] == 1
+
+    def test_inventory_incremental_updates(self, db_with_data):
+        """测试写入预测/跳过/标注时增量更新图片清单"""
+        db = db_with_data
+
+        db.sync_image_inventory(["a.jpg", "b.jpg", "c.jpg"])
+
+        db.add_ai_prediction(
+            {
+                "filename": "a.jpg",
+                "aircraft_class": "A320",
+                "aircraft_confidence": 0.9,
+                "airline_class": "CCA",
+                "airline_confidence": 0.9,
+                "prediction_time": 1.0,
+            }
+        )
+        db.skip_image("b.jpg")
+        result = db.add_label(
+            {
+                "file_name": "A320-0001.jpg",
+                "original_file_name": "c.jpg",
+                "type_id": "A320",
+                "type_name": "空客A320",
+                "airline_id": "CCA",
+                "airline_name": "中国国航",
+                "clarity": 0.9,
+                "block": 0.1,
+                "registration": "B-1234",
+                "registration_area": "0.5 0.5 0.2 0.1",
+            }
+        )
+
+        counts = db.get_inventory_counts()
+        assert counts == {"predicted": 1, "skipped": 1, "labeled": 1}
+        assert db.get_inventory_filenames() == ["a.jpg"]
+
+        # 删除标注后清单记录被移除，等待下一次同步重新推导
+        db.delete_label(result["id"])
+        db.sync_image_inventory(["a.jpg", "c.jpg"])
+        assert db.get_inventory_filenames() == ["a.jpg", "c.jpg"]
+
+    def test_get_inbox_view(self, db_with_data):
+        """测试待标注视图一次返回锁和AI预测"""
+        db = db_with_data
+
+        db.sync_image_inventory(["a.jpg", "b.jpg", "c.jpg", "d.jpg"])
+        db.skip_image("d.jpg")
+        db.add_ai_prediction(
+            {
+                "filename": "b.jpg",
+                "aircraft_class": "A320",
+                "aircraft_confidence": 0.9,
+                "airline_class": "CCA",
+                "airline_confidence": 0.8,
+                "registration": "B-1234",
+                "prediction_time": 1.0,
+            }
+        )
+        db.acquire_lock("a.jpg", "user1")
+        db.acquire_lock("c.jpg", "user2")
+
+        view = db.get_inbox_view(user_id="user1")
+        assert view["total"] == 3
+        items = {item["filename"]: item for item in view["items"]}
+        assert list(items) == ["a.jpg", "b.jpg", "c.jpg"]
+
+        # 自己持有的锁不视为锁定
+        assert items["a.jpg"]["locked_by"] is None
+        assert items["c.jpg"]["locked_by"] == "user2"
+
+        assert items["b.jpg"]["has_ai_prediction"] == 1
+        assert items["b.jpg"]["aircraft_class"] == "A320"
+        assert items["a.jpg"]["has_ai_prediction"] == 0
+
+        page = db.get_inbox_view(user_id="user1", offset=1, limit=1)
+        assert page["total"] == 3
+        assert [item["filename"] for item in page["items"]] == ["b.jpg"]
+
+    def test_inbox_view_keyset_pagination(self, db_with_data):
+        """测试待标注视图的键集分页、排序和过滤"""
+        db = db_with_data
+
+        db.sync_image_inventory([f"img{i}.jpg" for i in range(6)])
+        for i in range(4):
+            db.add_ai_prediction(
+                {
+                    "filename": f"img{i}.jpg",
+                    "aircraft_class": "A320",
+                    "aircraft_confidence": 0.9 - i * 0.1,
+                    "airline_class": "CCA",
+                    "airline_confidence": 0.95,
+                    "is_new_class": i % 2,
+                    "outlier_score": i * 0.1,
+                    "quality_pass": i != 3,
+                    "prediction_time": 1.0,
+                }
+            )
+
+        def collect(**kwargs):
+            view = db.get_inbox_view(limit=2, **kwargs)
+            names = [item["filename"] for item in view["items"]]
+            while view["next_cursor"]:
+                view = db.get_inbox_view(
+                    limit=2, after=view["next_cursor"], with_total=False, **kwargs
+                )
+                names.extend(item["filename"] for item in view["items"])
+            return names
+
+        assert collect() == [f"img{i}.jpg" for i in range(6)]
+        # 按置信度/异常分数排序时只返回有预测的图片
+        assert collect(sort="confidence") == ["img3.jpg", "img2.jpg", "img1.jpg", "img0.jpg"]
+        assert collect(sort="outlier_score") == ["img3.jpg", "img2.jpg", "img1.jpg", "img0.jpg"]
+
+        assert collect(filters={"is_new_class": 1}) == ["img1.jpg", "img3.jpg"]
+        assert collect(filters={"quality_pass": 0}) == ["img3.jpg"]
+        assert collect(
+            sort="confidence", filters={"min_confidence": 0.65, "max_confidence": 0.85}
+        ) == ["img2.jpg", "img1.jpg"]
+
+        with pytest.raises(ValueError):
+            db.get_inbox_view(sort="unknown")
+
+        # 游标与排序方式不匹配
+        cursor = db.get_inbox_view(limit=1)["next_cursor"]
+        with pytest.raises(ValueError):
+            db.get_inbox_view(limit=1, sort="confidence", after=cursor)
+
+    def test_connection_pool(self, temp_db):
+        """测试连接池：WAL 模式、线程内复用、线程间隔离"""
+        db, db_path = temp_db
+
+        conn = db.get_connection()
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        raw = conn._conn
+        conn.close()
+
+        # 同一线程复用连接
+        conn = db.get_connection()
+        assert conn._conn is raw
+        conn.close()
+
+        # 不同线程使用不同连接
+        other = []
+        def worker():
+            c = db.get_connection()
+            other.append(c._conn)
+            c.close()
+        thread = threading.Thread(target=worker)
+        thread.start()
+        thread.join()
+        assert other[0] is not raw
+
+        # 未提交的写入在归还连接时回滚
+        conn = db.get_connection()
+        conn.execute("INSERT INTO airlines (code, name) VALUES ('TST', 'Test')")
+        conn.close()
+        assert all(a["code"] != "TST" for a in db.get_airlines())
+
+        health = db.health_check()
+        assert health["ok"] is True
+        assert health["journal_mode"] == "wal"
+
+    def test_close_pool(self, temp_db):
+        """测试关闭连接池"""
+        db, db_path = temp_db
+        db.get_airlines()
+        db.close()
+
+        with pytest.raises(sqlite3.ProgrammingError):
+            db.get_airlines()
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
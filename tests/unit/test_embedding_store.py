@@ -0,0 +1,86 @@
+"""
+特征向量存储单元测试
+测试追加写入、按文件名读取和未提交数据的截断
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import numpy as np
+import pytest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from embedding_store import EmbeddingStore
+
+
+@pytest.fixture
+def store():
+    """创建临时数据库和矩阵文件目录"""
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    store_dir = tempfile.mkdtemp()
+
+    db = Database(db_path)
+    yield EmbeddingStore(db, store_dir), db
+
+    db.close()
+    shutil.rmtree(store_dir, ignore_errors=True)
+    os.unlink(db_path)
+
+
+class TestEmbeddingStore:
+    """特征向量存储测试"""
+
+    def test_add_and_get(self, store):
+        """测试追加写入和按文件名读取"""
+        embedding_store, db = store
+
+        first = np.random.rand(3, 8).astype(np.float32)
+        second = np.random.rand(2, 8).astype(np.float32)
+        assert embedding_store.add("cls-v1", ["a.jpg", "b.jpg", "c.jpg"], first) == 3
+        # b.jpg 重新写入后指向新行
+        embedding_store.add("cls-v1", ["b.jpg", "d.jpg"], second)
+
+        matrix = embedding_store.matrix("cls-v1")
+        assert isinstance(matrix, np.memmap)
+        assert matrix.shape == (5, 8)
+        assert matrix.dtype == np.float16
+
+        names, vectors = embedding_store.get("cls-v1", ["b.jpg", "d.jpg", "missing.jpg"])
+        assert names == ["b.jpg", "d.jpg"]
+        np.testing.assert_allclose(vectors, second.astype(np.float16))
+
+        names, vectors = embedding_store.get("cls-v1")
+        assert names == ["a.jpg", "c.jpg", "b.jpg", "d.jpg"]
+        assert vectors.shape == (4, 8)
+
+        sets = embedding_store.versions()
+        assert [(s["model_version"], s["row_count"], s["indexed_count"]) for s in sets] == [
+            ("cls-v1", 5, 4)
+        ]
+
+        with pytest.raises(ValueError):
+            embedding_store.add("cls-v1", ["e.jpg"], np.random.rand(1, 4))
+        assert embedding_store.matrix("cls-v2") is None
+
+    def test_uncommitted_rows_truncated(self, store):
+        """测试索引未提交的尾部数据在下次写入时被截掉"""
+        embedding_store, db = store
+
+        embedding_store.add("cls-v1", ["a.jpg"], np.ones((1, 4)))
+        # 模拟写入文件后、提交索引前进程退出
+        with open(embedding_store.matrix_path("cls-v1"), "ab") as f:
+            f.write(np.full((3, 4), 7, dtype=np.float16).tobytes())
+
+        embedding_store.add("cls-v1", ["b.jpg"], np.full((1, 4), 2))
+        assert os.path.getsize(embedding_store.matrix_path("cls-v1")) == 2 * 4 * 2
+        names, vectors = embedding_store.get("cls-v1", ["b.jpg"])
+        np.testing.assert_array_equal(vectors, np.full((1, 4), 2))
+
+        assert embedding_store.delete("cls-v1")
+        assert not os.path.exists(embedding_store.matrix_path("cls-v1"))
+        assert db.get_embedding_rows("cls-v1") == {}
@@ -0,0 +1,149 @@
+"""
+后台导出任务单元测试
+测试各类型导出产物和任务状态
+"""
+
+import os
+import sys
+import time
+import shutil
+import zipfile
+import tempfile
+import pytest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from export_jobs import ExportJobManager
+
+
+@pytest.fixture
+def manager():
+    """创建临时数据库、已标注目录和导出目录"""
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    labeled_dir = tempfile.mkdtemp()
+    spool_dir = tempfile.mkdtemp()
+
+    db = Database(db_path)
+    db.add_aircraft_type("A320", "空客A320")
+    db.add_airline("CCA", "中国国航")
+    for i in range(1, 4):
+        file_name = f"A320-{i:04d}.jpg"
+        with open(os.path.join(labeled_dir, file_name), "wb") as f:
+            f.write(os.urandom(2000))
+        db.add_label({
+            "file_name": file_name,
+            "original_file_name": f"orig{i}.jpg",
+            "type_id": "A320",
+            "type_name": "空客A320",
+            "airline_id": "CCA",
+            "airline_name": "中国国航",
+            "clarity": 0.9,
+            "block": 0.1,
+            "registration": "B-1234",
+            "registration_area": "0.5 0.5 0.2 0.1",
+        })
+
+    export_manager = ExportJobManager(db, labeled_dir, spool_dir, max_workers=1)
+    yield export_manager, db, spool_dir
+
+    export_manager.shutdown()
+    db.close()
+    shutil.rmtree(labeled_dir, ignore_errors=True)
+    shutil.rmtree(spool_dir, ignore_errors=True)
+    os.unlink(db_path)
+
+
+def wait_for(db, job_id, timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = db.get_export_job(job_id)
+        if job["status"] not in ("queued", "running"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("export job did not finish")
+
+
+class TestExportJobs:
+    """后台导出任务测试"""
+
+    def test_csv_export(self, manager):
+        """测试 CSV 导出任务"""
+        export_manager, db, spool_dir = manager
+
+        job = export_manager.submit("csv", {"start_id": 2})
+        assert job["status"] == "queued"
+        job = wait_for(db, job["id"])
+
+        assert job["status"] == "completed"
+        assert job["progress"] == job["total"] == 2
+        with open(job["file_path"], "rb") as f:
+            lines = f.read().decode("utf-8-sig").splitlines()
+        assert [line.split(",")[0] for line in lines] == ["filename", "A320-0002.jpg", "A320-0003.jpg"]
+        assert job["file_size"] == os.path.getsize(job["file_path"])
+
+    def test_dataset_export(self, manager):
+        """测试完整数据集导出任务"""
+        export_manager, db, spool_dir = manager
+
+        job = wait_for(db, export_manager.submit("dataset")["id"])
+        assert job["status"] == "completed"
+        assert job["total"] == 9
+
+        with zipfile.ZipFile(job["file_path"]) as zf:
+            names = zf.namelist()
+            assert names[0] == "labels.csv"
+            assert "labels/A320-0001.txt" in names
+            assert "images/A320-0003.jpg" in names
+            assert zf.read("labels/A320-0001.txt") == b"0 0.5 0.5 0.2 0.1"
+        assert export_manager.download_name(job) == f"dataset-{job['id']}.zip"
+
+    def test_delta_export(self, manager):
+        """测试按变更水位增量导出"""
+        export_manager, db, spool_dir = manager
+
+        full = wait_for(db, export_manager.submit("csv")["id"])
+        watermark = full["watermark"]
+        assert watermark == db.get_label_change_watermark()
+
+        label = db.get_label_by_id(1)
+        db.update_label(1, dict(label, registration="B-5678"))
+        db.delete_label(3)
+
+        job = wait_for(db, export_manager.submit("csv", {"since": watermark})["id"])
+        assert job["status"] == "completed"
+        assert job["total"] == 1
+        assert job["watermark"] > watermark
+        with open(job["file_path"], "rb") as f:
+            rows = [line.split(",") for line in f.read().decode("utf-8-sig").splitlines()]
+        assert rows[0][-1] == "change"
+        assert (rows[1][0], rows[1][7], rows[1][-1]) == ("A320-0001.jpg", "B-5678", "upsert")
+        assert (rows[2][0], rows[2][-1]) == ("A320-0003.jpg", "delete")
+        assert len(rows) == 3
+
+        job = wait_for(db, export_manager.submit("images", {"since": watermark})["id"])
+        with zipfile.ZipFile(job["file_path"]) as zf:
+            assert zf.namelist() == ["A320-0001.jpg", "deleted.txt"]
+            assert zf.read("deleted.txt") == b"A320-0003.jpg\n"
+
+    def test_delete_and_interrupted(self, manager):
+        """测试删除任务产物和重启后标记未完成任务"""
+        export_manager, db, spool_dir = manager
+
+        job = wait_for(db, export_manager.submit("yolo")["id"])
+        assert os.path.exists(job["file_path"])
+        assert export_manager.delete(job["id"])
+        assert not os.path.exists(job["file_path"])
+        assert db.get_export_job(job["id"]) is None
+
+        with pytest.raises(ValueError):
+            export_manager.submit("unknown")
+
+        # 模拟进程退出时遗留的任务
+        job_id = db.create_export_job("csv")
+        open(os.path.join(spool_dir, f"{job_id}.csv.part"), "wb").close()
+        ExportJobManager(db, export_manager.labeled_dir, spool_dir).shutdown()
+        assert db.get_export_job(job_id)["status"] == "failed"
+        assert not os.path.exists(os.path.join(spool_dir, f"{job_id}.csv.part"))
@@ -0,0 +1,88 @@
+"""
+图片清单单元测试
+测试目录 mtime 校验和清单同步
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import pytest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from image_inventory import ImageInventory
+
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+
+
+@pytest.fixture
+def inventory():
+    """创建临时数据库和图片目录"""
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    images_dir = tempfile.mkdtemp()
+
+    db = Database(db_path)
+    yield ImageInventory(db, images_dir, IMAGE_EXTENSIONS, rescan_interval=0), images_dir
+
+    db.close()
+    shutil.rmtree(images_dir, ignore_errors=True)
+    os.unlink(db_path)
+
+
+def touch(images_dir, filename):
+    with open(os.path.join(images_dir, filename), "wb") as f:
+        f.write(b"fake image data")
+
+
+class TestImageInventory:
+    """图片清单测试"""
+
+    def test_list_pending_filters_non_images(self, inventory):
+        """测试只收录图片文件"""
+        inv, images_dir = inventory
+        touch(images_dir, "b.jpg")
+        touch(images_dir, "a.png")
+        touch(images_dir, "notes.txt")
+
+        assert inv.list_pending() == ["a.png", "b.jpg"]
+        assert inv.count_pending() == 2
+
+    def test_refresh_skipped_when_mtime_unchanged(self, inventory):
+        """测试目录未变化时不重新扫描"""
+        inv, images_dir = inventory
+        touch(images_dir, "a.jpg")
+
+        assert inv.refresh() is True
+        assert inv.refresh() is False
+
+        os.remove(os.path.join(images_dir, "a.jpg"))
+        # 保证 mtime 变化（部分文件系统时间精度较低）
+        stat = os.stat(images_dir)
+        os.utime(images_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+
+        assert inv.refresh() is True
+        assert inv.list_pending() == []
+
+    def test_skip_removes_from_pending(self, inventory):
+        """测试跳过图片后不再出现在待标注列表"""
+        inv, images_dir = inventory
+        touch(images_dir, "a.jpg")
+        touch(images_dir, "b.jpg")
+        inv.refresh()
+
+        inv.db.skip_image("a.jpg")
+
+        assert inv.list_pending() == ["b.jpg"]
+        assert inv.get_counts()["skipped"] == 1
+
+    def test_invalidate_forces_rescan(self, inventory):
+        """测试 invalidate 后强制重新扫描"""
+        inv, images_dir = inventory
+        inv.refresh()
+        inv.invalidate()
+        assert inv.refresh() is True
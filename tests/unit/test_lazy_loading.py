@@ -132,10 +132,12 @@ class TestModelPredictorLazyLoading:
 
         predictor = ModelPredictor(sample_config["models"])
 
-        # 创建测试图片
+        # 创建测试图片（predict 会先解码图片再送入模型）
+        import cv2
         import tempfile
         fd, test_image = tempfile.mkstemp(suffix=".jpg")
         os.close(fd)
+        cv2.imwrite(test_image, np.zeros((32, 32, 3), dtype=np.uint8))
 
         try:
             # 调用 predict
@@ -214,6 +216,8 @@ class TestAIPredictorLazyLoading:
         self, mock_yaml_load, mock_hdbscan, mock_quality, mock_ocr, mock_predictor, temp_config_file
     ):
         """测试：predict_batch 不应该提前加载所有模型"""
+        import numpy as np
+
         # Mock yaml 加载
         mock_yaml_load.return_value = {
             "models": {"aircraft": {"path": "/fake/aircraft.pt", "device": "cpu"},
@@ -225,10 +229,13 @@ class TestAIPredictorLazyLoading:
 
         # 模拟 ModelPredictor
         mock_predictor_instance = MagicMock()
-        mock_predictor_instance.predict.return_value = {
-            "aircraft": {"class_name": "B738", "confidence": 0.95, "class_id": 1, "top5": []},
-            "airline": {"class_name": "CSN", "confidence": 0.93, "class_id": 1, "top5": []},
-        }
+        mock_predictor_instance.predict_many.side_effect = lambda paths: [
+            {
+                "aircraft": {"class_name": "B738", "confidence": 0.95, "class_id": 1, "top5": []},
+                "airline": {"class_name": "CSN", "confidence": 0.93, "class_id": 1, "top5": []},
+            }
+            for _ in paths
+        ]
         mock_predictor_instance.get_embeddings.return_value = None
         mock_predictor_instance.load_models = MagicMock()
         mock_predictor.return_value = mock_predictor_instance
@@ -236,15 +243,18 @@ class TestAIPredictorLazyLoading:
         # 模拟其他组件
         mock_ocr_instance = MagicMock()
         mock_ocr_instance.recognize.return_value = {"registration": "B-1234", "confidence": 0.9}
+        mock_ocr_instance.recognize_many.side_effect = lambda paths, regions=None: [
+            {"registration": "B-1234", "confidence": 0.9} for _ in paths
+        ]
         mock_ocr.return_value = mock_ocr_instance
 
         mock_quality_instance = MagicMock()
         mock_quality_instance.assess.return_value = {"score": 0.85}
+        mock_quality_instance.assess_many.side_effect = lambda paths: [{"score": 0.85} for _ in paths]
         mock_quality.return_value = mock_quality_instance
 
         mock_hdbscan_instance = MagicMock()
-        mock_hdbscan_instance.detect_new_classes.return_value = []
-        mock_hdbscan_instance.get_outlier_scores.return_value = []
+        mock_hdbscan_instance.detect_new_classes.return_value = (np.zeros(0, dtype=int), np.zeros(0))
         mock_hdbscan.return_value = mock_hdbscan_instance
 
         predictor = AIPredictor(temp_config_file)
@@ -265,8 +275,9 @@ class TestAIPredictorLazyLoading:
             assert not mock_predictor_instance.load_models.called, \
                 "predict_batch 不应该在开始时调用 load_models"
 
-            # 验证：predict 被调用（这会触发懒加载）
-            assert mock_predictor_instance.predict.call_count == 2
+            # 验证：批量推理被调用（这会触发懒加载），两张图片都有结果
+            assert mock_predictor_instance.predict_many.called
+            assert len(result["predictions"]) == 2
         finally:
             for path in test_images:
                 if os.path.exists(path):
@@ -0,0 +1,191 @@
+"""
+后台预测任务单元测试
+测试分轮进度、暂停/继续和重启后从断点继续
+"""
+
+import os
+import sys
+import time
+import threading
+import tempfile
+import pytest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from prediction_jobs import PredictionJobManager
+
+
+IMAGES = [f"/images/img_{i:03d}.jpg" for i in range(10)]
+
+
+@pytest.fixture
+def db():
+    """创建临时数据库"""
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+    database = Database(db_path)
+    yield database
+    database.close()
+    os.unlink(db_path)
+
+
+class RecordingPredictor:
+    """记录每轮预测的图片，gate 未置位时阻塞预测"""
+
+    def __init__(self):
+        self.chunks = []
+        self.entered = threading.Event()
+        self.gate = threading.Event()
+        self.gate.set()
+
+    def __call__(self, image_paths):
+        self.entered.set()
+        self.gate.wait(10)
+        self.chunks.append(list(image_paths))
+        return {"saved": len(image_paths) - 1, "duplicates": 1, "errors": 0, "new_class_count": 0}
+
+    @property
+    def predicted(self):
+        return [path for chunk in self.chunks for path in chunk]
+
+
+def wait_for(manager, predicate, timeout=10):
+    """等待任务状态满足条件"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = manager.get_status()
+        if predicate(status):
+            return status
+        time.sleep(0.02)
+    raise AssertionError(f"Prediction job did not reach expected state: {manager.get_status()}")
+
+
+class TestPredictionJobManager:
+    """后台预测任务测试"""
+
+    def test_runs_in_background_with_progress(self, db):
+        """任务在后台分轮执行，进度和断点写入数据库"""
+        predictor = RecordingPredictor()
+        predictor.gate.clear()
+        manager = PredictionJobManager(db, lambda: list(IMAGES), predictor, chunk_size=4)
+
+        status = manager.start()
+        assert status["active"]
+        assert status["job"]["trigger"] == "startup"
+
+        predictor.gate.set()
+        status = wait_for(manager, lambda s: s["job"]["status"] == "completed")
+        job = status["job"]
+        assert [len(chunk) for chunk in predictor.chunks] == [4, 4, 2]
+        assert job["total"] == 10
+        assert job["processed"] == 10
+        assert job["saved"] == 7
+        assert job["duplicates"] == 3
+        assert job["last_filename"] == "img_009.jpg"
+        assert job["completed_at"] is not None
+
+    def test_pause_and_resume(self, db):
+        """暂停在当前一轮完成后生效，继续后处理剩余图片"""
+        predictor = RecordingPredictor()
+        predictor.gate.clear()
+        manager = PredictionJobManager(db, lambda: list(IMAGES), predictor, chunk_size=4)
+
+        manager.start()
+        assert predictor.entered.wait(10)
+        assert manager.pause()
+        assert not manager.pause()
+        predictor.gate.set()
+
+        status = wait_for(manager, lambda s: s["job"]["processed"] == 4)
+        time.sleep(0.2)
+        assert len(predictor.chunks) == 1
+        assert status["job"]["status"] == "paused"
+
+        assert manager.resume()
+        assert not manager.resume()
+        status = wait_for(manager, lambda s: s["job"]["status"] == "completed")
+        assert predictor.predicted == IMAGES
+        assert status["job"]["processed"] == 10
+
+    def test_resume_from_checkpoint_after_restart(self, db):
+        """进程重启后新的任务管理从断点继续，已处理的图片不再预测"""
+        first = RecordingPredictor()
+        manager = PredictionJobManager(db, lambda: list(IMAGES), None, chunk_size=3)
+
+        def predict_then_stop(image_paths):
+            # 第一轮完成后模拟进程退出
+            result = first(image_paths)
+            manager.shutdown()
+            return result
+
+        manager.predict_chunk = predict_then_stop
+        manager.start()
+        wait_for(manager, lambda s: not s["active"])
+        job = db.get_latest_prediction_job()
+        assert job["status"] == "running"
+        assert job["processed"] == 3
+        assert job["last_filename"] == "img_002.jpg"
+
+        second = RecordingPredictor()
+        restarted = PredictionJobManager(db, lambda: list(IMAGES), second, chunk_size=3)
+        status = restarted.start()
+        assert status["job"]["id"] == job["id"]
+
+        status = wait_for(restarted, lambda s: s["job"]["status"] == "completed")
+        assert second.predicted == IMAGES[3:]
+        assert status["job"]["processed"] == 10
+        assert status["job"]["total"] == 10
+        assert status["job"]["saved"] == 6
+
+    def test_paused_job_stays_paused_after_restart(self, db):
+        """已暂停的任务重启后保持暂停，继续后从断点执行"""
+        job_id = db.create_prediction_job("startup")
+        db.update_prediction_job(job_id, status="paused", processed=5, total=10,
+                                 last_filename="img_004.jpg")
+
+        predictor = RecordingPredictor()
+        manager = PredictionJobManager(db, lambda: list(IMAGES), predictor, chunk_size=5)
+        manager.start()
+        time.sleep(0.2)
+        assert predictor.chunks == []
+        assert db.get_prediction_job(job_id)["status"] == "paused"
+
+        assert manager.resume()
+        wait_for(manager, lambda s: s["job"]["status"] == "completed")
+        assert predictor.predicted == IMAGES[5:]
+        manager.shutdown()
+
+    def test_failed_chunk_counted_as_errors(self, db):
+        """单轮预测失败时计为错误并继续下一轮"""
+        calls = []
+
+        def flaky(image_paths):
+            calls.append(image_paths)
+            if len(calls) == 1:
+                raise RuntimeError("boom")
+            return {"saved": len(image_paths)}
+
+        manager = PredictionJobManager(db, lambda: list(IMAGES), flaky, chunk_size=5)
+        manager.start(trigger="manual")
+        status = wait_for(manager, lambda s: s["job"]["status"] == "completed")
+        assert status["job"]["errors"] == 5
+        assert status["job"]["saved"] == 5
+        assert status["job"]["trigger"] == "manual"
+
+    def test_collect_failure_marks_job_failed(self, db):
+        """收集图片失败时任务标记为 failed，下次启动创建新任务"""
+        def broken():
+            raise OSError("images dir missing")
+
+        manager = PredictionJobManager(db, broken, RecordingPredictor())
+        manager.start()
+        status = wait_for(manager, lambda s: s["job"]["status"] == "failed")
+        failed_id = status["job"]["id"]
+        assert "images dir missing" in status["job"]["error_message"]
+
+        manager.collect_images = lambda: []
+        status = manager.start()
+        assert status["job"]["id"] != failed_id
+        wait_for(manager, lambda s: s["job"]["status"] == "completed")
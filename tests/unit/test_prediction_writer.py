@@ -0,0 +1,83 @@
+"""
+AI 预测结果批量写入单元测试
+测试按条数、按时间和关闭时的批量写入
+"""
+
+import os
+import sys
+import time
+import tempfile
+import pytest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+from prediction_writer import PredictionWriter
+
+
+@pytest.fixture
+def temp_db():
+    """创建临时数据库"""
+    fd, db_path = tempfile.mkstemp(suffix=".db")
+    os.close(fd)
+
+    db = Database(db_path)
+    yield db
+
+    db.close()
+    os.unlink(db_path)
+
+
+def make_prediction(filename):
+    return {
+        "filename": filename,
+        "aircraft_class": "A320",
+        "aircraft_confidence": 0.9,
+        "airline_class": "CCA",
+        "airline_confidence": 0.9,
+        "prediction_time": 0.1,
+    }
+
+
+def count_predictions(db):
+    conn = db.get_connection()
+    count = conn.execute("SELECT COUNT(*) FROM ai_predictions").fetchone()[0]
+    conn.close()
+    return count
+
+
+class TestPredictionWriter:
+    """批量写入测试"""
+
+    def test_flush_by_batch_size(self, temp_db):
+        """测试达到批量大小时写入"""
+        writer = PredictionWriter(temp_db, batch_size=3, flush_interval_ms=60000)
+        for i in range(2):
+            writer.on_prediction(i, make_prediction(f"img{i}.jpg"))
+        assert count_predictions(temp_db) == 0
+
+        writer.on_prediction(2, make_prediction("img2.jpg"))
+        assert count_predictions(temp_db) == 3
+        assert writer.saved == 3
+
+    def test_flush_on_close(self, temp_db):
+        """测试关闭时写入剩余结果并统计重复"""
+        temp_db.add_ai_prediction(make_prediction("img0.jpg"))
+
+        with PredictionWriter(temp_db, batch_size=100, flush_interval_ms=60000) as writer:
+            for i in range(3):
+                writer.add(make_prediction(f"img{i}.jpg"))
+
+        assert count_predictions(temp_db) == 3
+        assert writer.saved == 2
+        assert writer.duplicates == 1
+
+    def test_flush_by_interval(self, temp_db):
+        """测试超过时间间隔时由后台线程写入"""
+        with PredictionWriter(temp_db, batch_size=100, flush_interval_ms=50) as writer:
+            writer.add(make_prediction("img0.jpg"))
+            deadline = time.time() + 5
+            while count_predictions(temp_db) == 0 and time.time() < deadline:
+                time.sleep(0.02)
+            assert count_predictions(temp_db) == 1
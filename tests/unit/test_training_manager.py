@@ -242,6 +242,7 @@ class TestTrainingManager:
         yield db, db_path
 
         # 清理
+        db.close()
         os.unlink(db_path)
 
     def test_init_training_manager(self, temp_dirs, temp_db):
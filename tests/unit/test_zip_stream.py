@@ -0,0 +1,66 @@
+"""
+流式 ZIP 打包单元测试
+测试输出的压缩包可被正常读取
+"""
+
+import io
+import os
+import sys
+import shutil
+import zipfile
+import tempfile
+import pytest
+
+# 添加项目根目录到路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from zip_stream import iter_zip_stream
+
+
+@pytest.fixture
+def files_dir():
+    """创建包含测试文件的临时目录"""
+    path = tempfile.mkdtemp()
+    for i in range(3):
+        with open(os.path.join(path, f"img{i}.jpg"), "wb") as f:
+            f.write(os.urandom(1000 + i * 3000))
+    yield path
+    shutil.rmtree(path, ignore_errors=True)
+
+
+class TestZipStream:
+    """流式 ZIP 测试"""
+
+    def test_stream_files(self, files_dir):
+        """测试分块输出文件条目（ZIP_STORED）"""
+        missing = []
+        entries = [
+            (f"img{i}.jpg", os.path.join(files_dir, f"img{i}.jpg"), None) for i in range(3)
+        ] + [("missing.jpg", os.path.join(files_dir, "missing.jpg"), None)]
+
+        chunks = list(iter_zip_stream(entries, chunk_size=1024, missing=missing))
+        assert len(chunks) > 3
+        assert all(chunks)
+        assert missing == ["missing.jpg"]
+
+        with zipfile.ZipFile(io.BytesIO(b"".join(chunks))) as zf:
+            assert zf.testzip() is None
+            assert zf.namelist() == ["img0.jpg", "img1.jpg", "img2.jpg"]
+            for info in zf.infolist():
+                assert info.compress_type == zipfile.ZIP_STORED
+                with open(os.path.join(files_dir, info.filename), "rb") as f:
+                    assert zf.read(info) == f.read()
+
+    def test_stream_data_entries(self):
+        """测试写入内存数据条目"""
+        entries = [
+            ("a.txt", None, b"0 0.5 0.5 0.2 0.1"),
+            ("b.txt", None, b""),
+            ("c.csv", None, (f"row{i}\n".encode() for i in range(1000))),
+        ]
+        data = b"".join(iter_zip_stream(entries, compression=zipfile.ZIP_DEFLATED))
+
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            assert zf.read("a.txt") == b"0 0.5 0.5 0.2 0.1"
+            assert zf.read("b.txt") == b""
+            assert zf.read("c.csv") == b"".join(f"row{i}\n".encode() for i in range(1000))
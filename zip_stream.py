@@ -0,0 +1,110 @@
+"""
+流式 ZIP 打包
+边读文件边输出 ZIP 数据，不在内存中构建整个压缩包。
+图片本身已压缩，条目以 ZIP_STORED 存储避免无意义的 deflate；
+输出不可回退，条目大小写在数据描述符中，超过 4GB 的条目/压缩包使用 ZIP64
+"""
+
+import time
+import zipfile
+from typing import Iterable, Iterator, Optional, Tuple
+
+
+# 每次从源文件读取的字节数
+ZIP_STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+class _StreamBuffer:
+    """只写缓冲区，供 ZipFile 写入，由生成器取走已写入的数据"""
+
+    def __init__(self):
+        self._chunks = []
+        self._size = 0
+
+    def write(self, data) -> int:
+        if data:
+            self._chunks.append(bytes(data))
+            self._size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def __len__(self):
+        return self._size
+
+    def pop(self) -> bytes:
+        """取出已写入的数据"""
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self._size = 0
+        return data
+
+
+def iter_zip_stream(
+    entries: Iterable[Tuple[str, Optional[str], Optional[bytes]]],
+    chunk_size: int = ZIP_STREAM_CHUNK_SIZE,
+    compression: int = zipfile.ZIP_STORED,
+    missing: Optional[list] = None,
+) -> Iterator[bytes]:
+    """
+    生成 ZIP 数据流
+
+    Args:
+        entries: (arcname, path, data) 迭代器，path 为源文件路径，
+                 path 为 None 时写入 data：bytes 用于小的文本条目，
+                 bytes 迭代器用于边生成边写入的大条目（如 CSV）
+        chunk_size: 每次读取并输出的字节数
+        compression: 条目压缩方式（默认 ZIP_STORED）
+        missing: 传入列表时，记录不存在而被跳过的源文件 arcname
+
+    Yields:
+        ZIP 数据块
+    """
+    buffer = _StreamBuffer()
+    with zipfile.ZipFile(buffer, "w", compression=compression, allowZip64=True) as zf:
+        for arcname, path, data in entries:
+            if path is None and (data is None or isinstance(data, bytes)):
+                zf.writestr(arcname, data or b"")
+                if len(buffer) >= chunk_size:
+                    yield buffer.pop()
+                continue
+
+            if path is None:
+                # 大小未知，预先使用 ZIP64 头以免条目超过 4GB 时出错
+                zinfo = zipfile.ZipInfo(arcname, time.localtime()[:6])
+                zinfo.compress_type = compression
+                with zf.open(zinfo, "w", force_zip64=True) as dst:
+                    for block in data:
+                        dst.write(block)
+                        if len(buffer) >= chunk_size:
+                            yield buffer.pop()
+                if len(buffer):
+                    yield buffer.pop()
+                continue
+
+            try:
+                zinfo = zipfile.ZipInfo.from_file(path, arcname)
+                src = open(path, "rb")
+            except FileNotFoundError:
+                if missing is not None:
+                    missing.append(arcname)
+                continue
+
+            zinfo.compress_type = compression
+            # file_size 已由 from_file 填入，zipfile 据此决定是否使用 ZIP64
+            with src, zf.open(zinfo, "w") as dst:
+                while True:
+                    block = src.read(chunk_size)
+                    if not block:
+                        break
+                    dst.write(block)
+                    if len(buffer):
+                        yield buffer.pop()
+            # 数据描述符
+            if len(buffer):
+                yield buffer.pop()
+
+    # 中央目录
+    if len(buffer):
+        yield buffer.pop()